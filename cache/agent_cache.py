@@ -1,43 +1,557 @@
 # cache/agent_cache.py
-from functools import lru_cache
-import hashlib
+import asyncio
+import itertools
+import logging
+import time
 import redis
-import json
-from typing import Optional, Any
+import redis.asyncio as aioredis
+from collections import defaultdict
+from typing import Optional, Any, Awaitable, Callable, Dict, Iterable, List, Sequence, Set, Tuple
+
+from cache.codecs import BinaryCodec, Codec
+from cache.keys import agent_config, config_fingerprint, fast_hash
+from cache.local_cache import LocalCache
+from cache.similarity import SimilarityIndex
+from cache.single_flight import SingleFlight
+from cache.snapshot import SnapshotEntry, SnapshotReader, write_snapshot
+from config.production import ProductionConfig
+from monitoring.metrics import CacheMetrics, MetricsCollector
+
+logger = logging.getLogger(__name__)
 
 class AgentCache:
-    def __init__(self, redis_url: Optional[str] = None):
-        self.redis_client = redis.from_url(redis_url) if redis_url else None
-        self.local_cache = {}
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        redis_client: Optional[aioredis.Redis] = None,
+        max_connections: int = 50,
+        similarity_threshold: Optional[float] = None,
+        similarity_max_entries: int = 100000,
+        codec: Optional[Codec] = None,
+        snapshot_path: Optional[str] = None,
+        snapshot_interval: Optional[float] = None,
+        stale_ttl: Optional[float] = None,
+        tag_sync_interval: float = 5.0,
+        metrics_enabled: Optional[bool] = None
+    ):
+        # Uses the asyncio client so cache round-trips never block the event loop
+        if redis_client is None and redis_url:
+            redis_client = aioredis.from_url(redis_url, max_connections=max_connections)
+        self.redis_client = redis_client
+        if metrics_enabled is None:
+            metrics_enabled = ProductionConfig.CACHE_METRICS_ENABLED
+        
+        # Both tiers hold encoded bytes, so the byte budget reflects real usage
+        self.codec = codec or BinaryCodec()
+        self.local_cache = LocalCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.single_flight = SingleFlight()
+        self.counters: Dict[str, int] = defaultdict(int)
+        # Counters are exported at scrape time; only latency is observed inline
+        self.metrics = CacheMetrics(self) if metrics_enabled else None
+        
+        # Stale-while-revalidate: entries live stale_ttl seconds past their ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_seconds = 0.0
+        self._background: Set[asyncio.Task] = set()
+        
+        # Optional near-duplicate tier; exact keys are always tried first
+        self.similarity_index = None
+        if similarity_threshold is not None:
+            self.similarity_index = SimilarityIndex(
+                threshold=similarity_threshold,
+                max_entries=similarity_max_entries
+            )
+        
+        # Warm start: the previous snapshot is only mapped here and read on demand.
+        # Periodic snapshots start with the first cache operation (see start_snapshots)
+        self.snapshot_path = snapshot_path or ProductionConfig.CACHE_SNAPSHOT_PATH
+        self.snapshot_interval = (
+            ProductionConfig.CACHE_SNAPSHOT_INTERVAL if snapshot_interval is None else snapshot_interval
+        )
+        self._snapshot = SnapshotReader.open(self.snapshot_path) if self.snapshot_path else None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._snapshot_write: Optional[asyncio.Future] = None
+        self._snapshots_started = False
+        
+        # Tag versions are part of every key, so bumping one invalidates all
+        # entries for an agent or model in O(1); Redis shares them across workers
+        self.tag_sync_interval = tag_sync_interval
+        self._tag_versions: Dict[str, int] = {}
+        self._tags_synced_at = 0.0
+        if self._snapshot is not None:
+            # Snapshotted keys embed these versions; restoring them keeps invalidations
+            self._tag_versions.update(self._snapshot.tag_versions())
+    
+    def cache_key(self, agent_name: str, input_text: str, config: Any = None) -> str:
+        """Generate cache key scoped to the agent's configuration and tag versions"""
+        return fast_hash(f"{self._scope(agent_name, self._settings(config))}:{input_text}")
+    
+    async def get(self, agent_name: str, input_text: str, config: Any = None) -> Optional[Any]:
+        """Get cached result; config is the agent (or its settings dict)"""
+        timed = self.metrics is not None and self.metrics.sample()
+        start = time.perf_counter() if timed else 0.0
+        cached, _ = await self._get(agent_name, input_text, config)
+        if timed:
+            self.metrics.latency["get"].observe(time.perf_counter() - start)
+        return None if cached is None else cached[0]
+    
+    async def set(self, agent_name: str, input_text: str, result: Any, ttl: int = 3600, config: Any = None):
+        """Cache result"""
+        timed = self.metrics is not None and self.metrics.sample()
+        start = time.perf_counter() if timed else 0.0
+        self._start_snapshots()
+        settings = self._settings(config)
+        await self._sync_tags(self._tags(agent_name, settings))
+        scope = self._scope(agent_name, settings)
+        key = fast_hash(f"{scope}:{input_text}")
+        payload = self._encode(agent_name, result)
+        if payload is None:
+            return
+        ttl = self._hard_ttl(ttl)
+        
+        # Local cache
+        self._local_set(key, payload, ttl)
+        if self.similarity_index is not None:
+            self.similarity_index.add(scope, input_text, key)
+        
+        # Redis cache
+        if self.redis_client:
+            try:
+                await self.redis_client.set(key, payload, ex=ttl)
+            except redis.RedisError as e:
+                logger.warning(f"Redis set failed: {e}")
+        
+        if timed:
+            self.metrics.latency["set"].observe(time.perf_counter() - start)
     
-    def cache_key(self, agent_name: str, input_text: str) -> str:
-        """Generate cache key"""
-        content = f"{agent_name}:{input_text}"
-        return hashlib.md5(content.encode()).hexdigest()
+    async def get_or_compute(
+        self,
+        agent_name: str,
+        input_text: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: int = 3600,
+        config: Any = None
+    ) -> Any:
+        """Get cached result, or compute it once for all concurrent identical misses.
+        
+        With stale_ttl set, a value past its ttl but within the stale window is
+        returned immediately and refreshed once in the background.
+        """
+        cached, key = await self._get(agent_name, input_text, config)
+        if cached is not None:
+            result, stale = cached
+            if stale and key not in self.single_flight:
+                task = asyncio.ensure_future(self._refresh(key, agent_name, input_text, compute, ttl, config))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+            return result
+        
+        async def load() -> Any:
+            # An earlier flight for this key may have finished since our miss
+            cached = self._local_get(key)
+            if cached is not None:
+                return cached[0]
+            result = await compute()
+            if result is not None:
+                await self.set(agent_name, input_text, result, ttl=ttl, config=config)
+            return result
+        
+        return await self.single_flight.do(key, load)
     
-    async def get(self, agent_name: str, input_text: str) -> Optional[Any]:
-        """Get cached result"""
-        key = self.cache_key(agent_name, input_text)
+    async def get_many(
+        self,
+        requests: Sequence[Tuple[str, str]],
+        configs: Optional[Dict[str, Any]] = None
+    ) -> List[Optional[Any]]:
+        """Get cached results for (agent_name, input_text) pairs in one Redis round-trip.
+        
+        configs optionally maps agent names to their agent or settings dict.
+        """
+        timed = self.metrics is not None and self.metrics.sample()
+        start = time.perf_counter() if timed else 0.0
+        self._start_snapshots()
+        settings = self._settings_by_agent({name for name, _ in requests}, configs)
+        await self._sync_tags([
+            tag for agent_name, agent_settings in settings.items()
+            for tag in self._tags(agent_name, agent_settings)
+        ])
+        scopes = {agent_name: self._scope(agent_name, agent_settings) for agent_name, agent_settings in settings.items()}
+        scopes = [scopes[agent_name] for agent_name, _ in requests]
+        keys = [fast_hash(f"{scope}:{input_text}") for scope, (_, input_text) in zip(scopes, requests)]
+        found: List[Optional[Tuple[Any, bool]]] = [self._local_get(key) for key in keys]
+        
+        missing = [i for i, cached in enumerate(found) if cached is None]
+        if missing and self.redis_client:
+            for i, cached in zip(missing, await self._redis_get_many([keys[i] for i in missing])):
+                found[i] = cached
         
-        # Try local cache first
-        if key in self.local_cache:
-            return self.local_cache[key]
+        results: List[Optional[Any]] = []
+        for i, (_, input_text) in enumerate(requests):
+            cached = found[i]
+            if cached is not None:
+                self._count_hit(cached[1])
+            else:
+                cached = await self._lookup_similar(scopes[i], input_text, keys[i])
+                if cached is None:
+                    self.counters["misses"] += 1
+            results.append(None if cached is None else cached[0])
         
-        # Try Redis
+        if timed:
+            self.metrics.latency["get_many"].observe(time.perf_counter() - start)
+        return results
+    
+    async def set_many(
+        self,
+        entries: Sequence[Tuple[str, str, Any]],
+        ttl: int = 3600,
+        configs: Optional[Dict[str, Any]] = None
+    ):
+        """Cache (agent_name, input_text, result) triples with a single pipelined write"""
+        timed = self.metrics is not None and self.metrics.sample()
+        start = time.perf_counter() if timed else 0.0
+        self._start_snapshots()
+        settings = self._settings_by_agent({entry[0] for entry in entries}, configs)
+        await self._sync_tags([
+            tag for agent_name, agent_settings in settings.items()
+            for tag in self._tags(agent_name, agent_settings)
+        ])
+        scopes = {agent_name: self._scope(agent_name, agent_settings) for agent_name, agent_settings in settings.items()}
+        ttl = self._hard_ttl(ttl)
+        payloads = []
+        for agent_name, input_text, result in entries:
+            scope = scopes[agent_name]
+            key = fast_hash(f"{scope}:{input_text}")
+            payload = self._encode(agent_name, result)
+            if payload is None:
+                continue
+            self._local_set(key, payload, ttl)
+            if self.similarity_index is not None:
+                self.similarity_index.add(scope, input_text, key)
+            payloads.append((key, payload))
+        
+        if payloads and self.redis_client:
+            try:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for key, payload in payloads:
+                        pipe.set(key, payload, ex=ttl)
+                    await pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Redis pipeline set failed: {e}")
+        
+        if timed:
+            self.metrics.latency["set_many"].observe(time.perf_counter() - start)
+    
+    async def invalidate_tag(self, tag: str) -> int:
+        """Invalidate every entry carrying tag by bumping its version"""
+        version = self._tag_versions.get(tag, 0) + 1
         if self.redis_client:
-            cached = self.redis_client.get(key)
-            if cached:
-                return json.loads(cached)
+            try:
+                version = max(version, await self.redis_client.incr(self._tag_key(tag)))
+            except redis.RedisError as e:
+                logger.warning(f"Redis tag invalidation failed, applying locally: {e}")
+        self._tag_versions[tag] = version
+        return version
+    
+    async def invalidate_agent(self, agent_name: str) -> int:
+        """Invalidate all cached results of one agent"""
+        return await self.invalidate_tag(f"agent:{agent_name}")
+    
+    async def invalidate_model(self, model: str) -> int:
+        """Invalidate all cached results produced by one model"""
+        return await self.invalidate_tag(f"model:{model}")
+    
+    async def _get(
+        self,
+        agent_name: str,
+        input_text: str,
+        config: Any = None
+    ) -> Tuple[Optional[Tuple[Any, bool]], str]:
+        """Look up (result, stale) through the exact and similarity tiers, with the key used"""
+        self._start_snapshots()
+        settings = self._settings(config)
+        await self._sync_tags(self._tags(agent_name, settings))
+        scope = self._scope(agent_name, settings)
+        key = fast_hash(f"{scope}:{input_text}")
+        
+        cached = await self._lookup(key)
+        if cached is not None:
+            self._count_hit(cached[1])
+            return cached, key
+        
+        cached = await self._lookup_similar(scope, input_text, key)
+        if cached is not None:
+            return cached, key
+        
+        self.counters["misses"] += 1
+        return None, key
+    
+    async def _lookup(self, key: str) -> Optional[Tuple[Any, bool]]:
+        """Look up an exact key in the local tier, then Redis"""
+        cached = self._local_get(key)
+        if cached is not None:
+            return cached
+        
+        if self.redis_client:
+            return (await self._redis_get_many([key]))[0]
         
         return None
     
-    async def set(self, agent_name: str, input_text: str, result: Any, ttl: int = 3600):
-        """Cache result"""
-        key = self.cache_key(agent_name, input_text)
+    def _local_get(self, key: str) -> Optional[Tuple[Any, bool]]:
+        entry = self.local_cache.get_entry(key)
+        if entry is None and self._snapshot is not None:
+            entry = self._snapshot.pop(key)
+            if entry is not None:
+                self.local_cache.set(key, entry[0], ttl=entry[1], size=len(entry[0]))
+        if entry is None:
+            self.counters["local_misses"] += 1
+            return None
+        self.counters["local_hits"] += 1
+        return self.codec.decode(entry[0]), self._is_stale(entry[1])
+    
+    def _encode(self, agent_name: str, result: Any) -> Optional[bytes]:
+        """Encoded result, or None if the codec cannot serialize it (the result is left uncached)"""
+        try:
+            return self.codec.encode(result)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Not caching result of {agent_name}: {e}")
+            return None
+    
+    def _local_set(self, key: str, payload: bytes, ttl: int):
+        self.local_cache.set(key, payload, ttl=ttl, size=len(payload))
+        if self.metrics:
+            self.metrics.value_size.observe(len(payload))
+    
+    async def _redis_get_many(self, keys: List[str]) -> List[Optional[Tuple[Any, bool]]]:
+        """Fetch keys from Redis in one round-trip, with remaining TTLs when stale_ttl is set"""
+        try:
+            if self.stale_ttl is None:
+                payloads = await self.redis_client.mget(keys)
+                remaining = [None] * len(keys)
+            else:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.get(key)
+                        pipe.pttl(key)
+                    replies = await pipe.execute()
+                payloads = replies[0::2]
+                remaining = [pttl / 1000 if pttl > 0 else None for pttl in replies[1::2]]
+        except redis.RedisError as e:
+            logger.warning(f"Redis get failed, treating as miss: {e}")
+            return [None] * len(keys)
         
-        # Local cache
-        self.local_cache[key] = result
+        hits = sum(1 for payload in payloads if payload)
+        self.counters["redis_hits"] += hits
+        self.counters["redis_misses"] += len(keys) - hits
+        return [
+            (self.codec.decode(payload), self._is_stale(ttl)) if payload else None
+            for payload, ttl in zip(payloads, remaining)
+        ]
+    
+    async def _lookup_similar(self, scope: str, input_text: str, key: str) -> Optional[Tuple[Any, bool]]:
+        """Serve a near-duplicate prompt's cached result, if the similarity tier is enabled"""
+        if self.similarity_index is None:
+            return None
+        
+        match = self.similarity_index.lookup(scope, input_text)
+        if match is None or match[0] == key:
+            return None
+        
+        cached = await self._lookup(match[0])
+        if cached is not None:
+            self.counters["similar_hits"] += 1
+        return cached
+    
+    async def _refresh(
+        self,
+        key: str,
+        agent_name: str,
+        input_text: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: int,
+        config: Any = None
+    ):
+        """Recompute a stale entry; failures keep serving the stale value until hard expiry"""
+        async def refresh() -> Any:
+            start = time.perf_counter()
+            try:
+                result = await compute()
+                if result is not None:
+                    await self.set(agent_name, input_text, result, ttl=ttl, config=config)
+            except Exception as e:
+                self._record_refresh(agent_name, "error", time.perf_counter() - start)
+                logger.warning(f"Background refresh for {agent_name} failed: {e}")
+                raise
+            self._record_refresh(agent_name, "success", time.perf_counter() - start)
+            return result
+        
+        try:
+            await self.single_flight.do(key, refresh)
+        except Exception:
+            pass  # Already logged and counted
+    
+    def _record_refresh(self, agent_name: str, status: str, duration: float):
+        self.counters["refreshes" if status == "success" else "refresh_errors"] += 1
+        self.refresh_seconds += duration
+        if self.metrics:
+            MetricsCollector.record_cache_refresh(agent_name, status, duration)
+    
+    @staticmethod
+    def _settings(config: Any = None) -> Optional[Dict[str, Any]]:
+        """Effective configuration, resolved once per operation"""
+        return agent_config(config) if config is not None else None
+    
+    def _settings_by_agent(
+        self,
+        agent_names: Iterable[str],
+        configs: Optional[Dict[str, Any]]
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        configs = configs or {}
+        return {agent_name: self._settings(configs.get(agent_name)) for agent_name in agent_names}
+    
+    def _tags(self, agent_name: str, settings: Optional[Dict[str, Any]] = None) -> List[str]:
+        tags = [f"agent:{agent_name}"]
+        if settings is not None and settings.get("llm") is not None:
+            tags.append(f"model:{settings['llm']}")
+        return tags
+    
+    def _scope(self, agent_name: str, settings: Optional[Dict[str, Any]] = None) -> str:
+        """Agent name, configuration fingerprint and tag versions shared by a set of keys"""
+        tags = self._tags(agent_name, settings)
+        versions = ".".join(str(self._tag_versions.get(tag, 0)) for tag in tags)
+        fingerprint = config_fingerprint(settings) if settings is not None else ""
+        return f"{agent_name}:{fingerprint}:{versions}"
+    
+    @staticmethod
+    def _tag_key(tag: str) -> str:
+        return f"agentcache:tag:{tag}"
+    
+    async def _sync_tags(self, tags: Sequence[str]):
+        """Pick up tag versions bumped by other workers; new tags are fetched before first use"""
+        if not self.redis_client:
+            return
+        now = time.monotonic()
+        full_sync = now - self._tags_synced_at >= self.tag_sync_interval
+        names = set(tags) | set(self._tag_versions) if full_sync else {t for t in tags if t not in self._tag_versions}
+        if not names:
+            return
+        
+        names = list(names)
+        try:
+            versions = await self.redis_client.mget([self._tag_key(tag) for tag in names])
+        except redis.RedisError as e:
+            logger.warning(f"Redis tag sync failed, using local versions: {e}")
+            return
+        
+        for tag, version in zip(names, versions):
+            # Versions only move forward, so a local bump made during an outage is kept
+            self._tag_versions[tag] = max(self._tag_versions.get(tag, 0), int(version or 0))
+        if full_sync:
+            self._tags_synced_at = now
+    
+    def _count_hit(self, stale: bool):
+        self.counters["hits"] += 1
+        if stale:
+            self.counters["stale_hits"] += 1
+    
+    def _hard_ttl(self, ttl: int) -> int:
+        return ttl + int(self.stale_ttl) if self.stale_ttl else ttl
+    
+    def _is_stale(self, remaining: Optional[float]) -> bool:
+        return self.stale_ttl is not None and remaining is not None and remaining <= self.stale_ttl
+    
+    def start_snapshots(self):
+        """Persist the local tier to snapshot_path every snapshot_interval seconds.
+        
+        Called by the first cache operation, so it only needs calling
+        directly to start snapshots before any traffic.
+        """
+        self._snapshots_started = True
+        if self.snapshot_path and self.snapshot_interval > 0 and self._snapshot_task is None:
+            self._snapshot_task = asyncio.ensure_future(self._snapshot_loop())
+    
+    def _start_snapshots(self):
+        if not self._snapshots_started:
+            self.start_snapshots()
+    
+    async def save_snapshot(self) -> int:
+        """Write the local tier (plus unread warm-start entries) to snapshot_path"""
+        if not self.snapshot_path:
+            return 0
+        # One write at a time; a write outlives a cancelled caller, so wait for it
+        while self._snapshot_write is not None and not self._snapshot_write.done():
+            await asyncio.wait([self._snapshot_write])
+        # Unread warm-start payloads are copied by the writer thread, not here
+        self._snapshot_write = asyncio.ensure_future(asyncio.to_thread(
+            write_snapshot, self.snapshot_path, self._snapshot_entries(), dict(self._tag_versions)
+        ))
+        return await asyncio.shield(self._snapshot_write)
+    
+    def _snapshot_entries(self) -> Iterable[SnapshotEntry]:
+        entries = self.local_cache.items()
+        if self._snapshot is None:
+            return entries
+        live = {key for key, _, _ in entries}
+        pending = (entry for entry in self._snapshot.pending() if entry[0] not in live)
+        return itertools.chain(pending, entries)
+    
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.save_snapshot()
+            except OSError as e:
+                logger.warning(f"Cache snapshot failed: {e}")
+    
+    async def close(self):
+        """Write a final snapshot and release pooled Redis connections"""
+        for task in list(self._background):
+            task.cancel()
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            try:
+                await self._snapshot_task
+            except asyncio.CancelledError:
+                pass
+            self._snapshot_task = None
+        
+        if self.snapshot_path:
+            try:
+                await self.save_snapshot()
+            except OSError as e:
+                logger.warning(f"Cache snapshot failed: {e}")
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
         
-        # Redis cache
         if self.redis_client:
-            self.redis_client.setex(key, ttl, json.dumps(result))
\ No newline at end of file
+            await self.redis_client.aclose()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Cache usage and eviction counters"""
+        hits = self.counters["hits"]
+        similar_hits = self.counters["similar_hits"]
+        lookups = hits + similar_hits + self.counters["misses"]
+        refreshes = self.counters["refreshes"] + self.counters["refresh_errors"]
+        return {
+            "requests": {
+                "hits": hits,
+                "similar_hits": similar_hits,
+                "misses": self.counters["misses"],
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "similarity_hit_rate": similar_hits / lookups if lookups else 0.0
+            },
+            "refresh": {
+                "refreshes": self.counters["refreshes"],
+                "errors": self.counters["refresh_errors"],
+                "stale_hits": self.counters["stale_hits"],
+                "avg_latency": self.refresh_seconds / refreshes if refreshes else 0.0
+            },
+            "local": self.local_cache.stats(),
+            "single_flight": {
+                "calls": self.single_flight.calls,
+                "coalesced": self.single_flight.coalesced,
+                "inflight": len(self.single_flight)
+            }
+        }
@@ -0,0 +1,123 @@
+import json
+import lzma
+import pickle
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Tuple
+
+# Header: magic, format version, payload type, compression
+MAGIC = 0xAC
+FORMAT_VERSION = 1
+HEADER_SIZE = 4
+
+TYPE_STR = 0
+TYPE_BYTES = 1
+TYPE_JSON = 2
+TYPE_PICKLE = 3
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+
+COMPRESSORS: Dict[int, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    COMPRESSION_ZLIB: (lambda data: zlib.compress(data, 6), zlib.decompress),
+    COMPRESSION_LZMA: (lzma.compress, lzma.decompress),
+}
+
+
+class Codec(ABC):
+    """Serializes cached values to bytes and back"""
+
+    name = "codec"
+
+    @abstractmethod
+    def encode(self, value: Any) -> bytes:
+        ...
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        ...
+
+
+class JsonCodec(Codec):
+    """Plain JSON, the format AgentCache originally wrote to Redis"""
+
+    name = "json"
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class BinaryCodec(Codec):
+    """Type-tagged binary encoding with compression above a size threshold.
+
+    Strings and bytes, which is what most agent outputs are, are stored raw
+    instead of going through JSON escaping. Payloads of at least
+    ``compress_threshold`` bytes are compressed, and kept uncompressed if
+    that does not make them smaller. Every payload starts with a 4-byte
+    header so the format can evolve; data without the header is decoded
+    as legacy JSON. Pickle is only used when explicitly allowed, since it
+    must never be loaded from an untrusted Redis.
+    """
+
+    name = "binary"
+
+    def __init__(
+        self,
+        compress_threshold: int = 1024,
+        compression: int = COMPRESSION_ZLIB,
+        allow_pickle: bool = False
+    ):
+        if compression != COMPRESSION_NONE and compression not in COMPRESSORS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.compress_threshold = compress_threshold
+        self.compression = compression
+        self.allow_pickle = allow_pickle
+
+    def encode(self, value: Any) -> bytes:
+        if isinstance(value, str):
+            value_type, payload = TYPE_STR, value.encode()
+        elif isinstance(value, (bytes, bytearray)):
+            value_type, payload = TYPE_BYTES, bytes(value)
+        else:
+            try:
+                value_type, payload = TYPE_JSON, json.dumps(value, separators=(",", ":")).encode()
+            except TypeError:
+                if not self.allow_pickle:
+                    raise
+                value_type, payload = TYPE_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        compression = COMPRESSION_NONE
+        if self.compression != COMPRESSION_NONE and len(payload) >= self.compress_threshold:
+            compressed = COMPRESSORS[self.compression][0](payload)
+            if len(compressed) < len(payload):
+                compression, payload = self.compression, compressed
+
+        return bytes((MAGIC, FORMAT_VERSION, value_type, compression)) + payload
+
+    def decode(self, data: bytes) -> Any:
+        if not data or data[0] != MAGIC:
+            return json.loads(data)
+
+        version, value_type, compression = data[1], data[2], data[3]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported cache format version: {version}")
+
+        payload = data[HEADER_SIZE:]
+        if compression != COMPRESSION_NONE:
+            payload = COMPRESSORS[compression][1](payload)
+
+        if value_type == TYPE_STR:
+            return payload.decode()
+        if value_type == TYPE_BYTES:
+            return payload
+        if value_type == TYPE_JSON:
+            return json.loads(payload)
+        if value_type == TYPE_PICKLE:
+            if not self.allow_pickle:
+                raise ValueError("Refusing to unpickle cached value; allow_pickle is disabled")
+            return pickle.loads(payload)
+        raise ValueError(f"Unknown cached value type: {value_type}")
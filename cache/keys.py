@@ -0,0 +1,97 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Agent attributes that change what the agent answers for the same input
+AGENT_CONFIG_FIELDS = (
+    "llm", "temperature", "max_tokens", "role", "goal",
+    "backstory", "instructions", "tools"
+)
+
+# LLM settings that only affect how the client connects or reports, not the answer
+LLM_IGNORED_SETTINGS = frozenset({"api_key", "auth", "metrics", "max_iter", "max_retries", "timeout", "verbose"})
+
+# Answer-relevant attributes of an LLM client object
+LLM_INSTANCE_FIELDS = (
+    "temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty",
+    "seed", "stop", "response_format", "reasoning_effort", "base_url"
+)
+
+
+def fast_hash(content: str) -> str:
+    """128-bit non-cryptographic hex digest (xxh3, or blake2b if xxhash is missing)"""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(content.encode())
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def _stable(value: Any) -> Any:
+    """Reduce objects such as tool callables or LLM clients to stable identifiers"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(k): _stable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [_stable(v) for v in value]
+        return sorted(items, key=str) if isinstance(value, set) else items
+    for attr in ("model", "name", "__qualname__", "__name__"):
+        identifier = getattr(value, attr, None)
+        if isinstance(identifier, str):
+            return identifier
+    return type(value).__name__
+
+
+def _llm_settings(agent: Any) -> Optional[Dict[str, Any]]:
+    """LLM settings of a praisonaiagents Agent, whose ``llm`` holds only the model name.
+
+    They are read from the parameters the Agent builds its LLM client from,
+    or from the client itself when one was passed in. ``llm_model`` is not
+    used because reading it builds the client.
+    """
+    params = getattr(agent, "_llm_init_params", None)
+    if isinstance(params, dict):
+        return params
+    instance = getattr(agent, "_llm_instance", None)
+    if instance is None:
+        return None
+    return {field: getattr(instance, field, None) for field in LLM_INSTANCE_FIELDS}
+
+
+def agent_config(agent: Any) -> Dict[str, Any]:
+    """Effective configuration of an agent, or of a plain config dict"""
+    if isinstance(agent, dict):
+        source = dict(agent)
+    else:
+        source = {field: getattr(agent, field, None) for field in AGENT_CONFIG_FIELDS}
+        source["llm_config"] = _llm_settings(agent)
+
+    llm = source.get("llm")
+    if isinstance(llm, dict):
+        # An LLM config dict: the model is the llm, the rest are its settings
+        source["llm"] = llm.get("model")
+        source["llm_config"] = {**llm, **(source.get("llm_config") or {})}
+
+    config = {}
+    for field in AGENT_CONFIG_FIELDS:
+        value = source.get(field)
+        if value is not None:
+            config[field] = _stable(value)
+    if "tools" in config:
+        config["tools"] = sorted(config["tools"], key=str)
+    llm_config = {
+        name: value for name, value in (source.get("llm_config") or {}).items()
+        if name != "model" and name not in LLM_IGNORED_SETTINGS and value is not None
+    }
+    if llm_config:
+        config["llm_config"] = _stable(llm_config)
+    return config
+
+
+def config_fingerprint(agent: Any) -> str:
+    """Hash of an agent's effective configuration"""
+    return fast_hash(json.dumps(agent_config(agent), sort_keys=True, default=str))
@@ -0,0 +1,167 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# (value, expires_at, size_in_bytes); expires_at of 0 means no expiry
+_Entry = Tuple[Any, float, int]
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate in-memory size of a cached value in bytes"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LocalCache:
+    """Bounded in-process LRU cache with per-entry TTL and a byte budget.
+
+    All operations are O(1): entries live in an ``OrderedDict`` kept in
+    recency order, so the least recently used entry is always at the front.
+    Expired entries are dropped lazily when they are looked up or when they
+    reach the front of the eviction order.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        default_ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if max_entries <= 0 or max_bytes <= 0:
+            raise ValueError("max_entries and max_bytes must be positive")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and not self._expired(entry, self.clock())
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Return (value, remaining_ttl), or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = self.clock()
+        if self._expired(entry, now):
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1] - now if entry[1] else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, size: Optional[int] = None) -> bool:
+        """Store a value, evicting least recently used entries to make room.
+
+        Returns False if the value alone exceeds the byte budget.
+        """
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            self.rejections += 1
+            self.delete(key)
+            return False
+
+        if ttl is None:
+            ttl = self.default_ttl
+        expires_at = self.clock() + ttl if ttl else 0.0
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, expires_at, size)
+        self.current_bytes += size
+
+        while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            self._evict_oldest()
+        return True
+
+    def delete(self, key: str) -> bool:
+        """Remove an entry, returning whether it was present"""
+        if key not in self._entries:
+            return False
+        self._remove(key)
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry. O(n); intended for periodic housekeeping."""
+        now = self.clock()
+        expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def items(self) -> List[Tuple[str, Any, Optional[float]]]:
+        """Live entries as (key, value, remaining_ttl), least recently used first"""
+        now = self.clock()
+        return [
+            (key, value, expires_at - now if expires_at else None)
+            for key, (value, expires_at, _) in self._entries.items()
+            if not expires_at or expires_at > now
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters and usage for sizing the cache per worker"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "rejections": self.rejections
+        }
+
+    @staticmethod
+    def _expired(entry: _Entry, now: float) -> bool:
+        return entry[1] != 0.0 and entry[1] <= now
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def _evict_oldest(self):
+        key, entry = self._entries.popitem(last=False)
+        self.current_bytes -= entry[2]
+        if self._expired(entry, self.clock()):
+            self.expirations += 1
+        else:
+            self.evictions += 1
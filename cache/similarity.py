@@ -0,0 +1,161 @@
+import operator
+import random
+import re
+import zlib
+from collections import OrderedDict
+from itertools import repeat
+from typing import Dict, List, Optional, Set, Tuple
+
+# Dates, clock times and epoch seconds/milliseconds. Every alternative starts
+# with a digit that has no word character before it; matching that first lets
+# the regex engine skip straight to digits instead of trying every position.
+_TIMESTAMP_RE = re.compile(
+    r"\d(?<!\w\d)(?:"
+    r"\d{3}-\d{2}-\d{2}(?:[ t]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:z|[+-]\d{2}:?\d{2})?)?"
+    r"|\d?:\d{2}(?::\d{2})?(?:\s?[ap]m)?"
+    r"|\d{9}(?:\d{3})?"
+    r")\b"
+)
+_WORD_RE = re.compile(r"\w+")
+
+# (scope, canonical_text, signature, cache_key)
+_IndexEntry = Tuple[str, str, Tuple[int, ...], str]
+
+
+def canonicalize(text: str) -> str:
+    """Normalize case, whitespace, punctuation and timestamps"""
+    text = _TIMESTAMP_RE.sub(" timestamp ", text.lower())
+    return " ".join(_WORD_RE.findall(text))
+
+
+class SimilarityIndex:
+    """MinHash/LSH index mapping near-duplicate prompts to an existing cache key.
+
+    Prompts are canonicalized, split into word shingles and reduced to a
+    one-permutation MinHash signature: each shingle is hashed once and the
+    hash picks one of ``num_perm`` bins, which keep their smallest value.
+    The signature is cut into bands; prompts sharing any band land in the
+    same bucket and become candidates, which are then verified against the
+    threshold by signature agreement. Lookup cost depends on prompt length
+    and bucket size, not on the number of entries.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 2,
+        max_entries: int = 100000,
+        max_candidates: int = 32,
+        seed: int = 1
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+
+        self.seed = seed
+        # Per bin, the order in which an empty bin looks for a filled one
+        rng = random.Random(seed)
+        self._probes = [rng.sample(range(num_perm), num_perm) for _ in range(num_perm)]
+        self._entries: "OrderedDict[int, _IndexEntry]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[int]] = {}
+        self._canonical: Dict[Tuple[str, str], int] = {}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def signature(self, canonical: str) -> Tuple[int, ...]:
+        """MinHash signature of canonicalized text.
+
+        Hashing, binning and the per-bin minimum all run in C builtins, so
+        the cost is one pass over the shingles rather than one per bin.
+        """
+        words = canonical.encode().split()
+        n = self.shingle_size
+        if len(words) <= n:
+            shingles = [canonical.encode()]
+        else:
+            shingles = map(b" ".join, zip(*(words[i:] for i in range(n))))
+        # Largest first, so the last value stored per bin is its minimum
+        hashes = sorted(set(map(zlib.crc32, shingles, repeat(self.seed))), reverse=True)
+        bins = dict(zip(map(self.num_perm.__rmod__, hashes), map(self.num_perm.__rfloordiv__, hashes)))
+        if len(bins) == self.num_perm:
+            return tuple(bins[i] for i in range(self.num_perm))
+
+        # Short prompts leave bins empty; each copies the first filled bin in
+        # its own random probe order, so bands stay as selective as filled ones
+        signature = []
+        for i, probes in enumerate(self._probes):
+            value = bins.get(i)
+            if value is None:
+                value = next(bins[j] for j in probes if j in bins)
+            signature.append(value)
+        return tuple(signature)
+
+    def add(self, scope: str, text: str, key: str):
+        """Index text under scope (typically the agent name) for cache key"""
+        canonical = canonicalize(text)
+        existing = self._canonical.get((scope, canonical))
+        if existing is not None:
+            self._remove(existing)
+
+        entry_id = self._next_id
+        self._next_id += 1
+        signature = self.signature(canonical)
+        self._entries[entry_id] = (scope, canonical, signature, key)
+        self._canonical[(scope, canonical)] = entry_id
+        for band_key in self._band_keys(scope, signature):
+            self._buckets.setdefault(band_key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def lookup(self, scope: str, text: str) -> Optional[Tuple[str, float]]:
+        """Return (cache_key, similarity) of the closest match above threshold"""
+        canonical = canonicalize(text)
+        exact = self._canonical.get((scope, canonical))
+        if exact is not None:
+            return self._entries[exact][3], 1.0
+
+        signature = self.signature(canonical)
+        best_key, best_score = None, 0.0
+        seen: Set[int] = set()
+        for band_key in self._band_keys(scope, signature):
+            for entry_id in self._buckets.get(band_key, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                _, _, candidate, key = self._entries[entry_id]
+                score = sum(map(operator.eq, signature, candidate)) / self.num_perm
+                if score > best_score:
+                    best_key, best_score = key, score
+                if len(seen) >= self.max_candidates:
+                    break
+            if len(seen) >= self.max_candidates:
+                break
+
+        if best_key is None or best_score < self.threshold:
+            return None
+        return best_key, best_score
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[tuple]:
+        rows = self.rows
+        return [(scope, band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def _remove(self, entry_id: int):
+        scope, canonical, signature, _ = self._entries.pop(entry_id)
+        del self._canonical[(scope, canonical)]
+        for band_key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band_key]
@@ -0,0 +1,161 @@
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Header: magic, version, entry count, index offset, metadata length (JSON after the index)
+_HEADER = struct.Struct(">6sHIQI")
+# Index record (after the key bytes): expires_at (wall clock, 0 = never), offset, length
+_RECORD = struct.Struct(">dQI")
+_KEY_LEN = struct.Struct(">H")
+MAGIC = b"ACSNAP"
+VERSION = 2
+
+# (key, payload, remaining_ttl or None)
+SnapshotEntry = Tuple[str, bytes, Optional[float]]
+
+
+def write_snapshot(
+    path: str,
+    entries: Iterable[SnapshotEntry],
+    tag_versions: Optional[Dict[str, int]] = None
+) -> int:
+    """Atomically write entries to path; returns the number written.
+
+    Payloads are laid out back to back after the header and followed by an
+    index, so a reader can map the file and only touch the payloads it needs.
+    Tag versions are stored with them, since the keys embed those versions.
+    """
+    now = time.time()
+    index: List[Tuple[bytes, float, int, int]] = []
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        offset = _HEADER.size
+        for key, payload, ttl in entries:
+            f.write(payload)
+            index.append((key.encode(), now + ttl if ttl else 0.0, offset, len(payload)))
+            offset += len(payload)
+
+        for key, expires_at, data_offset, length in index:
+            f.write(_KEY_LEN.pack(len(key)))
+            f.write(key)
+            f.write(_RECORD.pack(expires_at, data_offset, length))
+
+        metadata = json.dumps({"tag_versions": tag_versions or {}}).encode()
+        f.write(metadata)
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, len(index), offset, len(metadata)))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return len(index)
+
+
+class SnapshotReader:
+    """Lazily serves entries from a snapshot file through a memory map.
+
+    Opening only maps the file. The index is parsed on first use and
+    payloads are copied out one at a time as keys are requested, so startup
+    never waits on reading the whole snapshot. Entries are handed out at
+    most once and expired entries are skipped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index: Optional[Dict[str, Tuple[float, int, int]]] = None
+
+    @classmethod
+    def open(cls, path: str) -> Optional["SnapshotReader"]:
+        """Open a snapshot if one exists and is readable"""
+        try:
+            if os.path.getsize(path) < _HEADER.size:
+                return None
+            return cls(path)
+        except OSError:
+            return None
+
+    def __len__(self) -> int:
+        return len(self._load_index())
+
+    def pop(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        """Take (payload, remaining_ttl) for key, or None if absent or expired"""
+        record = self._load_index().pop(key, None)
+        if record is None:
+            return None
+
+        expires_at, offset, length = record
+        ttl = None
+        if expires_at:
+            ttl = expires_at - time.time()
+            if ttl <= 0:
+                return None
+        return self._mmap[offset:offset + length], ttl
+
+    def pending(self) -> Iterator[SnapshotEntry]:
+        """Entries not yet handed out and still valid.
+
+        Only the index is copied when called. Payloads are read from the map
+        as the iterator is consumed, so ``write_snapshot`` in a worker thread
+        streams them from this file into the new one. The reader must stay
+        open until the iterator is exhausted.
+        """
+        now = time.time()
+        records = [
+            (key, record) for key, record in self._load_index().items()
+            if not record[0] or record[0] > now
+        ]
+        return self._read(records, now)
+
+    def _read(self, records: List[Tuple[str, Tuple[float, int, int]]], now: float) -> Iterator[SnapshotEntry]:
+        for key, (expires_at, offset, length) in records:
+            yield key, self._mmap[offset:offset + length], expires_at - now if expires_at else None
+
+    def tag_versions(self) -> Dict[str, int]:
+        """Tag versions in effect when the snapshot was written"""
+        magic, version, _, _, metadata_length = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION or not metadata_length:
+            return {}
+        start = len(self._mmap) - metadata_length
+        try:
+            metadata = json.loads(self._mmap[start:].decode())
+            return {str(tag): int(v) for tag, v in metadata.get("tag_versions", {}).items()}
+        except (ValueError, AttributeError):
+            return {}
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def _load_index(self) -> Dict[str, Tuple[float, int, int]]:
+        if self._index is not None:
+            return self._index
+
+        self._index = {}
+        magic, version, count, index_offset, _ = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            return self._index
+
+        index = {}
+        position = index_offset
+        try:
+            for _ in range(count):
+                (key_len,) = _KEY_LEN.unpack_from(self._mmap, position)
+                position += _KEY_LEN.size
+                key = self._mmap[position:position + key_len].decode()
+                position += key_len
+                index[key] = _RECORD.unpack_from(self._mmap, position)
+                position += _RECORD.size
+        except (struct.error, UnicodeDecodeError):
+            # Truncated or corrupt snapshot: start cold rather than fail
+            return self._index
+
+        self._index = index
+        return self._index
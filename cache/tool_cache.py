@@ -0,0 +1,123 @@
+import asyncio
+import copy
+import inspect
+import json
+import re
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from cache.keys import fast_hash
+from cache.local_cache import LocalCache
+from monitoring.metrics import tool_cache_stats_collector
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_BLANK_LINES_RE = re.compile(r"(\n[ \t]*)+\Z")
+
+# Per-tool hit/miss counters, keyed by tool name; also exported to Prometheus
+_tool_stats: Dict[str, Dict[str, int]] = {}
+
+
+def normalize_query(value: Any) -> Any:
+    """Case- and whitespace-insensitive form of a search query"""
+    if not isinstance(value, str):
+        return value
+    return _WHITESPACE_RE.sub(" ", value).strip().lower()
+
+
+def normalize_code(value: Any) -> Any:
+    """Code with line endings and trailing blank lines normalized.
+
+    Whitespace inside lines is left alone: it can sit in a multi-line string.
+    """
+    if not isinstance(value, str):
+        return value
+    return _TRAILING_BLANK_LINES_RE.sub("", value.replace("\r\n", "\n").replace("\r", "\n"))
+
+
+def _default_normalize(value: Any) -> Any:
+    return value.strip() if isinstance(value, str) else value
+
+
+def tool_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Hit/miss counters and hit rate for every cached tool"""
+    stats = {}
+    for name, counters in _tool_stats.items():
+        lookups = counters["hits"] + counters["misses"]
+        stats[name] = dict(counters, hit_rate=counters["hits"] / lookups if lookups else 0.0)
+    return stats
+
+
+def cached_tool(
+    ttl: float = 300,
+    normalize: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    deterministic: bool = True,
+    cache_if: Optional[Callable[[Any], bool]] = None,
+    max_entries: int = 1024
+):
+    """Decorator caching a tool's results by its normalized arguments.
+
+    ``normalize`` maps argument names to normalizers; other string
+    arguments are stripped. Tools marked ``deterministic=False`` are
+    returned unwrapped. ``cache_if`` can veto caching of a result, e.g.
+    error payloads. The wrapper keeps the tool's name and signature, so
+    agents see the same tool schema.
+    """
+    normalizers = normalize or {}
+
+    def decorator(func: Callable) -> Callable:
+        if not deterministic:
+            return func
+
+        signature = inspect.signature(func)
+        cache = LocalCache(max_entries=max_entries, default_ttl=ttl)
+        stats = _tool_stats.setdefault(func.__name__, {"hits": 0, "misses": 0, "uncached": 0})
+        tool_cache_stats_collector.register(func.__name__, stats)
+
+        def make_key(args, kwargs) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                name: normalizers.get(name, _default_normalize)(value)
+                for name, value in bound.arguments.items()
+            }
+            return fast_hash(json.dumps(arguments, sort_keys=True, default=str))
+
+        def lookup(key: str):
+            cached = cache.get_entry(key)
+            if cached is None:
+                stats["misses"] += 1
+                return None
+            stats["hits"] += 1
+            return cached
+
+        def store(key: str, result: Any):
+            if result is None or (cache_if is not None and not cache_if(result)):
+                stats["uncached"] += 1
+                return
+            # Store and hand out copies so callers cannot mutate the cached result
+            cache.set(key, copy.deepcopy(result))
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            cached = lookup(key)
+            if cached is not None:
+                return copy.deepcopy(cached[0])
+            result = await func(*args, **kwargs)
+            store(key, result)
+            return result
+
+        @wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            cached = lookup(key)
+            if cached is not None:
+                return copy.deepcopy(cached[0])
+            result = func(*args, **kwargs)
+            store(key, result)
+            return result
+
+        wrapper = async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
+        wrapper.cache = cache
+        return wrapper
+    return decorator
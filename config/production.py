@@ -15,11 +15,45 @@ class ProductionConfig:
     # Performance
     REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "300"))
     MAX_CONCURRENT_AGENTS = int(os.getenv("MAX_CONCURRENT_AGENTS", "10"))
+    MAX_CONCURRENT_PER_AGENT = int(os.getenv("MAX_CONCURRENT_PER_AGENT", "4"))
+    AGENT_QUEUE_DEPTH = int(os.getenv("AGENT_QUEUE_DEPTH", "100"))
+    AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", "30"))
+    # Local cache tier persisted here for warm starts; unset disables snapshots
+    CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH")
+    CACHE_SNAPSHOT_INTERVAL = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", "300"))
+    # Balancer state shared across worker processes: local, shm (one host) or redis
+    BALANCER_STATE_BACKEND = os.getenv("BALANCER_STATE_BACKEND", "local")
+    BALANCER_STATE_SHM_PATH = os.getenv("BALANCER_STATE_SHM_PATH", "/dev/shm/agent_balancer_state")
+    BALANCER_STATE_REDIS_URL = os.getenv("BALANCER_STATE_REDIS_URL", "redis://localhost:6379/0")
+    BALANCER_STATE_SYNC_INTERVAL = float(os.getenv("BALANCER_STATE_SYNC_INTERVAL", "0.2"))
+    # Seconds a worker's load counts in Redis after its last sync
+    BALANCER_STATE_TTL = float(os.getenv("BALANCER_STATE_TTL", "10"))
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))  # Max extra requests, as a fraction
+    LOAD_BALANCER_POLICY = os.getenv("LOAD_BALANCER_POLICY", "least_load")  # least_load or p2c
+    # Provider quota shared by all agents in this process
+    PROVIDER_REQUESTS_PER_MINUTE = int(os.getenv("PROVIDER_REQUESTS_PER_MINUTE", "500"))
+    PROVIDER_TOKENS_PER_MINUTE = int(os.getenv("PROVIDER_TOKENS_PER_MINUTE", "90000"))
+    
+    # Circuit breaker (per agent)
+    CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+    CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "3"))
+    CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))
+    CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
     
     # Security
     ENABLE_CONTENT_FILTERING = os.getenv("ENABLE_CONTENT_FILTERING", "true").lower() == "true"
     ALLOWED_TOOLS = os.getenv("ALLOWED_TOOLS", "").split(",")
+    SECRET_CACHE_TTL = float(os.getenv("SECRET_CACHE_TTL", "300"))
+    SECRET_REFRESH_AHEAD = float(os.getenv("SECRET_REFRESH_AHEAD", "60"))  # Seconds before expiry
+    MAX_INPUT_LENGTH = int(os.getenv("MAX_INPUT_LENGTH", "10000"))
+    # Inputs longer than this are split into chunks scanned in a process pool
+    VALIDATION_CHUNK_SIZE = int(os.getenv("VALIDATION_CHUNK_SIZE", "1000000"))
+    RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
     
     # Monitoring
     TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
-    TELEMETRY_ENDPOINT = os.getenv("TELEMETRY_ENDPOINT")
\ No newline at end of file
+    TELEMETRY_ENDPOINT = os.getenv("TELEMETRY_ENDPOINT")
+    CACHE_METRICS_ENABLED = os.getenv("CACHE_METRICS_ENABLED", "true").lower() == "true"
\ No newline at end of file
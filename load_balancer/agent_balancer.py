@@ -1,39 +1,475 @@
 # load_balancer/agent_balancer.py
-from typing import List, Optional
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import heapq
+import logging
 import random
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from praisonaiagents import Agent
+from config.production import ProductionConfig
+from load_balancer.circuit_breaker import CircuitBreaker, CircuitState
+from load_balancer.policies import SelectionPolicy, make_policy
+from load_balancer.state_backend import StateBackend, make_state_backend
+from monitoring.metrics import MetricsCollector
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept for the hedge percentile, and the minimum before hedging starts
+HEDGE_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+HEDGE_REFRESH_EVERY = 10
+# Unused hedge budget saved up for bursts of slow requests
+HEDGE_BURST = 5.0
+
+class AgentOverloadedError(Exception):
+    """Raised when the waiting queue is full or a queued request times out"""
+
+@dataclass
+class BatchResult:
+    """Outcome of one task submitted through execute_many"""
+    index: int
+    task: str
+    result: Any = None
+    error: Optional[Exception] = None
+    
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 class AgentLoadBalancer:
-    def __init__(self, agents: List[Agent]):
-        self.agents = agents
+    def __init__(
+        self,
+        agents: List[Agent],
+        clock: Callable[[], float] = time.monotonic,
+        policy: Optional[SelectionPolicy] = None,
+        max_concurrent: Optional[int] = None,
+        max_per_agent: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_budget: Optional[float] = None,
+        state_backend: Optional[StateBackend] = None,
+        state_sync_interval: Optional[float] = None
+    ):
+        self.agents = list(agents)
+        self.clock = clock
+        # Concurrency caps; requests beyond them wait in a bounded FIFO queue
+        self.max_concurrent = max_concurrent or ProductionConfig.MAX_CONCURRENT_AGENTS
+        self.max_per_agent = max_per_agent or ProductionConfig.MAX_CONCURRENT_PER_AGENT
+        self.max_queue = ProductionConfig.AGENT_QUEUE_DEPTH if max_queue is None else max_queue
+        self.queue_timeout = ProductionConfig.AGENT_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        
+        # Hedging: duplicate a request to another agent once it runs past the
+        # rolling latency percentile, spending at most hedge_budget extra requests
+        if hedge_percentile is None and ProductionConfig.HEDGE_ENABLED:
+            hedge_percentile = ProductionConfig.HEDGE_PERCENTILE
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = ProductionConfig.HEDGE_BUDGET if hedge_budget is None else hedge_budget
+        self.hedge_counters: Dict[str, int] = defaultdict(int)
+        self._latencies: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self._hedge_delay: Optional[float] = None
+        self._hedge_tokens = 0.0
         self.agent_loads = defaultdict(int)
-        self.agent_errors = defaultdict(int)
-    
-    def select_agent(self) -> Optional[Agent]:
-        """Select agent with least load"""
-        available_agents = [
-            agent for agent in self.agents
-            if self.agent_errors[agent.name] < 3  # Skip agents with many errors
-        ]
+        self.agent_errors = defaultdict(int)  # Consecutive errors, for reporting
         
-        if not available_agents:
-            return None
+        # Load and open circuits of other worker processes; local changes are
+        # batched and exchanged with the backend every state_sync_interval
+        self.state_backend = state_backend or make_state_backend()
+        self.state_sync_interval = state_sync_interval or ProductionConfig.BALANCER_STATE_SYNC_INTERVAL
+        self.remote_loads = defaultdict(int)
+        self._pending_deltas: Dict[str, int] = defaultdict(int)
+        self._pending_opened: Dict[str, float] = {}
+        self._state_task: Optional[asyncio.Task] = None
         
-        # Select agent with minimum load
-        return min(available_agents, key=lambda a: self.agent_loads[a.name])
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._agents_by_name = {agent.name: agent for agent in self.agents}
+        # Agents with a closed circuit and spare capacity only; selection never scans every replica
+        self.policy = policy or make_policy(ProductionConfig.LOAD_BALANCER_POLICY)
+        for name in self._agents_by_name:
+            self.policy.add(name)
+        # Agents with an open circuit, as (retry_at, name), kept out of the load heap
+        self._parked: List[Tuple[float, str]] = []
+        self._parked_until: Dict[str, float] = {}
+        for name in self._agents_by_name:
+            self._breaker(name)
+    
+    def add_agent(self, agent: Agent):
+        """Register an agent replica"""
+        if agent.name in self._agents_by_name:
+            self.remove_agent(agent.name)
+        self.agents.append(agent)
+        self._agents_by_name[agent.name] = agent
+        if not self._breaker(agent.name).available:
+            self._park(agent.name)
+        elif self.agent_loads[agent.name] < self.max_per_agent:
+            self.policy.add(agent.name, self._effective_load(agent.name))
+            self._dispatch_waiters()
+    
+    def remove_agent(self, agent_name: str) -> bool:
+        """Deregister an agent; requests already running on it finish normally"""
+        agent = self._agents_by_name.pop(agent_name, None)
+        if agent is None:
+            return False
+        self.agents.remove(agent)
+        self.policy.remove(agent_name)
+        return True
+    
+    def select_agent(self, exclude: Optional[str] = None) -> Optional[Agent]:
+        """Select agent with least load"""
+        self._unpark()
+        name = self.policy.select()
+        if name is not None and name == exclude:
+            # Hide the excluded agent for one selection
+            self.policy.remove(exclude)
+            name = self.policy.select()
+            self.policy.add(exclude, self._effective_load(exclude))
+        return None if name is None else self._agents_by_name[name]
     
     async def execute_with_balancing(self, task: str) -> Any:
-        agent = self.select_agent()
-        if not agent:
-            raise Exception("No available agents")
+        agent = await self._acquire()
+        if self.hedge_percentile is None:
+            return await self._run(agent, task)
         
-        self.agent_loads[agent.name] += 1
+        self._hedge_tokens = min(self._hedge_tokens + self.hedge_budget, HEDGE_BURST)
+        primary = asyncio.ensure_future(self._run(agent, task))
+        contenders = {primary}
+        try:
+            delay = self._hedge_delay
+            if delay is None or (await asyncio.wait(contenders, timeout=delay))[0]:
+                return await primary
+            
+            # Hedges never queue: only use an agent that is free right now
+            hedge_agent = self._claim(exclude=agent.name) if self._hedge_tokens >= 1 else None
+            if hedge_agent is None:
+                return await primary
+            self._hedge_tokens -= 1
+            self.hedge_counters["hedged"] += 1
+            hedge = asyncio.ensure_future(self._run(hedge_agent, task))
+            contenders.add(hedge)
+            
+            # First success wins; if both fail, report the primary's error
+            pending = contenders
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if not finished.cancelled() and finished.exception() is None:
+                        if finished is hedge:
+                            self.hedge_counters["hedge_wins"] += 1
+                        MetricsCollector.record_hedge("hedge" if finished is hedge else "primary")
+                        return finished.result()
+            MetricsCollector.record_hedge("failed")
+            # A contender cancelled underneath us has no error of its own to report
+            return (hedge if primary.cancelled() else primary).result()
+        finally:
+            # Covers every exit, including our own cancellation: gather waits for the
+            # cancelled losers to release their slots before the cancellation propagates
+            for contender in contenders:
+                contender.cancel()
+            await asyncio.gather(*contenders, return_exceptions=True)
+    
+    async def _run(self, agent: Agent, task: str) -> Any:
+        """Call an agent on a slot already claimed for it"""
+        breaker = self.breakers[agent.name]
+        start = time.perf_counter()
         try:
             result = await agent.arun(task)
+            duration = time.perf_counter() - start
+            self.policy.record_latency(agent.name, duration)
+            if self.hedge_percentile is not None:
+                self._record_latency(duration)
             self.agent_errors[agent.name] = 0  # Reset error count on success
+            breaker.record_success()
             return result
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
         except Exception as e:
             self.agent_errors[agent.name] += 1
+            breaker.record_failure()
+            raise
+        finally:
+            self._release(agent.name)
+    
+    async def execute_many(self, tasks: Sequence[str], max_concurrency: Optional[int] = None) -> List[BatchResult]:
+        """Run a batch across the pool; results come back in input order.
+        
+        A failing task is reported in its BatchResult and does not cancel the others.
+        """
+        results: List[Optional[BatchResult]] = [None] * len(tasks)
+        async for item in self.iter_many(tasks, max_concurrency):
+            results[item.index] = item
+        return results
+    
+    async def iter_many(
+        self,
+        tasks: Sequence[str],
+        max_concurrency: Optional[int] = None
+    ) -> AsyncIterator[BatchResult]:
+        """Run a batch across the pool, yielding each BatchResult as it completes.
+        
+        At most max_concurrency tasks (default: the global cap) are submitted at
+        once, so a large batch never floods the waiting queue.
+        """
+        fan_out = min(max_concurrency or self.max_concurrent, len(tasks))
+        if fan_out <= 0:
+            return
+        
+        pending = iter(enumerate(tasks))
+        completed: asyncio.Queue = asyncio.Queue()
+        
+        async def worker():
+            for index, task in pending:
+                try:
+                    item = BatchResult(index, task, result=await self.execute_with_balancing(task))
+                except Exception as e:
+                    item = BatchResult(index, task, error=e)
+                completed.put_nowait(item)
+        
+        workers = [asyncio.ensure_future(worker()) for _ in range(fan_out)]
+        try:
+            for _ in range(len(tasks)):
+                yield await completed.get()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    async def _acquire(self) -> Agent:
+        """Claim a slot on an agent, queueing while the pool is at capacity"""
+        if not self._waiters:
+            agent = self._claim()
+            if agent is not None:
+                return agent
+        
+        # Nothing selectable and nothing running that could free a slot
+        if self.inflight == 0 and self.select_agent() is None:
+            raise Exception("No available agents")
+        if len(self._waiters) >= self.max_queue:
+            raise AgentOverloadedError(f"Agent queue is full ({self.max_queue} waiting)")
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._dispatch_waiters()  # A slot may have opened without a release, e.g. after a cooldown
+        try:
+            return await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise AgentOverloadedError(f"No agent slot within {self.queue_timeout}s") from None
+        except asyncio.CancelledError:
+            # A slot may have been handed over just as we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self._release(waiter.result().name)
             raise
         finally:
-            self.agent_loads[agent.name] -= 1
\ No newline at end of file
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+    
+    def _claim(self, exclude: Optional[str] = None) -> Optional[Agent]:
+        """Take a slot on the selected agent, or return None if the pool is at capacity"""
+        if self.inflight >= self.max_concurrent:
+            return None
+        while True:
+            agent = self.select_agent(exclude)
+            if agent is None:
+                return None
+            breaker = self.breakers[agent.name]
+            if breaker.allow_request():
+                break
+            # Selectable but refused, e.g. its probe slots were taken: drop it and pick again
+            self.policy.remove(agent.name)
+            self._sync_availability(agent.name)
+        
+        self.inflight += 1
+        self._adjust_load(agent.name, 1)
+        if not breaker.available or self.agent_loads[agent.name] >= self.max_per_agent:
+            # At its cap, or half-open probe slots are taken: rejoin once a call finishes
+            self.policy.remove(agent.name)
+        return agent
+    
+    def _record_latency(self, duration: float):
+        """Add a latency sample; the hedge delay is recomputed every few samples"""
+        self._latencies.append(duration)
+        self.hedge_counters["samples"] += 1
+        count = len(self._latencies)
+        if count >= HEDGE_MIN_SAMPLES and self.hedge_counters["samples"] % HEDGE_REFRESH_EVERY == 0:
+            ordered = sorted(self._latencies)
+            self._hedge_delay = ordered[min(count - 1, int(self.hedge_percentile * count))]
+    
+    def _release(self, agent_name: str):
+        self.inflight -= 1
+        self._adjust_load(agent_name, -1)
+        self._sync_availability(agent_name)
+        self._dispatch_waiters()
+    
+    def _dispatch_waiters(self):
+        """Hand freed slots to queued requests in arrival order"""
+        while self._waiters:
+            if self._waiters[0].done():
+                self._waiters.popleft()  # Timed out or cancelled
+                continue
+            agent = self._claim()
+            if agent is None:
+                return
+            self._waiters.popleft().set_result(agent)
+    
+    def _breaker(self, agent_name: str) -> CircuitBreaker:
+        breaker = self.breakers.get(agent_name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                agent_name,
+                failure_rate=ProductionConfig.CIRCUIT_FAILURE_RATE,
+                window=ProductionConfig.CIRCUIT_WINDOW_SECONDS,
+                min_calls=ProductionConfig.CIRCUIT_MIN_CALLS,
+                cooldown=ProductionConfig.CIRCUIT_COOLDOWN_SECONDS,
+                half_open_max_calls=ProductionConfig.CIRCUIT_HALF_OPEN_CALLS,
+                clock=self.clock,
+                on_state_change=self._on_circuit_change
+            )
+            self.breakers[agent_name] = breaker
+        return breaker
+    
+    def _on_circuit_change(self, agent_name: str, previous: CircuitState, state: CircuitState):
+        if state == CircuitState.OPEN:
+            logger.warning(f"Circuit for {agent_name} opened after {previous.value}")
+            if self.state_backend is not None:
+                remaining = self.breakers[agent_name].open_until - self.clock()
+                self._pending_opened[agent_name] = time.time() + remaining
+        else:
+            logger.info(f"Circuit for {agent_name} is {state.value}")
+        MetricsCollector.record_circuit_transition(agent_name, previous.value, state.value)
+    
+    def _sync_availability(self, agent_name: str):
+        """Move an agent between the load heap and the parked set after its breaker changed"""
+        if agent_name not in self._agents_by_name:
+            return
+        breaker = self.breakers[agent_name]
+        if breaker.state == CircuitState.OPEN:
+            self.policy.remove(agent_name)
+            self._park(agent_name)
+        elif (
+            breaker.available
+            and self.agent_loads[agent_name] < self.max_per_agent
+            and agent_name not in self.policy
+        ):
+            self.policy.add(agent_name, self._effective_load(agent_name))
+    
+    def _park(self, agent_name: str):
+        retry_at = self.breakers[agent_name].open_until
+        if self._parked_until.get(agent_name) != retry_at:
+            self._parked_until[agent_name] = retry_at
+            heapq.heappush(self._parked, (retry_at, agent_name))
+    
+    def _unpark(self):
+        """Return agents whose cooldown has elapsed to the load heap for probing"""
+        now = self.clock()
+        while self._parked and self._parked[0][0] <= now:
+            retry_at, name = heapq.heappop(self._parked)
+            if self._parked_until.get(name) == retry_at:
+                del self._parked_until[name]
+            if name in self._agents_by_name and name not in self.policy and self.breakers[name].available:
+                if self.agent_loads[name] < self.max_per_agent:
+                    self.policy.add(name, self._effective_load(name))
+    
+    def _adjust_load(self, agent_name: str, delta: int):
+        self.agent_loads[agent_name] += delta
+        if self.state_backend is not None:
+            self._pending_deltas[agent_name] += delta
+        if agent_name in self.policy:
+            self.policy.update_load(agent_name, self._effective_load(agent_name))
+    
+    def _effective_load(self, agent_name: str) -> int:
+        """In-flight requests on an agent across all processes sharing state"""
+        return self.agent_loads[agent_name] + self.remote_loads[agent_name]
+    
+    def start_state_sync(self):
+        """Periodically exchange load and circuit state with the shared backend"""
+        if self.state_backend is not None and self._state_task is None:
+            self._state_task = asyncio.ensure_future(self._state_sync_loop())
+    
+    async def sync_state(self):
+        """Push batched local changes and pull other processes' load and open circuits"""
+        if self.state_backend is None:
+            return
+        deltas, self._pending_deltas = self._pending_deltas, defaultdict(int)
+        opened, self._pending_opened = self._pending_opened, {}
+        try:
+            loads, open_until = await self.state_backend.sync(
+                list(self._agents_by_name), {name: d for name, d in deltas.items() if d}, opened
+            )
+        except Exception:
+            # Keep the changes for the next attempt
+            for name, delta in deltas.items():
+                self._pending_deltas[name] += delta
+            for name, until in opened.items():
+                self._pending_opened[name] = max(self._pending_opened.get(name, 0.0), until)
+            raise
+        
+        for name, load in loads.items():
+            # Changes made while the sync was in flight are not in the shared count yet
+            own = self.agent_loads[name] - self._pending_deltas[name]
+            self.remote_loads[name] = max(0, load - own)
+            if name in self.policy:
+                self.policy.update_load(name, self._effective_load(name))
+        
+        wall_now, now = time.time(), self.clock()
+        for name, until in open_until.items():
+            breaker = self.breakers.get(name)
+            remaining = until - wall_now
+            if breaker is None or remaining <= 0:
+                continue
+            if breaker.state != CircuitState.OPEN or breaker.open_until < now + remaining - 1.0:
+                # Another process saw this agent fail; stop sending it traffic here too
+                breaker.force_open(now + remaining)
+                self._sync_availability(name)
+    
+    async def _state_sync_loop(self):
+        while True:
+            await asyncio.sleep(self.state_sync_interval)
+            try:
+                await self.sync_state()
+            except Exception as e:
+                logger.warning(f"Balancer state sync failed: {e}")
+    
+    async def close(self):
+        """Stop syncing, flush pending changes and release the state backend"""
+        if self._state_task is not None:
+            self._state_task.cancel()
+            try:
+                await self._state_task
+            except asyncio.CancelledError:
+                pass
+            self._state_task = None
+        if self.state_backend is not None:
+            try:
+                await self.sync_state()
+            except Exception as e:
+                logger.warning(f"Balancer state sync failed: {e}")
+            await self.state_backend.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Per-agent load, consecutive errors and circuit state"""
+        agents = {
+            name: {
+                "load": self.agent_loads[name],
+                "remote_load": self.remote_loads[name],
+                "errors": self.agent_errors[name],
+                "circuit": self.breakers[name].stats()
+            }
+            for name in self._agents_by_name
+        }
+        return {
+            "inflight": self.inflight,
+            "queued": sum(not waiter.done() for waiter in self._waiters),
+            "hedging": {
+                "delay": self._hedge_delay,
+                "hedged": self.hedge_counters["hedged"],
+                "hedge_wins": self.hedge_counters["hedge_wins"]
+            },
+            "agents": agents
+        }
\ No newline at end of file
@@ -0,0 +1,146 @@
+import time
+from collections import deque
+from enum import Enum
+from typing import Callable, Deque, Optional, Tuple
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+
+class CircuitBreaker:
+    """Per-agent circuit breaker with a time-based failure-rate window.
+
+    CLOSED: calls flow; the breaker opens when at least ``min_calls``
+    outcomes in the last ``window`` seconds have a failure rate of
+    ``failure_rate`` or more.
+    OPEN: calls are refused until ``cooldown`` seconds have passed.
+    HALF_OPEN: up to ``half_open_max_calls`` probes run at a time; that many
+    successes close the breaker, any failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        window: float = 60.0,
+        min_calls: int = 3,
+        cooldown: float = 30.0,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        on_state_change: Optional[Callable[[str, CircuitState, CircuitState], None]] = None
+    ):
+        if not 0 < failure_rate <= 1:
+            raise ValueError("failure_rate must be in (0, 1]")
+        if min_calls <= 0 or half_open_max_calls <= 0:
+            raise ValueError("min_calls and half_open_max_calls must be positive")
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self.on_state_change = on_state_change
+
+        self.state = CircuitState.CLOSED
+        self.open_until = 0.0
+        # (timestamp, failed) outcomes inside the window, oldest first
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would currently be let through, without claiming it"""
+        if self.state == CircuitState.OPEN:
+            return self.clock() >= self.open_until
+        if self.state == CircuitState.HALF_OPEN:
+            return self._probes < self.half_open_max_calls
+        return True
+
+    def allow_request(self) -> bool:
+        """Claim permission for one call; in half-open this takes a probe slot"""
+        if self.state == CircuitState.OPEN:
+            if self.clock() < self.open_until:
+                return False
+            self._transition(CircuitState.HALF_OPEN)
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                return False
+            self._probes += 1
+        return True
+
+    def record_success(self):
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes == 0:
+                return  # Outcome of a call started before the breaker opened
+            self._probes -= 1
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_max_calls:
+                self._transition(CircuitState.CLOSED)
+        elif self.state == CircuitState.CLOSED:
+            self._record(False)
+
+    def record_failure(self):
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes == 0:
+                return
+            self._probes -= 1
+            self._open()
+        elif self.state == CircuitState.CLOSED:
+            self._record(True)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and self._failures >= self.failure_rate * calls:
+                self._open()
+
+    def release(self):
+        """Give back a probe slot for a call that ended without an outcome, e.g. cancelled"""
+        if self.state == CircuitState.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def force_open(self, until: float):
+        """Open the breaker until the given clock time"""
+        self.open_until = max(self.open_until, until)
+        if self.state != CircuitState.OPEN:
+            self._transition(CircuitState.OPEN)
+
+    def stats(self) -> dict:
+        self._prune(self.clock())
+        return {
+            "state": self.state.value,
+            "calls": len(self._outcomes),
+            "failures": self._failures,
+            "open_until": self.open_until
+        }
+
+    def _record(self, failed: bool):
+        now = self.clock()
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        self._prune(now)
+
+    def _prune(self, now: float):
+        horizon = now - self.window
+        outcomes = self._outcomes
+        while outcomes and outcomes[0][0] <= horizon:
+            _, failed = outcomes.popleft()
+            self._failures -= failed
+
+    def _open(self):
+        self.open_until = self.clock() + self.cooldown
+        self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState):
+        previous = self.state
+        self.state = state
+        self._probes = 0
+        self._probe_successes = 0
+        if state == CircuitState.CLOSED:
+            self._outcomes.clear()
+            self._failures = 0
+        if self.on_state_change is not None and previous != state:
+            self.on_state_change(self.name, previous, state)
@@ -0,0 +1,66 @@
+import heapq
+import itertools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (load, sequence, name); the sequence breaks ties in insertion order
+_HeapEntry = Tuple[int, int, str]
+
+
+class LoadHeap:
+    """Min-heap of agent loads with lazy updates.
+
+    Changing a load pushes a new entry instead of re-sifting the old one;
+    entries whose load no longer matches the agent's current load are
+    discarded when they reach the top. Selection and updates are O(log n)
+    amortized, and the heap is rebuilt once stale entries outnumber live ones.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._heap: List[_HeapEntry] = []
+        self._loads: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self._loads)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._loads
+
+    def add(self, name: str, load: int = 0):
+        """Track an agent, or reset the load of one already tracked"""
+        self.update(name, load)
+
+    def remove(self, name: str) -> bool:
+        """Stop tracking an agent; its heap entries are dropped lazily"""
+        return self._loads.pop(name, None) is not None
+
+    def load(self, name: str) -> Optional[int]:
+        return self._loads.get(name)
+
+    def update(self, name: str, load: int):
+        self._loads[name] = load
+        heapq.heappush(self._heap, (load, next(self._sequence), name))
+        if len(self._heap) > 2 * len(self._loads) + 64:
+            self._compact()
+
+    def increment(self, name: str, delta: int = 1) -> int:
+        """Adjust a tracked agent's load by delta and return the new load"""
+        load = self._loads[name] + delta
+        self.update(name, load)
+        return load
+
+    def peek(self) -> Optional[str]:
+        """Name of the least loaded agent, or None if no agents are tracked"""
+        heap = self._heap
+        while heap:
+            load, _, name = heap[0]
+            if self._loads.get(name) == load:
+                return name
+            heapq.heappop(heap)
+        return None
+
+    def _compact(self):
+        self._heap = [(load, next(self._sequence), name) for name, load in self._loads.items()]
+        heapq.heapify(self._heap)
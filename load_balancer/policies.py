@@ -0,0 +1,145 @@
+import random
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from load_balancer.load_heap import LoadHeap
+
+
+class SelectionPolicy(ABC):
+    """Strategy for picking an agent among those currently available.
+
+    The balancer adds and removes agents as their circuits open and close,
+    reports every change in in-flight load, and reports the latency of each
+    successful call.
+    """
+
+    @abstractmethod
+    def __contains__(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def add(self, name: str, load: int = 0):
+        ...
+
+    @abstractmethod
+    def remove(self, name: str):
+        ...
+
+    @abstractmethod
+    def update_load(self, name: str, load: int):
+        ...
+
+    def record_latency(self, name: str, seconds: float):
+        pass
+
+    @abstractmethod
+    def select(self) -> Optional[str]:
+        ...
+
+
+class LeastLoadPolicy(SelectionPolicy):
+    """Fewest in-flight requests, via a lazily updated min-heap"""
+
+    def __init__(self):
+        self.heap = LoadHeap()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.heap
+
+    def add(self, name: str, load: int = 0):
+        self.heap.add(name, load)
+
+    def remove(self, name: str):
+        self.heap.remove(name)
+
+    def update_load(self, name: str, load: int):
+        self.heap.update(name, load)
+
+    def select(self) -> Optional[str]:
+        return self.heap.peek()
+
+
+class PowerOfTwoChoicesPolicy(SelectionPolicy):
+    """Better of two random agents by expected completion time.
+
+    Each agent's latency is tracked as an exponentially weighted moving
+    average; the expected completion time is that latency times the queue
+    the request would join, (in-flight + 1). Agents without a latency
+    sample are assumed to match the pool average and win ties, so new
+    replicas get measured. Selection and updates are O(1).
+    """
+
+    def __init__(self, alpha: float = 0.3, rng: Optional[random.Random] = None):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.rng = rng or random.Random()
+        self.latency: Dict[str, float] = {}
+        self._latency_total = 0.0
+        self._loads: Dict[str, int] = {}
+        # Names in a list for O(1) sampling; removal swaps with the last element
+        self._names: List[str] = []
+        self._positions: Dict[str, int] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._positions
+
+    def add(self, name: str, load: int = 0):
+        if name not in self._positions:
+            self._positions[name] = len(self._names)
+            self._names.append(name)
+        self._loads[name] = load
+
+    def remove(self, name: str):
+        position = self._positions.pop(name, None)
+        if position is None:
+            return
+        last = self._names.pop()
+        if last != name:
+            self._names[position] = last
+            self._positions[last] = position
+        del self._loads[name]
+
+    def update_load(self, name: str, load: int):
+        if name in self._loads:
+            self._loads[name] = load
+
+    def record_latency(self, name: str, seconds: float):
+        previous = self.latency.get(name)
+        current = seconds if previous is None else previous + self.alpha * (seconds - previous)
+        self.latency[name] = current
+        self._latency_total += current - (previous or 0.0)
+
+    def score(self, name: str) -> float:
+        """Expected completion time of a new request on this agent"""
+        latency = self.latency.get(name)
+        if latency is None:
+            latency = self._latency_total / len(self.latency) if self.latency else 1.0
+        return latency * (self._loads[name] + 1)
+
+    def select(self) -> Optional[str]:
+        names = self._names
+        if len(names) < 2:
+            return names[0] if names else None
+        first = self.rng.randrange(len(names))
+        second = self.rng.randrange(len(names) - 1)
+        if second >= first:
+            second += 1
+        a, b = names[first], names[second]
+        rank_a = (self.score(a), a in self.latency)
+        rank_b = (self.score(b), b in self.latency)
+        return a if rank_a <= rank_b else b
+
+
+POLICIES = {
+    "least_load": LeastLoadPolicy,
+    "p2c": PowerOfTwoChoicesPolicy
+}
+
+
+def make_policy(name: str) -> SelectionPolicy:
+    """Build a policy by its configured name"""
+    try:
+        return POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown load balancing policy: {name}") from None
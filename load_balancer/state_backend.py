@@ -0,0 +1,412 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+import redis
+import redis.asyncio as aioredis
+
+from config.production import ProductionConfig
+
+logger = logging.getLogger(__name__)
+
+# (cluster-wide load per agent, open_until per agent as wall-clock time)
+SharedState = Tuple[Dict[str, int], Dict[str, float]]
+
+
+class StateBackend(ABC):
+    """Agent load counters and circuit open times shared between balancers.
+
+    Balancers batch their changes and exchange them in one ``sync`` call:
+    ``deltas`` are load changes since the last sync, ``opened`` maps agents
+    whose circuit opened to the wall-clock time it stays open. The returned
+    state covers ``names`` and includes the caller's own contribution.
+    """
+
+    @abstractmethod
+    async def sync(
+        self,
+        names: Sequence[str],
+        deltas: Dict[str, int],
+        opened: Dict[str, float]
+    ) -> SharedState:
+        ...
+
+    async def close(self):
+        pass
+
+
+class LocalStateBackend(StateBackend):
+    """In-process state; the default, and the fallback when a shared backend fails"""
+
+    def __init__(self):
+        self.loads: Dict[str, int] = defaultdict(int)
+        self.open_until: Dict[str, float] = {}
+
+    async def sync(self, names, deltas, opened) -> SharedState:
+        self.apply(deltas, opened)
+        return (
+            {name: self.loads[name] for name in names},
+            {name: self.open_until[name] for name in names if name in self.open_until}
+        )
+
+    def apply(self, deltas: Dict[str, int], opened: Dict[str, float]):
+        for name, delta in deltas.items():
+            self.loads[name] += delta
+        for name, until in opened.items():
+            self.open_until[name] = max(self.open_until.get(name, 0.0), until)
+
+
+def _process_start(pid: int) -> int:
+    """Start time of a process in clock ticks since boot, or 0 where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # Fields after the parenthesised command name; starttime is the 22nd field
+            return int(f.read().rsplit(b")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _process_alive(pid: int, started: int) -> bool:
+    """Whether pid is still the process that registered, not a reused pid"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    current = _process_start(pid)
+    return not (started and current) or current == started
+
+
+class SharedMemoryStateBackend(StateBackend):
+    """State for all worker processes on one host, in a memory-mapped file.
+
+    The file holds a table of registered workers (pid, start time) and a
+    fixed open-addressing table of (key digest, open_until, load per worker)
+    slots. Each worker only writes its own load column, and columns of
+    workers that died without closing (e.g. SIGKILL) are zeroed and freed
+    every ``reap_interval`` seconds, so they leave no phantom load. Each
+    sync runs in a thread under an exclusive ``lockf`` on the file, so
+    updates from different processes are atomic and waiting for another
+    worker's lock does not block the event loop.
+    """
+
+    _HEADER = struct.Struct("8sQQ")
+    _WORKER = struct.Struct("qq")
+    _LOAD = struct.Struct("q")
+    _UNTIL = struct.Struct("d")
+    # Offsets within a slot: open_until follows the key digest, then the load columns
+    _UNTIL_AT = 16
+    _LOADS_AT = 24
+    MAGIC = b"AGENTLB2"
+
+    def __init__(
+        self,
+        path: str = "/dev/shm/agent_balancer_state",
+        slots: int = 4096,
+        workers: int = 64,
+        reap_interval: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.path = path
+        self.slots = slots
+        self.workers = workers
+        self.reap_interval = reap_interval
+        self.clock = clock
+        self._slot = struct.Struct(f"16sd{workers}q")
+        self._table = self._HEADER.size + workers * self._WORKER.size
+        size = self._table + slots * self._slot.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._mmap = mmap.mmap(self._fd, size)
+            magic, existing_slots, existing_workers = self._HEADER.unpack_from(self._mmap, 0)
+            if magic != self.MAGIC:
+                self._mmap[:size] = bytes(size)
+                self._HEADER.pack_into(self._mmap, 0, self.MAGIC, slots, workers)
+            elif (existing_slots, existing_workers) != (slots, workers):
+                raise ValueError(
+                    f"{path} was created with {existing_slots} slots and {existing_workers} workers, "
+                    f"not {slots} and {workers}"
+                )
+            self._reap()
+            self._column = self._register()
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._reaped_at = clock()
+        self._offsets: Dict[str, int] = {}
+        # lockf only excludes other processes; this excludes our own threads
+        self._lock = threading.Lock()
+
+    async def sync(self, names, deltas, opened) -> SharedState:
+        return await asyncio.to_thread(self._sync, names, deltas, opened)
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+    def _sync(self, names, deltas, opened) -> SharedState:
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                return self._apply(names, deltas, opened)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _apply(self, names, deltas, opened) -> SharedState:
+        """Apply changes and read shared state (caller holds the lock)"""
+        now = self.clock()
+        if now - self._reaped_at >= self.reap_interval:
+            self._reap()
+            self._reaped_at = now
+        own = self._LOADS_AT + self._column * self._LOAD.size
+        for name, delta in deltas.items():
+            offset = self._offset(name) + own
+            load, = self._LOAD.unpack_from(self._mmap, offset)
+            self._LOAD.pack_into(self._mmap, offset, load + delta)
+        for name, opened_until in opened.items():
+            offset = self._offset(name) + self._UNTIL_AT
+            until, = self._UNTIL.unpack_from(self._mmap, offset)
+            self._UNTIL.pack_into(self._mmap, offset, max(until, opened_until))
+
+        loads, open_until = {}, {}
+        for name in names:
+            _, until, *columns = self._slot.unpack_from(self._mmap, self._offset(name))
+            loads[name] = sum(columns)
+            if until:
+                open_until[name] = until
+        return loads, open_until
+
+    def _close(self):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self._release(self._column)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            self._mmap.close()
+            os.close(self._fd)
+
+    def _register(self) -> int:
+        """Claim a free worker column for this process (caller holds the lock)"""
+        for column in range(self.workers):
+            offset = self._HEADER.size + column * self._WORKER.size
+            pid, _ = self._WORKER.unpack_from(self._mmap, offset)
+            if not pid:
+                self._WORKER.pack_into(self._mmap, offset, os.getpid(), _process_start(os.getpid()))
+                return column
+        raise OSError(f"Shared balancer state {self.path} is full ({self.workers} workers)")
+
+    def _reap(self):
+        """Free the columns of workers that exited without closing (caller holds the lock)"""
+        for column in range(self.workers):
+            pid, started = self._WORKER.unpack_from(self._mmap, self._HEADER.size + column * self._WORKER.size)
+            if pid and pid != os.getpid() and not _process_alive(pid, started):
+                logger.info(f"Dropping balancer load of exited worker {pid}")
+                self._release(column)
+
+    def _release(self, column: int):
+        """Zero a worker's load in every slot and free its column (caller holds the lock)"""
+        own = self._LOADS_AT + column * self._LOAD.size
+        for slot in range(self.slots):
+            offset = self._table + slot * self._slot.size
+            if self._mmap[offset:offset + 16] != bytes(16):
+                self._LOAD.pack_into(self._mmap, offset + own, 0)
+        self._WORKER.pack_into(self._mmap, self._HEADER.size + column * self._WORKER.size, 0, 0)
+
+    def _offset(self, name: str) -> int:
+        """Slot offset for name, claiming an empty slot on first use (caller holds the lock)"""
+        offset = self._offsets.get(name)
+        if offset is not None:
+            return offset
+
+        key = hashlib.blake2b(name.encode(), digest_size=16).digest()
+        start = int.from_bytes(key[:8], "big") % self.slots
+        for probe in range(self.slots):
+            offset = self._table + (start + probe) % self.slots * self._slot.size
+            slot_key = self._mmap[offset:offset + 16]
+            if slot_key == key:
+                break
+            if slot_key == bytes(16):
+                self._mmap[offset:offset + 16] = key
+                break
+        else:
+            raise OSError(f"Shared balancer state {self.path} is full ({self.slots} agents)")
+        self._offsets[name] = offset
+        return offset
+
+
+class RedisStateBackend(StateBackend):
+    """State shared across hosts in Redis.
+
+    Each worker keeps its own load per agent in a ``<prefix>:loads:<host>:<pid>``
+    hash that every sync rewrites and expires after ``ttl`` seconds, and
+    registers in a ``<prefix>:workers`` sorted set scored by that deadline.
+    The cluster load is the sum over live workers, so a worker that dies
+    without closing stops counting once its TTL passes. Open times live in
+    one ``<prefix>:open_until`` hash that only moves forward.
+    """
+
+    # HSET that only moves an agent's open_until forward
+    _OPEN_SCRIPT = """
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+    if tonumber(ARGV[2]) > current then
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    end
+    return 0
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        redis_url: Optional[str] = None,
+        prefix: str = "agentlb",
+        ttl: Optional[float] = None,
+        worker_id: Optional[str] = None
+    ):
+        self.redis_client = redis_client or aioredis.from_url(redis_url)
+        self.ttl = ProductionConfig.BALANCER_STATE_TTL if ttl is None else ttl
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.prefix = prefix
+        self.workers_key = f"{prefix}:workers"
+        self.own_key = self._loads_key(self.worker_id)
+        self.open_key = f"{prefix}:open_until"
+        # This worker's contribution; Redis holds a copy that expires with the worker
+        self.loads: Dict[str, int] = defaultdict(int)
+
+    async def sync(self, names, deltas, opened) -> SharedState:
+        names = list(names)
+        loads = dict(self.loads)
+        for name, delta in deltas.items():
+            loads[name] = loads.get(name, 0) + delta
+        ttl_ms, now = int(self.ttl * 1000), time.time()
+
+        # Transactional, so a failed sync applies nothing and can be replayed safely
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            if loads:
+                pipe.hset(self.own_key, mapping=loads)
+                pipe.pexpire(self.own_key, ttl_ms)
+            pipe.zadd(self.workers_key, {self.worker_id: now + self.ttl})
+            pipe.pexpire(self.workers_key, ttl_ms)
+            pipe.zremrangebyscore(self.workers_key, "-inf", now)
+            for name, until in opened.items():
+                pipe.eval(self._OPEN_SCRIPT, 1, self.open_key, name, repr(until))
+            pipe.zrange(self.workers_key, 0, -1)
+            if names:
+                pipe.hmget(self.open_key, names)
+            replies = await pipe.execute()
+        self.loads.update(loads)
+
+        if not names:
+            return {}, {}
+        workers = [worker.decode() if isinstance(worker, bytes) else worker for worker in replies[-2]]
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for worker in workers:
+                pipe.hmget(self._loads_key(worker), names)
+            worker_loads = await pipe.execute()
+
+        totals = {name: 0 for name in names}
+        for values in worker_loads:
+            for name, value in zip(names, values):
+                totals[name] += int(value or 0)
+        open_until = {name: float(value) for name, value in zip(names, replies[-1]) if value}
+        return totals, open_until
+
+    async def close(self):
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.delete(self.own_key)
+                pipe.zrem(self.workers_key, self.worker_id)
+                await pipe.execute()
+        except (OSError, redis.RedisError) as e:
+            logger.warning(f"Could not remove balancer load of {self.worker_id}, it expires in {self.ttl}s: {e}")
+        finally:
+            await self.redis_client.aclose()
+
+    def _loads_key(self, worker: str) -> str:
+        return f"{self.prefix}:loads:{worker}"
+
+
+class FallbackStateBackend(StateBackend):
+    """Use a shared backend, falling back to process-local state while it fails.
+
+    Changes made during an outage are kept and replayed once the shared
+    backend answers again, so cluster counters do not drift. ``primary``
+    may be a callable that creates the backend; it is then created on the
+    first sync, off the event loop, and a failure to create it is handled
+    like any other outage.
+    """
+
+    def __init__(
+        self,
+        primary: Union[StateBackend, Callable[[], StateBackend]],
+        retry_interval: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if isinstance(primary, StateBackend):
+            self.primary, self._create_primary = primary, None
+        else:
+            self.primary, self._create_primary = None, primary
+        self.local = LocalStateBackend()
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.degraded_until = 0.0
+        self._unsynced_deltas: Dict[str, int] = defaultdict(int)
+        self._unsynced_opened: Dict[str, float] = {}
+
+    @property
+    def degraded(self) -> bool:
+        return self.clock() < self.degraded_until
+
+    async def sync(self, names, deltas, opened) -> SharedState:
+        self.local.apply(deltas, opened)
+        for name, delta in deltas.items():
+            self._unsynced_deltas[name] += delta
+        for name, until in opened.items():
+            self._unsynced_opened[name] = max(self._unsynced_opened.get(name, 0.0), until)
+
+        if not self.degraded:
+            pending = {name: delta for name, delta in self._unsynced_deltas.items() if delta}
+            try:
+                if self.primary is None:
+                    self.primary = await asyncio.to_thread(self._create_primary)
+                state = await self.primary.sync(names, pending, dict(self._unsynced_opened))
+            except (OSError, ValueError, redis.RedisError) as e:
+                logger.warning(f"Shared balancer state unavailable, using local state: {e}")
+                self.degraded_until = self.clock() + self.retry_interval
+            else:
+                self._unsynced_deltas.clear()
+                self._unsynced_opened.clear()
+                self.degraded_until = 0.0
+                return state
+
+        loads = {name: self.local.loads[name] for name in names}
+        open_until = {name: self.local.open_until[name] for name in names if name in self.local.open_until}
+        return loads, open_until
+
+    async def close(self):
+        if self.primary is not None:
+            await self.primary.close()
+
+
+def make_state_backend(kind: Optional[str] = None) -> Optional[StateBackend]:
+    """Configured shared backend wrapped in a local fallback, or None for process-local state"""
+    kind = kind or ProductionConfig.BALANCER_STATE_BACKEND
+    if kind == "local":
+        return None
+    if kind == "shm":
+        return FallbackStateBackend(lambda: SharedMemoryStateBackend(ProductionConfig.BALANCER_STATE_SHM_PATH))
+    if kind == "redis":
+        return FallbackStateBackend(RedisStateBackend(redis_url=ProductionConfig.BALANCER_STATE_REDIS_URL))
+    raise ValueError(f"Unknown balancer state backend: {kind}")
@@ -21,6 +21,8 @@ from praisonaiagents.tools import (
     lint_code, disassemble_code
 )
 
+from cache.tool_cache import cached_tool, normalize_code, normalize_query
+
 
 from praisonaiagents import (
     register_display_callback,
@@ -64,6 +66,7 @@ api_key = os.getenv("OPENAI_API_KEY") or input("Enter OpenAI (Compatible if usin
 
 
 # 1. Define the tool
+@cached_tool(ttl=3600, normalize={"query": normalize_query})
 def internet_search_tool(query: str):
     results = []
     ddgs = DDGS()
@@ -76,6 +79,11 @@ def internet_search_tool(query: str):
     return results
 
 
+@cached_tool(
+    ttl=600,
+    normalize={"code": normalize_code},
+    cache_if=lambda result: not (isinstance(result, dict) and "error" in result)
+)
 def code_interpreter(code: str):
     print(f"\n{'='*50}\n> Running following AI-generated code:\n{code}\n{'='*50}")
     exec_result = Sandbox().run_code(code)
@@ -93,6 +101,14 @@ def code_interpreter(code: str):
         return json.dumps({"results": results, "logs": logs})
 
 
+# Static analysis tools are pure functions of the code; execute_code runs
+# arbitrary code with side effects and stays uncached
+analyze_code = cached_tool(ttl=3600, normalize={"code": normalize_code})(analyze_code)
+format_code = cached_tool(ttl=3600, normalize={"code": normalize_code})(format_code)
+lint_code = cached_tool(ttl=3600, normalize={"code": normalize_code})(lint_code)
+disassemble_code = cached_tool(ttl=3600, normalize={"code": normalize_code})(disassemble_code)
+
+
 def create_chat_interface():
     # Initialize agent
 
@@ -1,12 +1,135 @@
 # monitoring/metrics.py
-from prometheus_client import Counter, Histogram, Gauge
+from prometheus_client import Counter, Histogram, Gauge, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from collections import defaultdict
+from typing import Any, Dict
 import time
+import weakref
 
 # Define metrics
 agent_requests = Counter('agent_requests_total', 'Total agent requests', ['agent_name', 'status'])
 agent_latency = Histogram('agent_request_duration_seconds', 'Agent request latency', ['agent_name'])
 active_agents = Gauge('active_agents', 'Number of active agents')
 token_usage = Counter('token_usage_total', 'Total tokens used', ['model', 'agent_name'])
+cache_refreshes = Counter('cache_refreshes_total', 'Background stale-while-revalidate refreshes', ['agent_name', 'status'])
+cache_refresh_latency = Histogram('cache_refresh_duration_seconds', 'Background cache refresh latency', ['agent_name'])
+circuit_transitions = Counter(
+    'agent_circuit_transitions_total', 'Agent circuit breaker state transitions', ['agent_name', 'from_state', 'to_state']
+)
+circuit_state = Gauge('agent_circuit_state', 'Agent circuit breaker state (0 closed, 1 half-open, 2 open)', ['agent_name'])
+hedged_requests = Counter('agent_hedged_requests_total', 'Hedged agent requests by winner', ['winner'])
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+cache_latency = Histogram(
+    'cache_operation_duration_seconds', 'Cache operation latency (sampled)', ['operation'],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+cache_value_size = Histogram(
+    'cache_value_size_bytes', 'Encoded size of cached values',
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+
+class CacheStatsCollector:
+    """Exports cache counters at scrape time.
+    
+    Caches count hits, misses and evictions in plain ints; reading them
+    here keeps Prometheus locking off the lookup path.
+    """
+    
+    # (tier, result) -> AgentCache.counters key
+    REQUEST_COUNTERS = {
+        ("local", "hit"): "local_hits",
+        ("local", "miss"): "local_misses",
+        ("redis", "hit"): "redis_hits",
+        ("redis", "miss"): "redis_misses",
+        ("similarity", "hit"): "similar_hits",
+        ("any", "stale"): "stale_hits",
+    }
+    
+    def __init__(self):
+        self.caches = weakref.WeakSet()
+        # Counts of collected caches, so exported totals never go backwards
+        self._retired: Dict[str, int] = defaultdict(int)
+    
+    def register(self, cache: Any):
+        self.caches.add(cache)
+        weakref.finalize(cache, self._retire, cache.counters, cache.local_cache)
+    
+    def _retire(self, counters: Dict[str, int], local_cache: Any):
+        for counter in self.REQUEST_COUNTERS.values():
+            self._retired[counter] += counters[counter]
+        self._retired["evictions"] += local_cache.evictions
+        self._retired["expirations"] += local_cache.expirations
+    
+    def collect(self):
+        requests = CounterMetricFamily('cache_requests', 'Cache lookups by tier and result', labels=['tier', 'result'])
+        evictions = CounterMetricFamily('cache_evictions', 'Local cache tier removals', labels=['reason'])
+        local_bytes = GaugeMetricFamily('cache_local_bytes', 'Bytes held by the local cache tier')
+        
+        caches = list(self.caches)
+        for (tier, result), counter in self.REQUEST_COUNTERS.items():
+            total = self._retired[counter] + sum(cache.counters[counter] for cache in caches)
+            requests.add_metric([tier, result], total)
+        evictions.add_metric(
+            ["capacity"], self._retired["evictions"] + sum(cache.local_cache.evictions for cache in caches)
+        )
+        evictions.add_metric(
+            ["expired"], self._retired["expirations"] + sum(cache.local_cache.expirations for cache in caches)
+        )
+        local_bytes.add_metric([], sum(cache.local_cache.current_bytes for cache in caches))
+        
+        yield requests
+        yield evictions
+        yield local_bytes
+
+cache_stats_collector = CacheStatsCollector()
+REGISTRY.register(cache_stats_collector)
+
+class CacheMetrics:
+    """Per-cache metric handles; latency is observed for one in sample_every operations"""
+    
+    def __init__(self, cache: Any, sample_every: int = 10):
+        self.latency = {
+            operation: cache_latency.labels(operation=operation)
+            for operation in ("get", "set", "get_many", "set_many")
+        }
+        self.value_size = cache_value_size
+        self.sample_every = sample_every
+        self._operations = 0
+        cache_stats_collector.register(cache)
+    
+    def sample(self) -> bool:
+        """Whether to time the current operation"""
+        self._operations += 1
+        return self._operations % self.sample_every == 0
+
+class ToolCacheStatsCollector:
+    """Exports per-tool cache counters at scrape time, off the tool call path"""
+    
+    def __init__(self):
+        # Tool name -> the hits/misses/uncached dict its cached_tool wrapper updates
+        self.tools: Dict[str, Dict[str, int]] = {}
+    
+    def register(self, tool_name: str, counters: Dict[str, int]):
+        self.tools[tool_name] = counters
+    
+    def collect(self):
+        requests = CounterMetricFamily('tool_cache_requests', 'Tool cache lookups by result', labels=['tool', 'result'])
+        uncached = CounterMetricFamily('tool_cache_uncached', 'Tool results not cached (None or vetoed)', labels=['tool'])
+        hit_ratio = GaugeMetricFamily('tool_cache_hit_ratio', 'Share of tool cache lookups that hit', labels=['tool'])
+        
+        for tool_name, counters in list(self.tools.items()):
+            hits, misses = counters["hits"], counters["misses"]
+            requests.add_metric([tool_name, "hit"], hits)
+            requests.add_metric([tool_name, "miss"], misses)
+            uncached.add_metric([tool_name], counters["uncached"])
+            hit_ratio.add_metric([tool_name], hits / (hits + misses) if hits + misses else 0.0)
+        
+        yield requests
+        yield uncached
+        yield hit_ratio
+
+tool_cache_stats_collector = ToolCacheStatsCollector()
+REGISTRY.register(tool_cache_stats_collector)
 
 class MetricsCollector:
     @staticmethod
@@ -19,4 +142,18 @@ class MetricsCollector:
     
     @staticmethod
     def record_tokens(model: str, agent_name: str, tokens: int):
-        token_usage.labels(model=model, agent_name=agent_name).inc(tokens)
\ No newline at end of file
+        token_usage.labels(model=model, agent_name=agent_name).inc(tokens)
+    
+    @staticmethod
+    def record_cache_refresh(agent_name: str, status: str, duration: float):
+        cache_refreshes.labels(agent_name=agent_name, status=status).inc()
+        cache_refresh_latency.labels(agent_name=agent_name).observe(duration)
+    
+    @staticmethod
+    def record_circuit_transition(agent_name: str, from_state: str, to_state: str):
+        circuit_transitions.labels(agent_name=agent_name, from_state=from_state, to_state=to_state).inc()
+        circuit_state.labels(agent_name=agent_name).set(CIRCUIT_STATE_VALUES[to_state])
+    
+    @staticmethod
+    def record_hedge(winner: str):
+        hedged_requests.labels(winner=winner).inc()
\ No newline at end of file
@@ -0,0 +1,177 @@
+# optimization/context_packer.py
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+CHUNK_SEPARATOR = "\n\n"
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms; snake_case identifiers split into their words"""
+    return _TERM_RE.findall(text.lower())
+
+
+def split_chunks(context: str) -> List[str]:
+    """Split markdown into blank-line separated blocks, keeping fenced code blocks whole"""
+    chunks, lines = [], []
+    in_fence = False
+    for line in context.split("\n"):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        if not line.strip() and not in_fence:
+            if lines:
+                chunks.append("\n".join(lines))
+                lines = []
+            continue
+        lines.append(line)
+    if in_fence:
+        # A fence that is never closed (e.g. output cut off mid-block) would
+        # otherwise swallow the rest of the document into one chunk
+        return chunks + _split_blank_lines(lines)
+    if lines:
+        chunks.append("\n".join(lines))
+    return chunks
+
+
+def _split_blank_lines(lines: List[str]) -> List[str]:
+    chunks, block = [], []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            chunks.append("\n".join(block))
+            block = []
+    if block:
+        chunks.append("\n".join(block))
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of documents"""
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(freqs.values()) for freqs in self.term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+        doc_freqs = Counter()
+        for freqs in self.term_freqs:
+            doc_freqs.update(freqs.keys())
+        count = len(documents)
+        self.idf = {
+            term: math.log(1 + (count - freq + 0.5) / (freq + 0.5))
+            for term, freq in doc_freqs.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """Score of every document against the query, in document order"""
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = []
+        for freqs, length in zip(self.term_freqs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            score = 0.0
+            for term in terms:
+                freq = freqs.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            scores.append(score)
+        return scores
+
+
+@dataclass
+class PackedContext:
+    """Context packed into a token budget; kept and dropped are chunk indexes"""
+    text: str
+    chunks: List[str]
+    kept: List[int] = field(default_factory=list)
+    dropped: List[int] = field(default_factory=list)
+
+    @property
+    def dropped_chunks(self) -> List[str]:
+        return [self.chunks[i] for i in self.dropped]
+
+
+def pack_context(
+    query: str,
+    context: str,
+    budget: int,
+    count_tokens: Callable[[str], int],
+    separator_tokens: int = 1,
+    truncate: Optional[Callable[[str, int], str]] = None
+) -> PackedContext:
+    """Fill the budget with the chunks most relevant to the query, kept in original order.
+
+    Blocks larger than the whole budget are split into lines, and lines
+    into sentences. Chunks are taken greedily by BM25 score, ties in
+    document order, and any chunk that no longer fits is skipped in favour
+    of smaller ones. If nothing fits, the best chunk is cut to the budget
+    with ``truncate`` when one is given.
+    """
+    pieces = _split_oversized(split_chunks(context), budget, count_tokens)
+    chunks = [text for text, _, _ in pieces]
+    scores = BM25Index(chunks).scores(query)
+    ranked = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+
+    kept, remaining = [], budget
+    for i in ranked:
+        if remaining <= separator_tokens:
+            break
+        cost = pieces[i][2] + (separator_tokens if kept else 0)
+        if cost <= remaining:
+            kept.append(i)
+            remaining -= cost
+
+    kept.sort()
+    parts = []
+    for position, i in enumerate(kept):
+        if position:
+            # Neighbouring pieces of one block keep their original separator
+            parts.append(pieces[i][1] if kept[position - 1] == i - 1 else CHUNK_SEPARATOR)
+        parts.append(chunks[i])
+    text = "".join(parts)
+
+    if not kept and chunks and truncate is not None and budget > 0:
+        kept = [ranked[0]]
+        text = truncate(chunks[ranked[0]], budget)
+
+    kept_set = set(kept)
+    return PackedContext(
+        text=text,
+        chunks=chunks,
+        kept=kept,
+        dropped=[i for i in range(len(chunks)) if i not in kept_set]
+    )
+
+
+def _split_oversized(
+    chunks: List[str],
+    budget: int,
+    count_tokens: Callable[[str], int]
+) -> List[Tuple[str, str, int]]:
+    """(text, separator before it, tokens) per piece, splitting blocks that exceed the budget"""
+    pieces = []
+    for chunk in chunks:
+        tokens = count_tokens(chunk)
+        if tokens <= budget:
+            pieces.append((chunk, CHUNK_SEPARATOR, tokens))
+            continue
+        separator = CHUNK_SEPARATOR
+        for line in chunk.split("\n"):
+            if line.strip():
+                tokens = count_tokens(line)
+                if tokens <= budget:
+                    pieces.append((line, separator, tokens))
+                else:
+                    for sentence in _SENTENCE_RE.split(line):
+                        if sentence:
+                            pieces.append((sentence, separator, count_tokens(sentence)))
+                            separator = " "
+            separator = "\n"
+    return pieces
@@ -1,34 +1,85 @@
 # optimization/token_optimizer.py
+import logging
+from functools import lru_cache
+from typing import Any, List, Optional
 import tiktoken
 
+from optimization.context_packer import PackedContext, pack_context
+
+logger = logging.getLogger(__name__)
+
+# How an overflowing context is cut down: leading sentences, or the chunks most relevant to the prompt
+STRATEGIES = ("truncate", "relevance")
+
 class TokenOptimizer:
-    def __init__(self, model: str = "gpt-4"):
-        self.encoder = tiktoken.encoding_for_model(model)
+    # Text rarely runs longer than this per token, so one prefix encode usually suffices
+    CHARS_PER_TOKEN = 8
+    
+    def __init__(self, model: str = "gpt-4", encoder: Optional[Any] = None):
+        self.encoder = encoder or tiktoken.encoding_for_model(model)
         self.max_tokens = 8000  # Leave room for response
+        # Per instance; the same prompts come back on every request
+        self.count_tokens = lru_cache(maxsize=1024)(self._count_tokens)
     
-    def optimize_prompt(self, prompt: str, context: str) -> str:
+    def optimize_prompt(self, prompt: str, context: str, strategy: str = "truncate") -> str:
         """Optimize prompt to fit within token limits"""
-        prompt_tokens = len(self.encoder.encode(prompt))
-        context_tokens = len(self.encoder.encode(context))
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown context strategy: {strategy}")
+        prompt_tokens = self.count_tokens(prompt)
+        # Enough of the context to tell whether it fits, and to cut it if not
+        context_tokens = self.encode_prefix(context, self.max_tokens - prompt_tokens + 1)
         
-        total_tokens = prompt_tokens + context_tokens
+        total_tokens = prompt_tokens + len(context_tokens)
         
         if total_tokens <= self.max_tokens:
             return f"{prompt}\n\nContext: {context}"
         
         # Truncate context to fit
         available_tokens = self.max_tokens - prompt_tokens - 50  # Buffer
-        context_parts = context.split('. ')
-        
-        optimized_context = ""
-        current_tokens = 0
+        if strategy == "relevance":
+            packed = self.pack_context(prompt, context, available_tokens)
+            if packed.dropped:
+                logger.info(
+                    f"Context packing dropped {len(packed.dropped)} of {len(packed.chunks)} chunks: {packed.dropped}"
+                )
+            return f"{prompt}\n\nContext (relevant excerpts): {packed.text}"
+        optimized_context = self.truncate(context_tokens, available_tokens)
         
-        for part in context_parts:
-            part_tokens = len(self.encoder.encode(part))
-            if current_tokens + part_tokens <= available_tokens:
-                optimized_context += part + ". "
-                current_tokens += part_tokens
-            else:
-                break
+        return f"{prompt}\n\nContext (truncated): {optimized_context}"
+    
+    def pack_context(self, prompt: str, context: str, budget: Optional[int] = None) -> PackedContext:
+        """Chunks of context most relevant to the prompt that fit the budget, with those dropped"""
+        if budget is None:
+            budget = self.max_tokens - self.count_tokens(prompt) - 50
+        return pack_context(
+            prompt, context, budget, self._count_tokens,
+            truncate=lambda text, limit: self.truncate(self.encoder.encode(text), limit)
+        )
+    
+    def encode_prefix(self, text: str, min_tokens: int) -> List[int]:
+        """Tokens of text, or of a prefix of it that holds at least min_tokens tokens"""
+        window = max(min_tokens, 1) * self.CHARS_PER_TOKEN
+        while window < len(text):
+            tokens = self.encoder.encode(text[:window])
+            if len(tokens) >= min_tokens:
+                # Only the last few tokens can differ from encoding the whole text,
+                # and truncation drops them with the buffer
+                return tokens
+            window *= 2
+        return self.encoder.encode(text)
+    
+    def truncate(self, tokens: List[int], limit: int) -> str:
+        """Text of the first limit tokens, cut back to the last sentence boundary"""
+        if limit <= 0:
+            return ""
         
-        return f"{prompt}\n\nContext (truncated): {optimized_context}"
\ No newline at end of file
+        # A cut inside a multi-byte character decodes to replacement characters
+        text = self.encoder.decode(tokens[:limit]).rstrip("\ufffd")
+        boundary = text.rfind(". ")
+        if boundary == -1:
+            # No sentence ends within the budget; keep the token-level cut
+            return text
+        return text[:boundary + 2]
+    
+    def _count_tokens(self, text: str) -> int:
+        return len(self.encoder.encode(text))
\ No newline at end of file
@@ -1,26 +1,130 @@
 # security/key_manager.py
+import logging
 import os
-from cryptography.fernet import Fernet
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from cryptography.fernet import Fernet, InvalidToken
 import boto3
-from typing import Optional
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from config.production import ProductionConfig
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CachedSecret:
+    value: Optional[str]
+    refresh_at: float
+    expires_at: float
 
 class SecureKeyManager:
-    def __init__(self, use_aws_secrets: bool = False):
+    """API keys from Secrets Manager or encrypted environment variables, cached in memory.
+    
+    A cached key is served until ``ttl`` passes. In the last ``refresh_ahead``
+    seconds before that it is refreshed in the background, so callers do not
+    wait on the secrets backend. Concurrent loads of one key share a single
+    backend call, and when a load fails the last good value is kept and
+    retried after ``retry_interval``. A key that has never loaded returns
+    None until its retry is due. Undecryptable environment keys raise
+    ``InvalidToken`` as they always have.
+    """
+    
+    def __init__(
+        self,
+        use_aws_secrets: bool = False,
+        secrets_client: Any = None,
+        ttl: Optional[float] = None,
+        refresh_ahead: Optional[float] = None,
+        retry_interval: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
         self.use_aws_secrets = use_aws_secrets
         self.fernet = Fernet(os.getenv("ENCRYPTION_KEY", Fernet.generate_key()))
+        self.ttl = ProductionConfig.SECRET_CACHE_TTL if ttl is None else ttl
+        refresh_ahead = ProductionConfig.SECRET_REFRESH_AHEAD if refresh_ahead is None else refresh_ahead
+        self.refresh_ahead = min(refresh_ahead, self.ttl)
+        self.retry_interval = retry_interval
+        self.clock = clock
         
         if use_aws_secrets:
-            self.secrets_client = boto3.client('secretsmanager')
+            self.secrets_client = secrets_client or boto3.client('secretsmanager')
+        
+        self._cache: Dict[str, CachedSecret] = {}
+        # Keys that have never loaded, with when the backend may be tried again
+        self._retry_at: Dict[str, float] = {}
+        # Loads in progress per key, shared by every caller that needs one
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
     
     def get_api_key(self, key_name: str) -> Optional[str]:
         """Securely retrieve API key"""
-        if self.use_aws_secrets:
-            try:
-                response = self.secrets_client.get_secret_value(SecretId=key_name)
-                return response['SecretString']
-            except Exception as e:
-                logger.error(f"Failed to retrieve secret: {e}")
+        entry = self._cache.get(key_name)
+        if entry is None:
+            if self.clock() < self._retry_at.get(key_name, 0.0):
                 return None
+            self._load(key_name).result()
+        else:
+            now = self.clock()
+            if now >= entry.expires_at:
+                self._load(key_name).result()
+            elif now >= entry.refresh_at:
+                self._load(key_name)
+        
+        entry = self._cache.get(key_name)
+        return entry.value if entry else None
+    
+    def invalidate(self, key_name: str):
+        """Drop a cached key, e.g. after the provider rejects it"""
+        self._cache.pop(key_name, None)
+    
+    def close(self):
+        """Stop the background refresh threads"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+    
+    def _load(self, key_name: str) -> Future:
+        """Start loading a key, or join the load already in progress"""
+        with self._lock:
+            future = self._loading.get(key_name)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="secret-refresh")
+                future = self._executor.submit(self._refresh, key_name)
+                self._loading[key_name] = future
+            return future
+    
+    def _refresh(self, key_name: str):
+        try:
+            value = self._retrieve(key_name)
+        except InvalidToken:
+            raise
+        except Exception as e:
+            now = self.clock()
+            entry = self._cache.get(key_name)
+            if entry is None:
+                logger.error(f"Failed to retrieve secret: {e}")
+                self._retry_at[key_name] = now + self.retry_interval
+            else:
+                logger.warning(f"Failed to refresh secret {key_name}, keeping last good value: {e}")
+                entry.refresh_at = now + self.retry_interval
+                entry.expires_at = max(entry.expires_at, entry.refresh_at)
+        else:
+            now = self.clock()
+            expires_at = now + self.ttl
+            self._cache[key_name] = CachedSecret(value, expires_at - self.refresh_ahead, expires_at)
+            self._retry_at.pop(key_name, None)
+        finally:
+            with self._lock:
+                self._loading.pop(key_name, None)
+    
+    def _retrieve(self, key_name: str) -> Optional[str]:
+        if self.use_aws_secrets:
+            response = self.secrets_client.get_secret_value(SecretId=key_name)
+            return response['SecretString']
         else:
             # Get from environment and decrypt
             encrypted = os.getenv(key_name)
@@ -1,30 +1,240 @@
 
 # security/rate_limiter.py
-from collections import defaultdict
-import time#, typing
-from typing import Dict, Tuple, Optional, List
+import asyncio
+import logging
+from collections import OrderedDict
+import time
+from typing import Callable, Dict, List, Sequence, Tuple, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from config.production import ProductionConfig
+
+logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    def __init__(self, requests_per_minute: int = 60):
+    """Per-client rate limit using the generic cell rate algorithm (GCRA).
+
+    Each client is a single theoretical arrival time (TAT): the time its
+    bucket would be empty again if no more requests came. A request is
+    allowed while TAT is less than ``burst`` emission intervals ahead of
+    now, so checks are O(1) and each client costs one float. A client
+    whose TAT has passed is indistinguishable from a new one, so such
+    entries are evicted a few at a time by a sweep that cycles through
+    the table from the least recently used end.
+    """
+
+    # Idle entries dropped per call; more than one, so eviction outpaces insertion
+    EVICT_PER_CALL = 2
+
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
         self.requests_per_minute = requests_per_minute
-        self.requests: Dict[str, List[float]] = defaultdict(list)
-    
+        self.burst = burst if burst is not None else requests_per_minute
+        if self.burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.clock = clock
+        self.interval = 60.0 / requests_per_minute
+        self.tolerance = self.interval * (self.burst - 1)
+        # client_id -> TAT, least recently allowed first
+        self.tat: Dict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.tat)
+
     def is_allowed(self, client_id: str) -> Tuple[bool, Optional[float]]:
-        """Check if request is allowed"""
-        now = time.time()
-        minute_ago = now - 60
-        
-        # Clean old requests
-        self.requests[client_id] = [
-            req_time for req_time in self.requests[client_id]
-            if req_time > minute_ago
-        ]
-        
-        if len(self.requests[client_id]) >= self.requests_per_minute:
-            # Calculate wait time
-            oldest_request = min(self.requests[client_id])
-            wait_time = 60 - (now - oldest_request)
-            return False, wait_time
-        
-        self.requests[client_id].append(now)
-        return True, None
\ No newline at end of file
+        """Check if request is allowed, returning the wait time when it is not"""
+        now = self.clock()
+        tat = self.tat.get(client_id)
+        if tat is None or tat < now:
+            tat = now
+
+        allow_at = tat - self.tolerance
+        if now < allow_at:
+            return False, allow_at - now
+
+        self.tat[client_id] = tat + self.interval
+        self.tat.move_to_end(client_id)
+        self._evict_idle(now, self.EVICT_PER_CALL)
+        return True, None
+
+    def evict_idle(self) -> int:
+        """Drop every client whose bucket has fully refilled, returning how many"""
+        now = self.clock()
+        idle = [client_id for client_id, tat in self.tat.items() if tat <= now]
+        for client_id in idle:
+            del self.tat[client_id]
+        return len(idle)
+
+    def _evict_idle(self, now: float, limit: int):
+        tat = self.tat
+        for _ in range(limit):
+            client_id = next(iter(tat))
+            if tat[client_id] > now:
+                # Still limited (e.g. throttled, or far ahead from a burst): rotate it
+                # to the back so it cannot shield idle clients queued behind it
+                tat.move_to_end(client_id)
+            else:
+                del tat[client_id]
+
+
+class DistributedRateLimiter:
+    """GCRA limit shared by every worker and replica through Redis.
+
+    Each check-and-update runs as one Lua script on Redis' own clock, so
+    concurrent workers cannot both spend the last slot and host clock skew
+    does not matter. Client keys expire once their TAT passes. While Redis
+    is unreachable, checks fall back to a process-local ``RateLimiter``
+    with the same limit and Redis is retried every ``retry_interval``.
+    """
+
+    # KEYS: client keys; ARGV: emission interval and tolerance in ms.
+    # Returns -1 for each allowed request, else the wait in ms.
+    _GCRA_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+    local interval = tonumber(ARGV[1])
+    local tolerance = tonumber(ARGV[2])
+    local result = {}
+    for i, key in ipairs(KEYS) do
+        local tat = tonumber(redis.call('GET', key) or now)
+        if tat < now then
+            tat = now
+        end
+        local allow_at = tat - tolerance
+        if now < allow_at then
+            result[i] = math.ceil(allow_at - now)
+        else
+            tat = tat + interval
+            redis.call('SET', key, string.format('%.3f', tat), 'PX', math.ceil(tat - now))
+            result[i] = -1
+        end
+    end
+    return result
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        burst: Optional[int] = None,
+        redis_client: Optional[aioredis.Redis] = None,
+        redis_url: Optional[str] = None,
+        prefix: str = "ratelimit",
+        retry_interval: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.local = RateLimiter(requests_per_minute, burst, clock=clock)
+        self.redis_client = redis_client or aioredis.from_url(redis_url or ProductionConfig.RATE_LIMIT_REDIS_URL)
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.degraded_until = 0.0
+        self._script = self.redis_client.register_script(self._GCRA_SCRIPT)
+
+    @property
+    def degraded(self) -> bool:
+        return self.clock() < self.degraded_until
+
+    async def is_allowed(self, client_id: str) -> Tuple[bool, Optional[float]]:
+        """Check if request is allowed, returning the wait time when it is not"""
+        return (await self.is_allowed_many([client_id]))[0]
+
+    async def is_allowed_many(self, client_ids: Sequence[str]) -> List[Tuple[bool, Optional[float]]]:
+        """Check a batch of requests in one round trip, in order"""
+        if not client_ids:
+            return []
+        if not self.degraded:
+            keys = [f"{self.prefix}:{client_id}" for client_id in client_ids]
+            try:
+                waits = await self._script(keys=keys, args=[self.local.interval * 1000, self.local.tolerance * 1000])
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"Redis rate limiting unavailable, limiting locally: {e}")
+                self.degraded_until = self.clock() + self.retry_interval
+            else:
+                self.degraded_until = 0.0
+                return [(True, None) if wait < 0 else (False, wait / 1000) for wait in waits]
+
+        return [self.local.is_allowed(client_id) for client_id in client_ids]
+
+    async def close(self):
+        await self.redis_client.aclose()
+
+
+class TokenRateLimiter:
+    """Async limiter for a provider's requests-per-minute and tokens-per-minute quota.
+
+    Both quotas are buckets that refill continuously up to one minute's
+    allowance. ``acquire`` charges one request plus a weighted token cost
+    (estimated prompt tokens plus max completion tokens) and waits until
+    both buckets can cover it, so calls are spread out instead of failing
+    with 429s. Waiters are served in arrival order.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.tokens_per_minute = tokens_per_minute or ProductionConfig.PROVIDER_TOKENS_PER_MINUTE
+        self.requests_per_minute = requests_per_minute or ProductionConfig.PROVIDER_REQUESTS_PER_MINUTE
+        self.clock = clock
+        self.tokens = float(self.tokens_per_minute)
+        self.requests = float(self.requests_per_minute)
+        self.blocked_until = 0.0
+        self._updated = clock()
+        # asyncio.Lock wakes waiters in FIFO order
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Wait until one request costing tokens fits the quota, returning the seconds waited"""
+        if tokens > self.tokens_per_minute:
+            raise ValueError(f"Cost of {tokens} tokens exceeds the {self.tokens_per_minute} per minute quota")
+
+        start = self.clock()
+        async with self._lock:
+            while True:
+                wait = self._wait_time(tokens, self.clock())
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.tokens -= tokens
+            self.requests -= 1
+        return self.clock() - start
+
+    def settle(self, estimated: int, actual: int):
+        """Correct a charge once the real token usage is known; refunds or takes the difference"""
+        self._refill(self.clock())
+        self.tokens = min(self.tokens + estimated - actual, float(self.tokens_per_minute))
+
+    def retry_after(self, seconds: float):
+        """Honor a provider Retry-After hint: block until it passes, then restart from empty buckets"""
+        now = self.clock()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        # The provider says the quota is spent; refill starts from when the block ends
+        self.tokens = min(self.tokens, 0.0)
+        self.requests = min(self.requests, 0.0)
+        self._updated = max(self._updated, self.blocked_until)
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self.tokens = min(self.tokens + elapsed * self.tokens_per_minute / 60, float(self.tokens_per_minute))
+            self.requests = min(self.requests + elapsed * self.requests_per_minute / 60, float(self.requests_per_minute))
+            self._updated = now
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        self._refill(now)
+        return max(
+            self.blocked_until - now,
+            (tokens - self.tokens) * 60 / self.tokens_per_minute,
+            (1 - self.requests) * 60 / self.requests_per_minute
+        )
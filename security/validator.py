@@ -1,31 +1,167 @@
 # security/validator.py
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional, Sequence
 import re
 
+from config.production import ProductionConfig
+
+# Secret prefixes redacted from output, with the token that follows them
+SECRET_PREFIXES = ("sk-", "api_key=")
+SECRET_PATTERN = re.compile("(?:" + "|".join(map(re.escape, SECRET_PREFIXES)) + ")[a-zA-Z0-9]+")
+REDACTED = "[REDACTED]"
+
+@dataclass
+class ValidationResult:
+    """Verdict for one input; rule is "max_length" or the blocked pattern that matched"""
+    valid: bool
+    rule: Optional[str] = None
+    match: Optional[str] = None
+
+def _scan_chunk(regex: re.Pattern, text: str) -> Optional[str]:
+    """First blocked match in a chunk (runs in the validation process pool)"""
+    match = regex.search(text.lower())
+    return match.group() if match else None
+
 class SecurityValidator:
+    # Chunks of large inputs overlap by more than any blocked match is long
+    CHUNK_OVERLAP = 256
+    
     def __init__(self, config: ProductionConfig):
         self.config = config
         self.blocked_patterns = [
-            r"(api_key|password|secret)",
-            r"(eval|exec|__import__)",
-            r"(system|popen|subprocess)"
+            r"api_key|password|secret",
+            r"eval|exec|__import__",
+            r"system|popen|subprocess"
         ]
+        # One flat, case-sensitive alternation over the lowercased input, so the
+        # input is scanned once; without groups or re.IGNORECASE the regex engine
+        # can skip ahead to positions where some pattern's first character occurs
+        self.blocked_regex = re.compile("|".join(self.blocked_patterns))
+        self.max_input_length = config.MAX_INPUT_LENGTH
+        self.chunk_size = config.VALIDATION_CHUNK_SIZE
+        if self.chunk_size <= self.CHUNK_OVERLAP:
+            raise ValueError(f"VALIDATION_CHUNK_SIZE must be greater than {self.CHUNK_OVERLAP}")
+        self._pool: Optional[ProcessPoolExecutor] = None
     
     def validate_input(self, input_text: str) -> bool:
         """Validate user input for security threats"""
-        # Check for injection attempts
-        for pattern in self.blocked_patterns:
-            if re.search(pattern, input_text, re.IGNORECASE):
-                return False
+        # Check input length first, so oversized input is never scanned
+        if len(input_text) > self.max_input_length:
+            return False
         
-        # Check input length
-        if len(input_text) > 10000:  # 10KB limit
+        # Check for injection attempts
+        if self.blocked_regex.search(input_text.lower()):
             return False
         
         return True
     
+    def validate_many(self, texts: Sequence[str], max_length: Optional[int] = None) -> List[ValidationResult]:
+        """Validate a batch of inputs, returning a verdict per input in order.
+        
+        ``max_length`` overrides the configured limit, e.g. for repository
+        dumps. Inputs longer than ``chunk_size`` are split into overlapping
+        chunks that are scanned in a process pool.
+        """
+        max_length = self.max_input_length if max_length is None else max_length
+        results: List[Optional[ValidationResult]] = [None] * len(texts)
+        chunks, owners = [], []
+        for i, text in enumerate(texts):
+            if len(text) > max_length:
+                results[i] = ValidationResult(False, "max_length")
+            elif len(text) > self.chunk_size:
+                step = self.chunk_size - self.CHUNK_OVERLAP
+                for start in range(0, len(text) - self.CHUNK_OVERLAP, step):
+                    chunks.append(text[start:start + self.chunk_size])
+                    owners.append(i)
+            else:
+                results[i] = self._verdict(_scan_chunk(self.blocked_regex, text))
+        
+        if chunks:
+            matches = self._executor().map(_scan_chunk, [self.blocked_regex] * len(chunks), chunks)
+            for i, matched in zip(owners, matches):
+                # Chunks arrive in order, so the first match in a text wins
+                if results[i] is None or (results[i].valid and matched):
+                    results[i] = self._verdict(matched)
+        return results
+    
+    def close(self):
+        """Shut down the validation process pool"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+    
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor()
+        return self._pool
+    
+    def _verdict(self, matched: Optional[str]) -> ValidationResult:
+        if matched is None:
+            return ValidationResult(True)
+        rule = next(
+            (pattern for pattern in self.blocked_patterns if re.fullmatch(pattern, matched)),
+            self.blocked_regex.pattern
+        )
+        return ValidationResult(False, rule, matched)
+    
     def sanitize_output(self, output: str) -> str:
         """Remove sensitive information from output"""
         # Remove potential secrets
-        output = re.sub(r'(sk-|api_key=)[a-zA-Z0-9]+', '[REDACTED]', output)
-        return output
\ No newline at end of file
+        return SECRET_PATTERN.sub(REDACTED, output)
+    
+    def stream_sanitizer(self) -> "StreamSanitizer":
+        """Sanitizer for output that arrives in chunks"""
+        return StreamSanitizer()
+    
+    async def sanitize_stream(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Sanitize streamed output chunk by chunk"""
+        sanitizer = self.stream_sanitizer()
+        async for chunk in chunks:
+            text = sanitizer.feed(chunk)
+            if text:
+                yield text
+        text = sanitizer.flush()
+        if text:
+            yield text
+
+class StreamSanitizer:
+    """Incremental ``sanitize_output`` for streamed text.
+    
+    Text is released as soon as it cannot be part of a secret: a match
+    still running at the end of the buffer, or a tail that could be the
+    start of a secret prefix, is held until the next chunk decides it.
+    The concatenated output equals ``sanitize_output`` on the whole text.
+    """
+    
+    HOLD = max(map(len, SECRET_PREFIXES))
+    
+    def __init__(self):
+        self.buffer = ""
+    
+    def feed(self, chunk: str) -> str:
+        """Add a chunk, returning the sanitized text that is safe to emit"""
+        buffer = self.buffer + chunk
+        out: List[str] = []
+        pos = 0
+        hold_from = None
+        for match in SECRET_PATTERN.finditer(buffer):
+            if match.end() == len(buffer):
+                # The token may continue in the next chunk
+                hold_from = match.start()
+                break
+            out.append(buffer[pos:match.start()])
+            out.append(REDACTED)
+            pos = match.end()
+        if hold_from is None:
+            hold_from = max(pos, len(buffer) - self.HOLD)
+        
+        out.append(buffer[pos:hold_from])
+        self.buffer = buffer[hold_from:]
+        return "".join(out)
+    
+    def flush(self) -> str:
+        """Sanitize and return whatever is still held at the end of the stream"""
+        text = SECRET_PATTERN.sub(REDACTED, self.buffer)
+        self.buffer = ""
+        return text
\ No newline at end of file
@@ -0,0 +1,104 @@
+import heapq
+import pytest
+import random
+import time
+from types import SimpleNamespace
+from load_balancer.agent_balancer import AgentLoadBalancer
+from load_balancer.policies import LeastLoadPolicy, PowerOfTwoChoicesPolicy
+
+def linear_select(agents, loads, errors):
+    """Previous selection: filter then scan every agent"""
+    available = [agent for agent in agents if errors[agent.name] < 3]
+    return min(available, key=lambda a: loads[a.name]) if available else None
+
+class TestBalancerSelectionPerformance:
+    @pytest.mark.performance
+    def test_selection_cost_by_agent_count(self):
+        """Test heap selection stays flat as the number of replicas grows"""
+        rounds = 2000
+        results = {}
+        for count in (10, 100, 1000, 10000):
+            agents = [SimpleNamespace(name=f"Agent{i}") for i in range(count)]
+            balancer = AgentLoadBalancer(agents)
+
+            # One select plus a load increment and decrement, as in execute_with_balancing
+            start = time.perf_counter()
+            for _ in range(rounds):
+                agent = balancer.select_agent()
+                balancer._adjust_load(agent.name, 1)
+                balancer._adjust_load(agent.name, -1)
+            heap_cost = (time.perf_counter() - start) / rounds
+
+            linear_rounds = max(20, rounds * 10 // count)
+            start = time.perf_counter()
+            for _ in range(linear_rounds):
+                agent = linear_select(agents, balancer.agent_loads, balancer.agent_errors)
+                balancer.agent_loads[agent.name] += 1
+                balancer.agent_loads[agent.name] -= 1
+            linear_cost = (time.perf_counter() - start) / linear_rounds
+
+            results[count] = (heap_cost, linear_cost)
+            print(f"{count:>6} agents: heap {heap_cost * 1e6:7.2f}us, linear {linear_cost * 1e6:9.2f}us")
+
+        assert results[10000][0] < results[10000][1] / 50
+        assert results[10000][0] < results[10][0] * 10
+
+def simulate(policy, latencies: dict, clients: int = 6, requests: int = 200) -> list:
+    """Closed-loop clients against a policy, in simulated time; returns request latencies.
+
+    Each agent's service time grows 10% per request it is already serving,
+    a mild contention model: enough that piling onto one replica costs
+    something, while the pool's base speeds still dominate, as they do for
+    replicas on different hardware or model endpoints.
+    """
+    for name in latencies:
+        policy.add(name)
+    inflight = {name: 0 for name in latencies}
+    # (finish_time, seq, client, agent, start_time)
+    events = []
+    seq = 0
+    samples = []
+
+    def dispatch(client: int, now: float):
+        nonlocal seq
+        name = policy.select()
+        inflight[name] += 1
+        policy.update_load(name, inflight[name])
+        service = latencies[name] * (1 + 0.1 * (inflight[name] - 1))
+        heapq.heappush(events, (now + service, seq, client, name, now))
+        seq += 1
+
+    remaining = [requests] * clients
+    for client in range(clients):
+        remaining[client] -= 1
+        dispatch(client, 0.0)
+    while events:
+        now, _, client, name, started = heapq.heappop(events)
+        inflight[name] -= 1
+        policy.update_load(name, inflight[name])
+        policy.record_latency(name, now - started)
+        samples.append(now - started)
+        if remaining[client]:
+            remaining[client] -= 1
+            dispatch(client, now)
+    return samples
+
+class TestRoutingPolicyLatency:
+    @pytest.mark.performance
+    def test_p99_in_heterogeneous_pool(self):
+        """Test latency-aware routing lowers p99 when a replica is 5x slower than the rest"""
+        def percentile(samples, q):
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+        latencies = {f"Fast{i}": 0.004 for i in range(7)}
+        latencies["Slow"] = 0.020
+        least_load = simulate(LeastLoadPolicy(), latencies)
+        p2c = simulate(PowerOfTwoChoicesPolicy(rng=random.Random(7)), latencies)
+        for name, samples in (("least_load", least_load), ("p2c", p2c)):
+            print(f"{name:>10}: p50 {percentile(samples, 0.5) * 1e3:.1f}ms, p99 {percentile(samples, 0.99) * 1e3:.1f}ms")
+
+        # Simulated time makes this deterministic. Least-load sends the slow
+        # replica about one request in eight, so its p99 is the slow latency
+        assert percentile(least_load, 0.99) >= latencies["Slow"]
+        assert percentile(p2c, 0.99) < percentile(least_load, 0.99)
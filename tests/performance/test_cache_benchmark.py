@@ -0,0 +1,132 @@
+import asyncio
+import pytest
+import random
+import time
+from cache.agent_cache import AgentCache
+from cache.similarity import SimilarityIndex
+
+VOCABULARY = [
+    "write", "python", "function", "parse", "csv", "json", "api", "flask", "fastapi",
+    "deploy", "docker", "kubernetes", "test", "unit", "integration", "database", "sql",
+    "schema", "migration", "react", "frontend", "backend", "auth", "token", "cache",
+    "redis", "queue", "worker", "retry", "logging", "metrics", "plan", "requirements",
+    "endpoint", "model", "agent", "search", "upload", "file", "user", "report", "cli"
+]
+
+def make_prompt(rng: random.Random, words: int = 20) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+class TestSimilarityCachePerformance:
+    @pytest.mark.performance
+    @pytest.mark.slow
+    def test_lookup_latency_at_100k_entries(self):
+        """Test near-duplicate lookups stay sub-millisecond with 100k indexed prompts"""
+        rng = random.Random(42)
+        index = SimilarityIndex(max_entries=200000)
+        prompts = [make_prompt(rng) for _ in range(100000)]
+        for i, prompt in enumerate(prompts):
+            index.add(f"Agent{i % 5}", prompt, f"key{i}")
+
+        queries = []
+        for i in rng.sample(range(len(prompts)), 2000):
+            words = prompts[i].split()
+            words[rng.randrange(len(words))] = rng.choice(VOCABULARY)
+            queries.append((f"Agent{i % 5}", "  ".join(words).upper()))
+
+        start = time.perf_counter()
+        matched = sum(index.lookup(scope, text) is not None for scope, text in queries)
+        per_lookup = (time.perf_counter() - start) / len(queries)
+
+        print(f"similarity lookup: {per_lookup * 1e6:.1f}us/op, {matched}/{len(queries)} matched")
+        assert per_lookup < 0.001
+        assert matched > len(queries) * 0.5
+
+    @pytest.mark.performance
+    @pytest.mark.parametrize("words, budget", [(300, 0.001), (1000, 0.003)])
+    def test_lookup_latency_for_long_prompts(self, words, budget):
+        """Test signature cost stays low for prompts of hundreds of words"""
+        rng = random.Random(42)
+        index = SimilarityIndex()
+        prompts = [make_prompt(rng, words) for _ in range(2000)]
+        for i, prompt in enumerate(prompts):
+            index.add(f"Agent{i % 5}", prompt, f"key{i}")
+
+        queries = []
+        for i in rng.sample(range(len(prompts)), 200):
+            words_ = prompts[i].split()
+            words_[rng.randrange(len(words_))] = rng.choice(VOCABULARY)
+            queries.append((f"Agent{i % 5}", " ".join(words_).upper(), f"key{i}"))
+
+        start = time.perf_counter()
+        matches = [index.lookup(scope, text) for scope, text, _ in queries]
+        per_lookup = (time.perf_counter() - start) / len(queries)
+
+        correct = sum(match is not None and match[0] == key for match, (_, _, key) in zip(matches, queries))
+        print(f"similarity lookup, {words} words: {per_lookup * 1e6:.1f}us/op, {correct}/{len(queries)} matched")
+        assert per_lookup < budget
+        assert correct > len(queries) * 0.9
+
+def make_agent_output(rng: random.Random, functions: int = 40) -> str:
+    """Code.md-style markdown with prose and Python code blocks"""
+    sections = ["# Implementation\n\nGenerated by CoderAgent for the approved plan.\n"]
+    for i in range(functions):
+        name = f"{rng.choice(VOCABULARY)}_{rng.choice(VOCABULARY)}_{i}"
+        sections.append(
+            f"## `{name}`\n\nHandles the {rng.choice(VOCABULARY)} step of the "
+            f"{rng.choice(VOCABULARY)} workflow.\n\n```python\n"
+            f"def {name}(payload: dict) -> dict:\n"
+            f"    \"\"\"Process {rng.choice(VOCABULARY)} payload\"\"\"\n"
+            f"    if not payload.get('{rng.choice(VOCABULARY)}'):\n"
+            f"        raise ValueError('missing {rng.choice(VOCABULARY)}')\n"
+            f"    result = {{'status': 'ok', 'items': [x for x in payload['items'] if x]}}\n"
+            f"    return result\n```\n"
+        )
+    return "\n".join(sections)
+
+class TestCodecPerformance:
+    @pytest.mark.performance
+    def test_codec_comparison(self):
+        """Compare size and speed of codecs on realistic agent outputs"""
+        from cache.codecs import BinaryCodec, JsonCodec, COMPRESSION_LZMA, COMPRESSION_NONE
+
+        rng = random.Random(7)
+        outputs = [make_agent_output(rng) for _ in range(20)]
+        outputs += [{"plan": [make_prompt(rng, 40) for _ in range(30)], "language": "python"} for _ in range(20)]
+        codecs = {
+            "json": JsonCodec(),
+            "binary": BinaryCodec(compression=COMPRESSION_NONE),
+            "binary+zlib": BinaryCodec(),
+            "binary+lzma": BinaryCodec(compression=COMPRESSION_LZMA),
+        }
+
+        sizes = {}
+        for name, codec in codecs.items():
+            start = time.perf_counter()
+            encoded = [codec.encode(value) for value in outputs]
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            decoded = [codec.decode(data) for data in encoded]
+            decode_time = time.perf_counter() - start
+
+            assert decoded == outputs
+            sizes[name] = sum(len(data) for data in encoded)
+            print(f"{name:12} {sizes[name]:>9} bytes  encode {encode_time * 1e3:7.2f}ms  decode {decode_time * 1e3:7.2f}ms")
+
+        assert sizes["binary+zlib"] < sizes["json"] / 3
+
+class TestCacheMetricsOverhead:
+    @pytest.mark.performance
+    def test_metrics_overhead(self):
+        """Test instrumentation adds little to local-tier hits"""
+        async def run(metrics_enabled: bool) -> float:
+            cache = AgentCache(metrics_enabled=metrics_enabled)
+            await cache.set("PlannerAgent", "plan a todo app", "cached plan")
+            start = time.perf_counter()
+            for _ in range(20000):
+                await cache.get("PlannerAgent", "plan a todo app")
+            return (time.perf_counter() - start) / 20000
+
+        disabled = asyncio.run(run(False))
+        enabled = asyncio.run(run(True))
+        print(f"local get: {disabled * 1e6:.2f}us without metrics, {enabled * 1e6:.2f}us with metrics")
+        assert enabled < disabled * 1.5
@@ -0,0 +1,73 @@
+import pytest
+import random
+import time
+from collections import defaultdict
+from security.rate_limiter import RateLimiter
+
+class SlidingLogRateLimiter:
+    """Previous limiter: a list of request timestamps per client"""
+
+    def __init__(self, requests_per_minute: int, clock):
+        self.requests_per_minute = requests_per_minute
+        self.clock = clock
+        self.requests = defaultdict(list)
+
+    def is_allowed(self, client_id: str):
+        now = self.clock()
+        minute_ago = now - 60
+        self.requests[client_id] = [t for t in self.requests[client_id] if t > minute_ago]
+        if len(self.requests[client_id]) >= self.requests_per_minute:
+            return False, 60 - (now - min(self.requests[client_id]))
+        self.requests[client_id].append(now)
+        return True, None
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def replay(limiter, clock, client_ids, rate: float) -> float:
+    """Feed requests at a fixed simulated rate, returning real seconds per call"""
+    step = 1.0 / rate
+    start = time.perf_counter()
+    for client_id in client_ids:
+        clock.now += step
+        limiter.is_allowed(client_id)
+    return (time.perf_counter() - start) / len(client_ids)
+
+class TestRateLimiterPerformance:
+    @pytest.mark.performance
+    @pytest.mark.slow
+    def test_100k_clients_at_10k_requests_per_second(self):
+        """Test per-call cost stays flat and idle clients are dropped with 100k clients"""
+        rng = random.Random(42)
+        client_ids = [f"client{rng.randrange(100000)}" for _ in range(300000)]  # 30s at 10k/s
+
+        results = {}
+        for name, factory in (("gcra", RateLimiter), ("sliding_log", SlidingLogRateLimiter)):
+            clock = SimulatedClock()
+            limiter = factory(requests_per_minute=60, clock=clock)
+            per_call = replay(limiter, clock, client_ids, 10000)
+            tracked = len(limiter.tat) if name == "gcra" else len(limiter.requests)
+            results[name] = (per_call, tracked)
+            print(f"{name:>12}: {per_call * 1e6:.2f}us/call, {tracked} clients tracked")
+
+        # 10k requests/s leaves a 100us budget per call
+        assert results["gcra"][0] < 0.0001
+        # Only clients active within the last few emission intervals keep state
+        assert results["gcra"][1] < results["sliding_log"][1] / 3
+
+    @pytest.mark.performance
+    def test_hot_client_cost_is_constant(self):
+        """Test a client near a high limit costs the same as an idle one"""
+        results = {}
+        for name, factory in (("gcra", RateLimiter), ("sliding_log", SlidingLogRateLimiter)):
+            clock = SimulatedClock()
+            limiter = factory(requests_per_minute=6000, clock=clock)
+            per_call = replay(limiter, clock, ["hot"] * 20000, 200)
+            results[name] = per_call
+            print(f"{name:>12}: {per_call * 1e6:.2f}us/call for one client at 6000/min")
+
+        assert results["gcra"] < results["sliding_log"] / 20
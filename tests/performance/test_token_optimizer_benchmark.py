@@ -0,0 +1,68 @@
+import pytest
+import random
+import time
+import tiktoken
+from optimization.token_optimizer import TokenOptimizer
+from tests.utils import WordEncoder
+
+def load_encoder():
+    try:
+        return tiktoken.get_encoding("cl100k_base"), "cl100k_base"
+    except Exception:
+        return WordEncoder(), "stand-in word encoder"
+
+def sentence_split_optimize(encoder, max_tokens: int, prompt: str, context: str) -> str:
+    """Previous optimize_prompt: encode everything, then re-encode sentence by sentence"""
+    prompt_tokens = len(encoder.encode(prompt))
+    context_tokens = len(encoder.encode(context))
+    if prompt_tokens + context_tokens <= max_tokens:
+        return f"{prompt}\n\nContext: {context}"
+
+    available_tokens = max_tokens - prompt_tokens - 50
+    optimized_context = ""
+    current_tokens = 0
+    for part in context.split('. '):
+        part_tokens = len(encoder.encode(part))
+        if current_tokens + part_tokens <= available_tokens:
+            optimized_context += part + ". "
+            current_tokens += part_tokens
+        else:
+            break
+    return f"{prompt}\n\nContext (truncated): {optimized_context}"
+
+def make_context(rng: random.Random, encoder, tokens: int) -> str:
+    words = ["agent", "repository", "function", "returns", "config", "the", "cache", "request",
+             "handler", "module", "test", "deploy", "value", "error", "client", "server"]
+    sentences = []
+    while True:
+        sentences.append(" ".join(rng.choice(words) for _ in range(rng.randint(8, 25))).capitalize())
+        if len(sentences) % 500 == 0 and len(encoder.encode(". ".join(sentences))) >= tokens:
+            return ". ".join(sentences)
+
+class TestTokenOptimizerPerformance:
+    @pytest.mark.performance
+    @pytest.mark.slow
+    def test_truncate_100k_token_context(self):
+        """Test single-encode truncation against per-sentence re-encoding on 100k-token contexts"""
+        encoder, name = load_encoder()
+        rng = random.Random(42)
+        contexts = [make_context(rng, encoder, 100000) for _ in range(3)]
+        prompt = "Review this repository and list the riskiest modules."
+        optimizer = TokenOptimizer(encoder=encoder)
+
+        rounds = 5
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for context in contexts:
+                sentence_split_optimize(encoder, optimizer.max_tokens, prompt, context)
+        previous = (time.perf_counter() - start) / (rounds * len(contexts))
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for context in contexts:
+                result = optimizer.optimize_prompt(prompt, context)
+        single = (time.perf_counter() - start) / (rounds * len(contexts))
+
+        print(f"100k-token context ({name}): per-sentence {previous * 1e3:.1f}ms, single encode {single * 1e3:.1f}ms")
+        assert len(encoder.encode(result)) <= optimizer.max_tokens
+        assert single < previous
@@ -0,0 +1,73 @@
+import pytest
+import random
+import re
+import time
+from config.production import ProductionConfig
+from security.validator import SecurityValidator
+
+WORDS = [
+    "the", "agent", "returns", "a", "plan", "for", "deploying", "service", "with", "docker",
+    "and", "kubernetes", "tests", "cover", "each", "endpoint", "token", "cache", "request", "user"
+]
+
+def make_text(rng: random.Random, size: int, secret_every: int = 0) -> str:
+    words = []
+    length = 0
+    while length < size:
+        if secret_every and rng.randrange(secret_every) == 0:
+            word = "sk-" + "".join(rng.choice("abcdefXYZ0123456789") for _ in range(32))
+        else:
+            word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+def throughput(func, texts) -> float:
+    """MB/s of func over texts"""
+    start = time.perf_counter()
+    for text in texts:
+        func(text)
+    elapsed = time.perf_counter() - start
+    return sum(map(len, texts)) / elapsed / 1e6
+
+class TestValidatorPerformance:
+    @pytest.mark.performance
+    def test_single_pass_input_validation(self):
+        """Test one scan of the lowercased input beats a case-insensitive search per pattern"""
+        rng = random.Random(42)
+        validator = SecurityValidator(ProductionConfig())
+        texts = [make_text(rng, 10000) for _ in range(200)]
+
+        def per_pattern(text):
+            # Previous validation: one case-insensitive search per pattern
+            for pattern in validator.blocked_patterns:
+                if re.search(pattern, text, re.IGNORECASE):
+                    return False
+            return True
+
+        assert all(validator.validate_input(text) for text in texts)
+        combined = throughput(validator.validate_input, texts)
+        separate = throughput(per_pattern, texts)
+        print(f"validate_input: combined {combined:.1f} MB/s, per pattern {separate:.1f} MB/s")
+        assert combined > separate * 2
+
+    @pytest.mark.performance
+    def test_stream_sanitizer_throughput(self):
+        """Test streaming sanitization keeps up with whole-string sanitization"""
+        rng = random.Random(42)
+        validator = SecurityValidator(ProductionConfig())
+        texts = [make_text(rng, 100000, secret_every=50) for _ in range(20)]
+
+        def streamed(text, chunk_size=16):
+            # LLM streams arrive a few tokens at a time
+            sanitizer = validator.stream_sanitizer()
+            out = [sanitizer.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+            out.append(sanitizer.flush())
+            return "".join(out)
+
+        assert all(streamed(text) == validator.sanitize_output(text) for text in texts[:2])
+        whole = throughput(validator.sanitize_output, texts)
+        stream = throughput(streamed, texts)
+        print(f"sanitize: whole string {whole:.1f} MB/s, streamed in 16-char chunks {stream:.1f} MB/s")
+        # Far above the rate LLM output is generated at
+        assert stream > 2
@@ -0,0 +1,639 @@
+import asyncio
+import time
+import pytest
+from prometheus_client import REGISTRY
+from cache.agent_cache import AgentCache
+from cache.codecs import BinaryCodec, JsonCodec, COMPRESSION_NONE
+from cache.keys import agent_config, config_fingerprint, fast_hash
+from cache.local_cache import LocalCache
+from cache.similarity import SimilarityIndex, canonicalize
+from cache.single_flight import SingleFlight
+from cache.snapshot import SnapshotReader, write_snapshot
+from cache.tool_cache import cached_tool, normalize_code, normalize_query, tool_cache_stats
+from tests.utils import FakeClock, make_redis_client
+
+class TestLocalCache:
+    def test_lru_eviction_by_count(self):
+        """Test least recently used entry is evicted at capacity"""
+        cache = LocalCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+
+        assert cache.get("a") == "1"
+        assert cache.get("b") is None
+        assert cache.get("c") == "3"
+        assert cache.stats()["evictions"] == 1
+
+    def test_byte_budget(self):
+        """Test byte budget evicts and tracks usage"""
+        cache = LocalCache(max_bytes=100)
+        cache.set("a", b"x" * 40)
+        cache.set("b", b"x" * 40)
+        assert cache.current_bytes == 80
+
+        cache.set("c", b"x" * 40)
+        assert "a" not in cache
+        assert cache.current_bytes == 80
+
+        # Values larger than the whole budget are rejected
+        assert cache.set("big", b"x" * 101) is False
+        assert cache.stats()["rejections"] == 1
+
+    def test_ttl_expiry(self):
+        """Test per-entry TTL is honored"""
+        clock = FakeClock()
+        cache = LocalCache(clock=clock)
+        cache.set("short", "v", ttl=10)
+        cache.set("forever", "v")
+
+        clock.advance(11)
+        assert cache.get("short") is None
+        assert cache.get("forever") == "v"
+        assert cache.stats()["expirations"] == 1
+        assert len(cache) == 1
+
+    def test_overwrite_updates_size(self):
+        """Test replacing a key does not leak byte accounting"""
+        cache = LocalCache()
+        cache.set("a", b"x" * 10)
+        cache.set("a", b"x" * 30)
+        assert cache.current_bytes == 30
+        cache.delete("a")
+        assert cache.current_bytes == 0
+
+class TestSingleFlight:
+    def test_concurrent_misses_share_one_call(self):
+        """Test identical concurrent misses trigger a single computation"""
+        cache = AgentCache()
+        calls = []
+
+        async def call_llm():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        async def scenario():
+            return await asyncio.gather(*[
+                cache.get_or_compute("PlannerAgent", "same question", call_llm)
+                for _ in range(10)
+            ])
+
+        assert asyncio.run(scenario()) == ["answer"] * 10
+        assert len(calls) == 1
+        assert cache.stats()["single_flight"]["coalesced"] == 9
+        assert cache.stats()["single_flight"]["inflight"] == 0
+
+    def test_exception_is_shared(self):
+        """Test every waiter receives the computation's exception"""
+        flight = SingleFlight()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            return await asyncio.gather(
+                *[flight.do("key", failing) for _ in range(3)],
+                return_exceptions=True
+            )
+
+        results = asyncio.run(scenario())
+        assert len(calls) == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    def test_cancelled_waiter_does_not_cancel_others(self):
+        """Test cancelling one caller leaves the shared computation running"""
+        flight = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        async def scenario():
+            first = asyncio.ensure_future(flight.do("key", slow))
+            second = asyncio.ensure_future(flight.do("key", slow))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(scenario()) == "done"
+
+class TestSimilarityIndex:
+    def test_canonicalize(self):
+        """Test case, whitespace, punctuation and timestamps are normalized"""
+        assert canonicalize("  Plan   the API!\nat 2024-05-01T10:22:01Z ") == \
+            canonicalize("plan the api at 2025-01-01 09:00")
+
+    def test_near_duplicate_lookup(self):
+        """Test near-duplicates match and unrelated prompts do not"""
+        index = SimilarityIndex(threshold=0.6)
+        index.add("CoderAgent", "Write a Python function that parses a CSV file and returns the rows as dictionaries", "k1")
+
+        match = index.lookup("CoderAgent", "write a python function that parses a csv file and returns the rows as dicts")
+        assert match is not None and match[0] == "k1"
+        assert index.lookup("CoderAgent", "Deploy the flask app to kubernetes with a helm chart") is None
+        # Entries are scoped per agent
+        assert index.lookup("TesterAgent", "Write a Python function that parses a CSV file and returns the rows as dictionaries") is None
+
+    def test_max_entries(self):
+        """Test oldest entries are dropped beyond max_entries"""
+        index = SimilarityIndex(max_entries=2)
+        for i, prompt in enumerate(["alpha beta gamma", "delta epsilon zeta", "eta theta iota"]):
+            index.add("agent", prompt, f"k{i}")
+        assert len(index) == 2
+        assert index.lookup("agent", "alpha beta gamma") is None
+
+class TestCodecs:
+    def test_roundtrip_types(self):
+        """Test strings, bytes and JSON values survive encoding"""
+        codec = BinaryCodec(compress_threshold=16)
+        for value in ["short", "code\n" * 500, b"\x00\x01" * 100, {"plan": ["a", "b"]}, [1, 2.5, None]]:
+            assert codec.decode(codec.encode(value)) == value
+
+    def test_large_values_are_compressed(self):
+        """Test payloads above the threshold are compressed"""
+        value = "def handler(event):\n    return event\n" * 200
+        assert len(BinaryCodec().encode(value)) < len(value) / 5
+        assert len(BinaryCodec(compression=COMPRESSION_NONE).encode(value)) == len(value) + 4
+
+    def test_legacy_json_is_readable(self):
+        """Test values written before the codec header still decode"""
+        legacy = JsonCodec().encode({"result": "ok"})
+        assert BinaryCodec().decode(legacy) == {"result": "ok"}
+
+    def test_pickle_requires_opt_in(self):
+        """Test non-JSON values need allow_pickle on both ends"""
+        value = {"when": {1, 2}}
+        with pytest.raises(TypeError):
+            BinaryCodec().encode(value)
+        encoded = BinaryCodec(allow_pickle=True).encode(value)
+        assert BinaryCodec(allow_pickle=True).decode(encoded) == value
+        with pytest.raises(ValueError):
+            BinaryCodec().decode(encoded)
+
+class TestToolCache:
+    def test_normalized_arguments_hit(self):
+        """Test equivalent queries share one tool call"""
+        calls = []
+
+        @cached_tool(ttl=60, normalize={"query": normalize_query})
+        def search_tool_a(query: str, max_results: int = 5):
+            calls.append(query)
+            return [{"title": query}]
+
+        first = search_tool_a("FastAPI  tutorial")
+        first[0]["title"] = "mutated by caller"
+        assert search_tool_a(" fastapi tutorial ") == [{"title": "FastAPI  tutorial"}]
+        assert search_tool_a("fastapi tutorial", max_results=10) == [{"title": "fastapi tutorial"}]
+        assert len(calls) == 2
+
+        stats = tool_cache_stats()["search_tool_a"]
+        assert (stats["hits"], stats["misses"]) == (1, 2)
+        assert stats["hit_rate"] == pytest.approx(1 / 3)
+        labels = {"tool": "search_tool_a", "result": "hit"}
+        assert REGISTRY.get_sample_value("tool_cache_requests_total", labels) == 1
+        assert REGISTRY.get_sample_value("tool_cache_hit_ratio", {"tool": "search_tool_a"}) == pytest.approx(1 / 3)
+
+    def test_normalize_code_keeps_whitespace_inside_lines(self):
+        """Test only line endings and trailing blank lines are normalized"""
+        code = 'text = """indented  \n  tail   """\r\nprint(text)\r\n\n  \n'
+        assert normalize_code(code) == 'text = """indented  \n  tail   """\nprint(text)'
+        assert normalize_code('print("a  ")') != normalize_code('print("a")')
+
+    def test_errors_and_opt_out_are_not_cached(self):
+        """Test cache_if vetoes results and non-deterministic tools run every time"""
+        calls = []
+
+        @cached_tool(normalize={"code": normalize_code}, cache_if=lambda r: "error" not in r)
+        def interpreter_tool_b(code: str):
+            calls.append(code)
+            return {"error": "sandbox unavailable"}
+
+        @cached_tool(deterministic=False)
+        def random_tool_c():
+            calls.append("random")
+            return 4
+
+        interpreter_tool_b("print(1)\n")
+        interpreter_tool_b("print(1)")
+        random_tool_c()
+        random_tool_c()
+        assert len(calls) == 4
+        assert tool_cache_stats()["interpreter_tool_b"]["uncached"] == 2
+        assert "random_tool_c" not in tool_cache_stats()
+
+    def test_async_tool(self):
+        """Test coroutine tools are cached too"""
+        calls = []
+
+        @cached_tool()
+        async def async_tool_d(x: int) -> int:
+            calls.append(x)
+            return x * 3
+
+        async def scenario():
+            return [await async_tool_d(2), await async_tool_d(x=2)]
+
+        assert asyncio.run(scenario()) == [6, 6]
+        assert calls == [2]
+
+class FakeAgent:
+    def __init__(self, name: str, llm: str = "gpt-4o-mini", temperature: float = 0.7, tools=None):
+        self.name = name
+        self.llm = llm
+        self.temperature = temperature
+        self.instructions = "Be helpful"
+        self.tools = tools or []
+
+def internet_search_tool(query: str):
+    return []
+
+class TestConfigKeys:
+    def test_fingerprint_tracks_configuration(self):
+        """Test model, temperature and tools change the fingerprint"""
+        base = config_fingerprint(FakeAgent("PlannerAgent"))
+        assert base == config_fingerprint(FakeAgent("PlannerAgent"))
+        assert base != config_fingerprint(FakeAgent("PlannerAgent", llm="gpt-4"))
+        assert base != config_fingerprint(FakeAgent("PlannerAgent", temperature=0.2))
+        assert base != config_fingerprint(FakeAgent("PlannerAgent", tools=[internet_search_tool]))
+
+    def test_tools_reduce_to_names(self):
+        """Test tool callables are identified by name, not by address"""
+        assert agent_config(FakeAgent("CoderAgent", tools=[internet_search_tool]))["tools"] == ["internet_search_tool"]
+        assert agent_config({"llm": "gpt-4", "unrelated": 1}) == {"llm": "gpt-4"}
+
+    def test_llm_config_dict_is_split_into_model_and_settings(self):
+        """Test sampling settings in an LLM dict count, credentials do not"""
+        config = agent_config({"llm": {"model": "gpt-4o", "temperature": 0.2, "api_key": "sk-test"}})
+        assert config == {"llm": "gpt-4o", "llm_config": {"temperature": 0.2}}
+
+    def test_praisonai_agent_sampling_settings_change_fingerprint(self):
+        """Test a real Agent's LLM settings, which it keeps off .llm, are fingerprinted"""
+        agents = pytest.importorskip("praisonaiagents")
+
+        def fingerprint(**llm):
+            return config_fingerprint(agents.Agent(name="PlannerAgent", role="Planner", llm={"model": "gpt-4o", **llm}))
+
+        base = fingerprint(temperature=0.2, max_tokens=500)
+        assert base == fingerprint(temperature=0.2, max_tokens=500, api_key="sk-test")
+        assert base != fingerprint(temperature=0.9, max_tokens=500)
+        assert base != fingerprint(temperature=0.2, max_tokens=100)
+        assert agent_config(agents.Agent(name="PlannerAgent", llm="gpt-4o-mini"))["llm"] == "gpt-4o-mini"
+
+class CountingAgent(FakeAgent):
+    """Agent that counts how often its configuration is read"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.reads = 0
+
+    def __getattribute__(self, attr):
+        if attr == "llm":
+            object.__setattr__(self, "reads", object.__getattribute__(self, "reads") + 1)
+        return super().__getattribute__(attr)
+
+class TestAgentCache:
+    def test_config_resolved_once_per_operation(self):
+        """Test get_or_compute and set read the agent configuration once each"""
+        cache = AgentCache(max_entries=10)
+        agent = CountingAgent("PlannerAgent")
+
+        async def compute():
+            return "plan"
+
+        async def scenario():
+            await cache.get_or_compute("PlannerAgent", "plan a todo app", compute, config=agent)
+            reads_on_miss = agent.reads
+            agent.reads = 0
+            await cache.get_or_compute("PlannerAgent", "plan a todo app", compute, config=agent)
+            return reads_on_miss, agent.reads
+
+        # A miss resolves it for the lookup and again for the set that stores the result
+        assert asyncio.run(scenario()) == (2, 1)
+        fingerprint = config_fingerprint(FakeAgent("PlannerAgent"))
+        assert cache.cache_key("PlannerAgent", "x", agent) == fast_hash(f"PlannerAgent:{fingerprint}:0.0:x")
+
+    def test_local_roundtrip(self):
+        """Test results are served from the local tier"""
+        cache = AgentCache(max_entries=10)
+
+        async def scenario():
+            await cache.set("PlannerAgent", "plan a todo app", {"plan": "steps"})
+            return await cache.get("PlannerAgent", "plan a todo app")
+
+        assert asyncio.run(scenario()) == {"plan": "steps"}
+        assert cache.stats()["local"]["entries"] == 1
+
+    def test_unserializable_result_is_returned_uncached(self):
+        """Test a result the codec cannot encode is still returned, just not cached"""
+        cache = AgentCache(max_entries=10)
+
+        class Plan:
+            pass
+
+        async def compute():
+            return Plan()
+
+        async def scenario():
+            result = await cache.get_or_compute("PlannerAgent", "plan a todo app", compute)
+            await cache.set_many([("PlannerAgent", "other", Plan()), ("PlannerAgent", "text", "plan")])
+            return result
+
+        assert isinstance(asyncio.run(scenario()), Plan)
+        assert cache.stats()["local"]["entries"] == 1
+
+    def test_redis_roundtrip(self):
+        """Test results fall back to the async Redis tier"""
+        async def scenario():
+            client = make_redis_client()
+            writer = AgentCache(redis_client=client)
+            reader = AgentCache(redis_client=client)
+            await writer.set("CoderAgent", "write hello world", "print('hello')", ttl=60)
+            result = await reader.get("CoderAgent", "write hello world")
+            await client.flushdb()
+            await client.aclose()
+            return result
+
+        assert asyncio.run(scenario()) == "print('hello')"
+
+    def test_batched_get_set(self):
+        """Test get_many/set_many use one round-trip and keep input order"""
+        async def scenario():
+            client = make_redis_client()
+            writer = AgentCache(redis_client=client)
+            reader = AgentCache(redis_client=client)
+            await writer.set_many([
+                ("PlannerAgent", "task 1", {"plan": 1}),
+                ("CoderAgent", "task 2", "code"),
+            ], ttl=60)
+            # Warm one key locally so the batch mixes local hits and Redis lookups
+            await reader.set("TesterAgent", "task 3", "tests")
+            results = await reader.get_many([
+                ("CoderAgent", "task 2"),
+                ("DeployerAgent", "missing"),
+                ("TesterAgent", "task 3"),
+                ("PlannerAgent", "task 1"),
+            ])
+            await client.flushdb()
+            await client.aclose()
+            return results
+
+        assert asyncio.run(scenario()) == ["code", None, "tests", {"plan": 1}]
+
+    def test_redis_failure_is_a_miss(self):
+        """Test Redis outages degrade to cache misses"""
+        async def scenario():
+            cache = AgentCache(redis_url="redis://127.0.0.1:1/0")
+            result = await cache.get("PlannerAgent", "anything")
+            await cache.set("PlannerAgent", "anything", "value")
+            await cache.close()
+            return result
+
+        assert asyncio.run(scenario()) is None
+
+    def test_similarity_tier(self):
+        """Test near-duplicate prompts are served and counted separately"""
+        cache = AgentCache(similarity_threshold=0.8)
+
+        async def scenario():
+            await cache.set("PlannerAgent", "Plan a todo app with FastAPI", "plan")
+            exact = await cache.get("PlannerAgent", "Plan a todo app with FastAPI")
+            similar = await cache.get("PlannerAgent", "  plan a TODO app with fastapi. ")
+            miss = await cache.get("PlannerAgent", "Plan a chess engine in Rust")
+            return exact, similar, miss
+
+        assert asyncio.run(scenario()) == ("plan", "plan", None)
+        requests = cache.stats()["requests"]
+        assert (requests["hits"], requests["similar_hits"], requests["misses"]) == (1, 1, 1)
+        assert requests["similarity_hit_rate"] == pytest.approx(1 / 3)
+
+    def test_snapshot_warm_start(self, tmp_path):
+        """Test a restarted cache lazily restores the previous local tier"""
+        path = str(tmp_path / "agent_cache.snapshot")
+
+        async def first_worker():
+            cache = AgentCache(snapshot_path=path)
+            await cache.set("CoderAgent", "hello world", "print('hello')", ttl=3600)
+            await cache.set("PlannerAgent", "todo app", {"plan": [1, 2]}, ttl=3600)
+            await cache.close()
+
+        async def second_worker():
+            cache = AgentCache(snapshot_path=path)
+            # Nothing is read until the first lookup
+            assert cache._snapshot._index is None
+            result = await cache.get("CoderAgent", "hello world")
+            await cache.close()
+            return result
+
+        async def third_worker():
+            cache = AgentCache(snapshot_path=path)
+            result = await cache.get("PlannerAgent", "todo app")
+            await cache.close()
+            return result
+
+        asyncio.run(first_worker())
+        assert asyncio.run(second_worker()) == "print('hello')"
+        # Entries never touched by the second worker survive its snapshot
+        assert asyncio.run(third_worker()) == {"plan": [1, 2]}
+
+    def test_snapshots_start_with_first_operation(self, tmp_path):
+        """Test periodic snapshots run without an explicit start_snapshots call"""
+        path = str(tmp_path / "agent_cache.snapshot")
+
+        async def scenario():
+            cache = AgentCache(snapshot_path=path, snapshot_interval=0.01)
+            await cache.set("CoderAgent", "hello world", "print('hello')")
+            await asyncio.sleep(0.1)
+            reader = SnapshotReader.open(path)
+            written = len(reader) if reader else 0
+            if reader:
+                reader.close()
+            await cache.close()
+            return written
+
+        assert asyncio.run(scenario()) == 1
+
+    def test_invalidation_survives_restart(self, tmp_path):
+        """Test entries invalidated before a snapshot stay invalid after a restart without Redis"""
+        path = str(tmp_path / "agent_cache.snapshot")
+
+        async def first_worker():
+            cache = AgentCache(snapshot_path=path)
+            await cache.set("Planner", "q", "old answer")
+            await cache.invalidate_agent("Planner")
+            assert await cache.get("Planner", "q") is None
+            await cache.close()
+
+        async def second_worker():
+            cache = AgentCache(snapshot_path=path)
+            result = await cache.get("Planner", "q")
+            await cache.set("Planner", "q", "new answer")
+            await cache.close()
+            return result
+
+        async def third_worker():
+            cache = AgentCache(snapshot_path=path)
+            result = await cache.get("Planner", "q")
+            await cache.close()
+            return result
+
+        asyncio.run(first_worker())
+        assert asyncio.run(second_worker()) is None
+        assert asyncio.run(third_worker()) == "new answer"
+
+    def test_snapshot_respects_ttl(self, tmp_path):
+        """Test expired snapshot entries are not restored"""
+        path = str(tmp_path / "agent_cache.snapshot")
+        write_snapshot(path, [("fresh", b"a", 60.0), ("stale", b"b", 0.001), ("forever", b"c", None)])
+        time.sleep(0.01)
+
+        reader = SnapshotReader.open(path)
+        assert reader.pop("fresh")[0] == b"a"
+        assert reader.pop("stale") is None
+        assert reader.pop("forever") == (b"c", None)
+        reader.close()
+
+    def test_stale_while_revalidate(self):
+        """Test stale values are served instantly and refreshed once in the background"""
+        cache = AgentCache(stale_ttl=100)
+        clock = FakeClock()
+        cache.local_cache.clock = clock
+        calls = []
+
+        async def search():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return f"answer {len(calls)}"
+
+        async def scenario():
+            first = await cache.get_or_compute("PlannerAgent", "query", search, ttl=10)
+            clock.advance(50)  # past ttl, within the stale window
+            stale = await asyncio.gather(*[
+                cache.get_or_compute("PlannerAgent", "query", search, ttl=10) for _ in range(5)
+            ])
+            await asyncio.sleep(0.05)
+            refreshed = await cache.get_or_compute("PlannerAgent", "query", search, ttl=10)
+            clock.advance(200)  # past the hard ttl
+            recomputed = await cache.get_or_compute("PlannerAgent", "query", search, ttl=10)
+            return first, stale, refreshed, recomputed
+
+        first, stale, refreshed, recomputed = asyncio.run(scenario())
+        assert first == "answer 1"
+        assert stale == ["answer 1"] * 5
+        assert refreshed == "answer 2"
+        assert recomputed == "answer 3"
+        refresh = cache.stats()["refresh"]
+        assert refresh["refreshes"] == 1
+        assert refresh["stale_hits"] == 5
+
+    def test_failed_refresh_keeps_stale_value(self):
+        """Test a failing refresh is counted and the stale value is kept"""
+        cache = AgentCache(stale_ttl=100)
+        clock = FakeClock()
+        cache.local_cache.clock = clock
+
+        async def failing():
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            await cache.set("PlannerAgent", "query", "old", ttl=10)
+            clock.advance(50)
+            first = await cache.get_or_compute("PlannerAgent", "query", failing, ttl=10)
+            await asyncio.sleep(0.01)
+            second = await cache.get_or_compute("PlannerAgent", "query", failing, ttl=10)
+            await asyncio.sleep(0.01)
+            return first, second
+
+        assert asyncio.run(scenario()) == ("old", "old")
+        assert cache.stats()["refresh"]["errors"] == 2
+
+    def test_config_change_misses(self):
+        """Test results from an old agent configuration are not served"""
+        cache = AgentCache()
+
+        async def scenario():
+            await cache.set("CoderAgent", "task", "old code", config=FakeAgent("CoderAgent"))
+            same = await cache.get("CoderAgent", "task", config=FakeAgent("CoderAgent"))
+            changed = await cache.get("CoderAgent", "task", config=FakeAgent("CoderAgent", llm="gpt-4"))
+            return same, changed
+
+        assert asyncio.run(scenario()) == ("old code", None)
+
+    def test_tag_invalidation(self):
+        """Test invalidating an agent or model drops only its entries"""
+        cache = AgentCache()
+        planner, coder = FakeAgent("PlannerAgent"), FakeAgent("CoderAgent", llm="gpt-4")
+
+        async def scenario():
+            await cache.set("PlannerAgent", "task", "plan", config=planner)
+            await cache.set("CoderAgent", "task", "code", config=coder)
+            await cache.invalidate_agent("PlannerAgent")
+            after_agent = (
+                await cache.get("PlannerAgent", "task", config=planner),
+                await cache.get("CoderAgent", "task", config=coder)
+            )
+            await cache.invalidate_model("gpt-4")
+            after_model = await cache.get("CoderAgent", "task", config=coder)
+            return after_agent, after_model
+
+        assert asyncio.run(scenario()) == ((None, "code"), None)
+
+    def test_invalidation_is_shared_through_redis(self):
+        """Test a tag bump on one worker is seen by another"""
+        async def scenario():
+            client = make_redis_client()
+            writer = AgentCache(redis_client=client, tag_sync_interval=0)
+            reader = AgentCache(redis_client=client, tag_sync_interval=0)
+            await writer.set("PlannerAgent", "task", "plan")
+            before = await reader.get("PlannerAgent", "task")
+            await writer.invalidate_agent("PlannerAgent")
+            after = await reader.get("PlannerAgent", "task")
+            await client.flushdb()
+            await client.aclose()
+            return before, after
+
+        assert asyncio.run(scenario()) == ("plan", None)
+
+    def test_metrics_by_tier(self):
+        """Test hits, misses, sizes and evictions reach Prometheus"""
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0.0
+
+        before = {
+            "local_hit": sample("cache_requests_total", tier="local", result="hit"),
+            "redis_hit": sample("cache_requests_total", tier="redis", result="hit"),
+            "evicted": sample("cache_evictions_total", reason="capacity"),
+            "gets": sample("cache_operation_duration_seconds_count", operation="get"),
+            "sizes": sample("cache_value_size_bytes_count"),
+        }
+
+        async def scenario():
+            client = make_redis_client()
+            writer = AgentCache(redis_client=client, max_entries=1, metrics_enabled=True)
+            reader = AgentCache(redis_client=client, metrics_enabled=True)
+            writer.metrics.sample_every = reader.metrics.sample_every = 1
+            await writer.set("PlannerAgent", "a", "plan a")
+            await writer.set("PlannerAgent", "b", "plan b")  # evicts "a" locally
+            await writer.get("PlannerAgent", "b")
+            await reader.get("PlannerAgent", "a")
+            await client.flushdb()
+            await client.aclose()
+
+        asyncio.run(scenario())
+        assert sample("cache_requests_total", tier="local", result="hit") == before["local_hit"] + 1
+        assert sample("cache_requests_total", tier="redis", result="hit") == before["redis_hit"] + 1
+        assert sample("cache_evictions_total", reason="capacity") == before["evicted"] + 1
+        assert sample("cache_operation_duration_seconds_count", operation="get") == before["gets"] + 2
+        assert sample("cache_value_size_bytes_count") == before["sizes"] + 2
+
+    def test_metrics_switch(self):
+        """Test disabled metrics leave Prometheus untouched"""
+        before = REGISTRY.get_sample_value("cache_operation_duration_seconds_count", {"operation": "get"}) or 0.0
+        cache = AgentCache(metrics_enabled=False)
+        asyncio.run(cache.get("PlannerAgent", "anything"))
+        assert cache.metrics is None
+        assert (REGISTRY.get_sample_value("cache_operation_duration_seconds_count", {"operation": "get"}) or 0.0) == before
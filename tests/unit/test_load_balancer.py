@@ -0,0 +1,670 @@
+# tests/unit/test_load_balancer.py
+import pytest
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import fakeredis
+import redis
+from prometheus_client import REGISTRY
+from config.production import ProductionConfig
+from load_balancer.agent_balancer import AgentLoadBalancer, AgentOverloadedError
+from load_balancer.circuit_breaker import CircuitBreaker, CircuitState
+from load_balancer.load_heap import LoadHeap
+from load_balancer.policies import LeastLoadPolicy, PowerOfTwoChoicesPolicy, make_policy
+from load_balancer.state_backend import (
+    FallbackStateBackend, LocalStateBackend, RedisStateBackend, SharedMemoryStateBackend, StateBackend,
+    make_state_backend
+)
+from tests.utils import FakeClock, make_redis_client
+
+class GatedAgent:
+    """Agent whose calls block until released, tracking peak concurrency"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.gate = asyncio.Event()
+        self.running = 0
+        self.peak = 0
+
+    async def arun(self, task: str):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await self.gate.wait()
+        finally:
+            self.running -= 1
+        return f"{self.name}: {task}"
+
+class FakeAgent:
+    """Stand-in for an Agent: a name and an async arun"""
+
+    def __init__(self, name: str, fail: bool = False, delay: float = 0.0):
+        self.name = name
+        self.fail = fail
+        self.delay = delay
+        self.calls = 0
+
+    async def arun(self, task: str):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        return f"{self.name}: {task}"
+
+class TestLoadHeap:
+    def test_peek_returns_least_loaded(self):
+        """Test the least loaded name is on top after updates"""
+        heap = LoadHeap(["a", "b", "c"])
+        heap.update("a", 2)
+        heap.update("b", 1)
+        assert heap.peek() == "c"
+        heap.increment("c", 5)
+        assert heap.peek() == "b"
+        heap.update("a", 0)
+        assert heap.peek() == "a"
+
+    def test_remove_and_empty(self):
+        """Test removed names are skipped lazily"""
+        heap = LoadHeap(["a", "b"])
+        assert heap.remove("a")
+        assert not heap.remove("a")
+        assert heap.peek() == "b"
+        heap.remove("b")
+        assert heap.peek() is None
+        assert len(heap) == 0
+
+    def test_stale_entries_are_compacted(self):
+        """Test repeated updates do not grow the heap without bound"""
+        heap = LoadHeap(["a", "b"])
+        for i in range(10000):
+            heap.update("a", i % 7)
+        assert len(heap._heap) <= 2 * len(heap) + 65
+        assert heap.load("a") == 9999 % 7
+
+class TestCircuitBreaker:
+    def test_opens_on_failure_rate(self):
+        """Test the breaker opens once the windowed failure rate crosses the threshold"""
+        clock = FakeClock()
+        breaker = CircuitBreaker("a", failure_rate=0.5, window=10, min_calls=4, clock=clock)
+        breaker.record_success()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.CLOSED  # Below min_calls
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        assert not breaker.allow_request()
+
+    def test_old_outcomes_leave_the_window(self):
+        """Test failures older than the window are forgotten"""
+        clock = FakeClock()
+        breaker = CircuitBreaker("a", window=10, min_calls=3, clock=clock)
+        breaker.record_failure()
+        breaker.record_failure()
+        clock.now += 11
+        breaker.record_failure()
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.stats()["calls"] == 2
+
+    def test_half_open_limits_probes(self):
+        """Test cooldown leads to a bounded number of probes"""
+        clock = FakeClock()
+        transitions = []
+        breaker = CircuitBreaker(
+            "a", min_calls=1, cooldown=5, half_open_max_calls=2, clock=clock,
+            on_state_change=lambda name, old, new: transitions.append((old.value, new.value))
+        )
+        breaker.record_failure()
+        clock.now += 5
+        assert breaker.available
+        assert breaker.allow_request() and breaker.allow_request()
+        assert not breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        clock.now += 5
+        assert breaker.allow_request()
+        breaker.release()
+        assert breaker.allow_request() and breaker.allow_request()
+        breaker.record_success()
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+        assert transitions == [
+            ("closed", "open"), ("open", "half_open"), ("half_open", "open"),
+            ("open", "half_open"), ("half_open", "closed")
+        ]
+
+class TestSelectionPolicies:
+    def test_p2c_prefers_lower_expected_completion(self):
+        """Test the faster agent wins unless it is much more loaded"""
+        policy = PowerOfTwoChoicesPolicy(alpha=0.5)
+        policy.add("fast")
+        policy.add("slow")
+        policy.record_latency("fast", 1.0)
+        policy.record_latency("slow", 5.0)
+        assert all(policy.select() == "fast" for _ in range(20))
+        policy.update_load("fast", 5)
+        assert policy.select() == "slow"
+        policy.record_latency("fast", 0.0)
+        assert policy.latency["fast"] == 0.5
+
+    def test_p2c_remove_keeps_sampling_consistent(self):
+        """Test removed agents are never selected"""
+        policy = PowerOfTwoChoicesPolicy()
+        for name in "abcd":
+            policy.add(name)
+        policy.remove("a")
+        policy.remove("missing")
+        assert "a" not in policy
+        assert {policy.select() for _ in range(200)} <= {"b", "c", "d"}
+        for name in "bcd":
+            policy.remove(name)
+        assert policy.select() is None
+
+    def test_make_policy(self):
+        """Test policies are built by configured name"""
+        assert isinstance(make_policy("least_load"), LeastLoadPolicy)
+        assert isinstance(make_policy("p2c"), PowerOfTwoChoicesPolicy)
+        with pytest.raises(ValueError):
+            make_policy("round_robin")
+
+    def test_balancer_with_p2c_policy(self):
+        """Test the balancer reports latencies to a pluggable policy"""
+        agents = [FakeAgent("Fast"), FakeAgent("Slow", delay=0.02)]
+        balancer = AgentLoadBalancer(agents, policy=PowerOfTwoChoicesPolicy())
+
+        async def scenario():
+            for _ in range(10):
+                await balancer.execute_with_balancing("task")
+
+        asyncio.run(scenario())
+        assert agents[1].calls == 1  # Tried once for a latency sample, then avoided
+        assert balancer.policy.latency["Slow"] > balancer.policy.latency["Fast"]
+
+class TestAgentLoadBalancer:
+    def test_select_least_loaded(self):
+        """Test selection follows in-flight load"""
+        agents = [FakeAgent(f"Agent{i}", delay=0.01) for i in range(3)]
+        balancer = AgentLoadBalancer(agents)
+
+        async def scenario():
+            running = [asyncio.ensure_future(balancer.execute_with_balancing("task")) for _ in range(2)]
+            await asyncio.sleep(0)
+            selected = balancer.select_agent()
+            await asyncio.gather(*running)
+            return selected
+
+        selected = asyncio.run(scenario())
+        assert balancer.agent_loads[selected.name] == 0
+        assert sorted(agent.calls for agent in agents) == [0, 1, 1]
+        assert selected.calls == 0
+
+    def test_failing_agent_is_skipped_until_cooldown(self):
+        """Test an open circuit diverts traffic, then a probe closes it again"""
+        clock = FakeClock()
+        bad, good = FakeAgent("Bad", fail=True), FakeAgent("Good")
+        balancer = AgentLoadBalancer([bad, good], clock=clock)
+        balancer.policy.update_load("Good", 1)  # Make Bad look idle
+        opened_before = REGISTRY.get_sample_value(
+            "agent_circuit_transitions_total", {"agent_name": "Bad", "from_state": "closed", "to_state": "open"}
+        ) or 0.0
+
+        async def scenario():
+            for _ in range(3):
+                with pytest.raises(RuntimeError):
+                    await balancer.execute_with_balancing("task")
+            assert balancer.breakers["Bad"].state == CircuitState.OPEN
+            assert await balancer.execute_with_balancing("task") == "Good: task"
+
+            clock.now += 31
+            bad.fail = False
+            balancer.policy.update_load("Good", 1)
+            return await balancer.execute_with_balancing("probe")
+
+        assert asyncio.run(scenario()) == "Bad: probe"
+        assert bad.calls == 4
+        assert balancer.breakers["Bad"].state == CircuitState.CLOSED
+        assert balancer.agent_loads["Bad"] == 0
+        assert REGISTRY.get_sample_value(
+            "agent_circuit_transitions_total", {"agent_name": "Bad", "from_state": "closed", "to_state": "open"}
+        ) == opened_before + 1
+        assert REGISTRY.get_sample_value("agent_circuit_state", {"agent_name": "Bad"}) == 0
+
+    def test_whole_pool_recovers_after_outage(self):
+        """Test a transient outage no longer drains the pool permanently"""
+        clock = FakeClock()
+        agents = [FakeAgent(f"Agent{i}", fail=True) for i in range(2)]
+        balancer = AgentLoadBalancer(agents, clock=clock)
+
+        async def scenario():
+            for _ in range(6):
+                with pytest.raises(RuntimeError):
+                    await balancer.execute_with_balancing("task")
+            with pytest.raises(Exception, match="No available agents"):
+                await balancer.execute_with_balancing("task")
+
+            clock.now += 31
+            for agent in agents:
+                agent.fail = False
+            # One probe per agent at a time while half-open; the third request queues
+            probes = await asyncio.gather(*(balancer.execute_with_balancing("probe") for _ in range(3)))
+            assert len(probes) == 3
+            return await asyncio.gather(*(balancer.execute_with_balancing("task") for _ in range(4)))
+
+        assert len(asyncio.run(scenario())) == 4
+        assert all(b.state == CircuitState.CLOSED for b in balancer.breakers.values())
+
+    def test_no_available_agents(self):
+        """Test an empty pool raises"""
+        balancer = AgentLoadBalancer([])
+        assert balancer.select_agent() is None
+        with pytest.raises(Exception, match="No available agents"):
+            asyncio.run(balancer.execute_with_balancing("task"))
+
+    def test_agent_its_breaker_refuses_is_skipped(self):
+        """Test a selectable agent whose breaker refuses the call is dropped, not called"""
+        clock = FakeClock()
+        bad, good = FakeAgent("Bad"), FakeAgent("Good")
+        balancer = AgentLoadBalancer([bad, good], clock=clock)
+        balancer.policy.update_load("Good", 1)  # Make Bad look idle
+        breaker = balancer.breakers["Bad"]
+        breaker.force_open(clock() + 30)  # Opened without the balancer syncing its policy
+
+        assert asyncio.run(balancer.execute_with_balancing("task")) == "Good: task"
+        assert "Bad" not in balancer.policy
+
+        clock.advance(31)
+        while breaker.allow_request():  # Someone else holds every half-open probe slot
+            pass
+        balancer.policy.add("Bad", 0)
+        balancer.policy.update_load("Good", 1)
+        assert asyncio.run(balancer.execute_with_balancing("task")) == "Good: task"
+        assert "Bad" not in balancer.policy
+        assert bad.calls == 0
+        assert balancer.agent_loads["Bad"] == 0
+
+    def test_add_and_remove_agents(self):
+        """Test replicas can join and leave the pool"""
+        balancer = AgentLoadBalancer([FakeAgent("A")])
+        balancer.add_agent(FakeAgent("B"))
+        balancer.policy.update_load("A", 3)
+        assert balancer.select_agent().name == "B"
+        assert balancer.remove_agent("B")
+        assert not balancer.remove_agent("B")
+        assert [agent.name for agent in balancer.agents] == ["A"]
+        assert balancer.select_agent().name == "A"
+
+class TestConcurrencyLimits:
+    def test_per_agent_and_global_caps(self):
+        """Test bursts queue behind the caps instead of failing"""
+        agents = [GatedAgent("A"), GatedAgent("B")]
+        balancer = AgentLoadBalancer(agents, max_concurrent=3, max_per_agent=2, max_queue=10)
+
+        async def scenario():
+            calls = [asyncio.ensure_future(balancer.execute_with_balancing(str(i))) for i in range(8)]
+            await asyncio.sleep(0.01)
+            stats = balancer.stats()
+            for agent in agents:
+                agent.gate.set()
+            results = await asyncio.gather(*calls)
+            return stats, results
+
+        stats, results = asyncio.run(scenario())
+        assert stats["inflight"] == 3 and stats["queued"] == 5
+        assert len(results) == 8
+        assert max(agent.peak for agent in agents) <= 2
+        assert sum(agent.running for agent in agents) == 0
+        assert balancer.inflight == 0
+
+    def test_queue_full_raises_overloaded(self):
+        """Test requests beyond the queue depth are rejected immediately"""
+        agent = GatedAgent("A")
+        balancer = AgentLoadBalancer([agent], max_per_agent=1, max_queue=1)
+
+        async def scenario():
+            running = asyncio.ensure_future(balancer.execute_with_balancing("first"))
+            queued = asyncio.ensure_future(balancer.execute_with_balancing("second"))
+            await asyncio.sleep(0)
+            with pytest.raises(AgentOverloadedError, match="queue is full"):
+                await balancer.execute_with_balancing("third")
+            agent.gate.set()
+            return await asyncio.gather(running, queued)
+
+        assert asyncio.run(scenario()) == ["A: first", "A: second"]
+
+    def test_queue_timeout(self):
+        """Test queued requests give up after the queue timeout and free their place"""
+        agent = GatedAgent("A")
+        balancer = AgentLoadBalancer([agent], max_per_agent=1, max_queue=5, queue_timeout=0.01)
+
+        async def scenario():
+            running = asyncio.ensure_future(balancer.execute_with_balancing("first"))
+            await asyncio.sleep(0)
+            with pytest.raises(AgentOverloadedError, match="No agent slot"):
+                await balancer.execute_with_balancing("second")
+            assert balancer.stats()["queued"] == 0
+            agent.gate.set()
+            return await running
+
+        assert asyncio.run(scenario()) == "A: first"
+        assert balancer.inflight == 0
+
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        """Test cancelling a queued request leaves capacity intact"""
+        agent = GatedAgent("A")
+        balancer = AgentLoadBalancer([agent], max_per_agent=1, max_queue=5)
+
+        async def scenario():
+            running = asyncio.ensure_future(balancer.execute_with_balancing("first"))
+            queued = asyncio.ensure_future(balancer.execute_with_balancing("second"))
+            await asyncio.sleep(0)
+            queued.cancel()
+            agent.gate.set()
+            await running
+            return await balancer.execute_with_balancing("third")
+
+        assert asyncio.run(scenario()) == "A: third"
+        assert balancer.inflight == 0
+        assert balancer.agent_loads["A"] == 0
+
+class TestBatchDispatch:
+    def test_execute_many_keeps_input_order_and_reports_failures(self):
+        """Test results follow input order and a failure does not cancel the batch"""
+        class FlakyAgent(FakeAgent):
+            async def arun(self, task: str):
+                await asyncio.sleep(0.001 * (10 - int(task)))  # Later tasks finish first
+                if task == "3":
+                    raise ValueError("bad input")
+                return task
+
+        balancer = AgentLoadBalancer([FlakyAgent("A"), FlakyAgent("B")], max_per_agent=3)
+        results = asyncio.run(balancer.execute_many([str(i) for i in range(10)], max_concurrency=4))
+
+        assert [item.index for item in results] == list(range(10))
+        assert [item.result for item in results if item.ok] == ["0", "1", "2", "4", "5", "6", "7", "8", "9"]
+        assert isinstance(results[3].error, ValueError)
+        assert sum(breaker.stats()["failures"] for breaker in balancer.breakers.values()) == 1
+        assert balancer.inflight == 0
+
+    def test_iter_many_streams_and_bounds_fan_out(self):
+        """Test results stream in completion order with at most max_concurrency in flight"""
+        agent = GatedAgent("A")
+        balancer = AgentLoadBalancer([agent], max_per_agent=10)
+
+        async def scenario():
+            seen = []
+            agent.gate.set()
+            async for item in balancer.iter_many(["a", "b", "c", "d", "e"], max_concurrency=2):
+                seen.append(item.task)
+            return seen
+
+        assert sorted(asyncio.run(scenario())) == ["a", "b", "c", "d", "e"]
+        assert agent.peak <= 2
+        assert asyncio.run(balancer.execute_many([])) == []
+
+    def test_stopping_a_stream_cancels_remaining_work(self):
+        """Test breaking out of iter_many releases every slot"""
+        agent = FakeAgent("A", delay=0.01)
+        balancer = AgentLoadBalancer([agent], max_per_agent=4)
+
+        async def scenario():
+            async for item in balancer.iter_many([str(i) for i in range(20)], max_concurrency=4):
+                break
+            return item
+
+        assert asyncio.run(scenario()).ok
+        assert balancer.inflight == 0
+        assert agent.calls < 20
+
+class TestHedging:
+    def make_balancer(self, agents, **kwargs):
+        balancer = AgentLoadBalancer(agents, hedge_percentile=0.9, **kwargs)
+        # Seed the latency window so the hedge delay stays ~1ms for the whole test
+        for _ in range(500):
+            balancer._record_latency(0.001)
+        return balancer
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        """Test a hung request is duplicated to another agent and the loser cancelled"""
+        hung, fast = GatedAgent("Hung"), FakeAgent("Fast")
+        balancer = self.make_balancer([hung, fast], hedge_budget=1.0)
+        balancer.policy.update_load("Fast", 1)  # Route the primary to Hung
+
+        result = asyncio.run(balancer.execute_with_balancing("task"))
+
+        assert result == "Fast: task"
+        assert balancer.hedge_counters["hedged"] == 1
+        assert balancer.hedge_counters["hedge_wins"] == 1
+        assert hung.running == 0  # Loser was cancelled
+        assert balancer.inflight == 0
+        assert balancer.breakers["Hung"].stats()["failures"] == 0
+
+    def test_cancelled_primary_does_not_break_the_hedge(self):
+        """Test a contender cancelled underneath the balancer is treated as lost, not raised"""
+        class CancelledAgent(FakeAgent):
+            async def arun(self, task: str):
+                await asyncio.sleep(0.005)  # Outlive the hedge delay
+                raise asyncio.CancelledError()
+
+        balancer = self.make_balancer([CancelledAgent("Gone"), FakeAgent("Fast", delay=0.01)], hedge_budget=1.0)
+        balancer.policy.update_load("Fast", 1)  # Route the primary to Gone
+
+        assert asyncio.run(balancer.execute_with_balancing("task")) == "Fast: task"
+        assert balancer.hedge_counters["hedge_wins"] == 1
+        assert balancer.inflight == 0
+
+    def test_outer_cancellation_cancels_both_contenders(self):
+        """Test cancelling a hedged request waits for both contenders to give their slots back"""
+        slow, slower = GatedAgent("Slow"), GatedAgent("Slower")
+        balancer = self.make_balancer([slow, slower], hedge_budget=1.0)
+
+        async def scenario():
+            request = asyncio.ensure_future(balancer.execute_with_balancing("task"))
+            while balancer.hedge_counters["hedged"] == 0:
+                await asyncio.sleep(0.001)
+            assert slow.running == slower.running == 1
+            request.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await request
+
+        asyncio.run(scenario())
+        assert slow.running == slower.running == 0
+        assert balancer.inflight == 0
+        assert all(load == 0 for load in balancer.agent_loads.values())
+
+    def test_fast_requests_are_not_hedged(self):
+        """Test requests finishing before the percentile never hedge"""
+        agents = [FakeAgent("A"), FakeAgent("B")]
+        balancer = self.make_balancer(agents, hedge_budget=1.0)
+
+        async def scenario():
+            for _ in range(20):
+                await balancer.execute_with_balancing("task")
+
+        asyncio.run(scenario())
+        assert balancer.hedge_counters["hedged"] == 0
+        assert sum(agent.calls for agent in agents) == 20
+
+    def test_hedge_budget_bounds_extra_requests(self):
+        """Test hedges stay within the budgeted fraction of requests"""
+        agents = [FakeAgent("A", delay=0.005), FakeAgent("B", delay=0.005)]
+        balancer = self.make_balancer(agents, hedge_budget=0.1)
+
+        async def scenario():
+            for _ in range(40):
+                await balancer.execute_with_balancing("task")
+
+        asyncio.run(scenario())
+        assert 1 <= balancer.hedge_counters["hedged"] <= 4
+        assert sum(agent.calls for agent in agents) == 40 + balancer.hedge_counters["hedged"]
+
+    def test_hedging_disabled_by_default(self):
+        """Test hedging is opt-in"""
+        balancer = AgentLoadBalancer([FakeAgent("A")])
+        assert balancer.hedge_percentile is None
+        assert asyncio.run(balancer.execute_with_balancing("task")) == "A: task"
+
+class BrokenStateBackend(StateBackend):
+    def __init__(self):
+        self.broken = True
+        self.inner = LocalStateBackend()
+
+    async def sync(self, names, deltas, opened):
+        if self.broken:
+            raise redis.ConnectionError("connection refused")
+        return await self.inner.sync(names, deltas, opened)
+
+class TestSharedState:
+    def test_shared_memory_counters_are_shared(self, tmp_path):
+        """Test two mappings of the same file see each other's updates"""
+        path = str(tmp_path / "state")
+
+        async def scenario():
+            first, second = SharedMemoryStateBackend(path, slots=64), SharedMemoryStateBackend(path, slots=64)
+            await first.sync(["A"], {"A": 3}, {"B": 123.0})
+            loads, open_until = await second.sync(["A", "B"], {"A": -1}, {})
+            await first.close()
+            await second.close()
+            return loads, open_until
+
+        assert asyncio.run(scenario()) == ({"A": 2, "B": 0}, {"B": 123.0})
+        with pytest.raises(ValueError):
+            SharedMemoryStateBackend(path, slots=32)
+
+    def test_shared_memory_drops_load_of_dead_worker(self, tmp_path):
+        """Test load left by a worker that exited without closing stops counting once reaped"""
+        path = str(tmp_path / "state")
+        clock = FakeClock()
+        backend = SharedMemoryStateBackend(path, slots=64, reap_interval=5, clock=clock)
+        child = (
+            "import asyncio\n"
+            "from load_balancer.state_backend import SharedMemoryStateBackend\n"
+            f"backend = SharedMemoryStateBackend({path!r}, slots=64)\n"
+            "asyncio.run(backend.sync(['A'], {'A': 5}, {}))\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        subprocess.run([sys.executable, "-c", child], check=True, cwd=root)
+
+        async def scenario():
+            before_reap = await backend.sync(["A"], {"A": 1}, {})
+            clock.advance(5)
+            after_reap = await backend.sync(["A"], {}, {})
+            await backend.close()
+            return before_reap, after_reap
+
+        assert asyncio.run(scenario()) == (({"A": 6}, {}), ({"A": 1}, {}))
+
+    def test_redis_backend(self):
+        """Test worker loads are summed and open times only move forward"""
+        server = fakeredis.FakeServer()
+
+        async def scenario():
+            first = RedisStateBackend(make_redis_client(server), prefix="test-agentlb", worker_id="w1")
+            second = RedisStateBackend(make_redis_client(server), prefix="test-agentlb", worker_id="w2")
+            await first.sync(["A"], {"A": 2}, {"A": 200.0})
+            await first.sync(["A"], {"A": 1}, {})
+            state = await second.sync(["A", "B"], {"A": 1, "B": 1}, {"A": 100.0})
+            await first.close()
+            closed = await second.sync(["A", "B"], {}, {})
+            await second.redis_client.delete("test-agentlb:open_until")
+            await second.close()
+            return state, closed
+
+        state, closed = asyncio.run(scenario())
+        assert state == ({"A": 4, "B": 1}, {"A": 200.0})
+        assert closed == ({"A": 1, "B": 1}, {"A": 200.0})
+
+    def test_redis_worker_load_expires(self):
+        """Test load of a worker that stopped syncing stops counting after its TTL"""
+        server = fakeredis.FakeServer()
+
+        async def scenario():
+            dead = RedisStateBackend(make_redis_client(server), prefix="test-agentlb", ttl=0.05, worker_id="dead")
+            live = RedisStateBackend(make_redis_client(server), prefix="test-agentlb", worker_id="live")
+            await dead.sync(["A"], {"A": 3}, {})
+            before = await live.sync(["A"], {"A": 1}, {})
+            await asyncio.sleep(0.1)
+            after = await live.sync(["A"], {}, {})
+            workers = await live.redis_client.zrange(live.workers_key, 0, -1)
+            await live.close()
+            await dead.redis_client.aclose()
+            return before, after, workers
+
+        before, after, workers = asyncio.run(scenario())
+        assert before == ({"A": 4}, {})
+        assert after == ({"A": 1}, {})
+        assert workers == [b"live"]
+
+    def test_fallback_replays_changes_after_outage(self):
+        """Test a failing shared backend degrades to local state and catches up later"""
+        clock = FakeClock()
+        primary = BrokenStateBackend()
+        backend = FallbackStateBackend(primary, retry_interval=5, clock=clock)
+
+        async def scenario():
+            degraded = await backend.sync(["A"], {"A": 2}, {})
+            assert backend.degraded
+            await backend.sync(["A"], {"A": -1}, {})  # Not retried inside the interval
+            primary.broken = False
+            clock.now += 5
+            recovered = await backend.sync(["A"], {}, {})
+            return degraded, recovered
+
+        degraded, recovered = asyncio.run(scenario())
+        assert degraded == ({"A": 2}, {})
+        assert recovered == ({"A": 1}, {})
+        assert primary.inner.loads["A"] == 1
+        assert not backend.degraded
+
+    def test_unavailable_shared_memory_degrades_to_local_state(self, tmp_path, monkeypatch):
+        """Test a shm file that cannot be created does not break the balancer"""
+        monkeypatch.setattr(ProductionConfig, "BALANCER_STATE_SHM_PATH", str(tmp_path / "missing" / "state"))
+        backend = make_state_backend("shm")
+        balancer = AgentLoadBalancer([FakeAgent("A")], state_backend=backend)
+
+        async def scenario():
+            balancer._adjust_load("A", 2)
+            await balancer.sync_state()
+            await balancer.close()
+
+        asyncio.run(scenario())
+        assert backend.degraded
+        assert backend.local.loads["A"] == 2
+
+    def test_balancers_share_load_and_open_circuits(self, tmp_path):
+        """Test two worker balancers avoid an agent the other one is loading or saw fail"""
+        path = str(tmp_path / "state")
+        gated, other = GatedAgent("A"), GatedAgent("B")
+
+        async def scenario():
+            worker_1 = AgentLoadBalancer([gated, other], state_backend=SharedMemoryStateBackend(path, slots=64))
+            worker_2 = AgentLoadBalancer(
+                [FakeAgent("A"), FakeAgent("B")], state_backend=SharedMemoryStateBackend(path, slots=64)
+            )
+            running = [asyncio.ensure_future(worker_1.execute_with_balancing("x")) for _ in range(3)]
+            await asyncio.sleep(0)
+            await worker_1.sync_state()
+            await worker_2.sync_state()
+            busy = {name: worker_2.remote_loads[name] for name in ("A", "B")}
+            chosen = worker_2.select_agent().name
+            least_loaded = min(("A", "B"), key=lambda name: busy[name])
+
+            worker_1.breakers["A"].force_open(worker_1.clock() + 30)
+            await worker_1.sync_state()
+            await worker_2.sync_state()
+            opened = worker_2.breakers["A"].state
+
+            gated.gate.set()
+            other.gate.set()
+            await asyncio.gather(*running)
+            await worker_1.close()
+            await worker_2.close()
+            return busy, chosen, least_loaded, opened
+
+        busy, chosen, least_loaded, opened = asyncio.run(scenario())
+        assert sum(busy.values()) == 3
+        assert chosen == least_loaded
+        assert opened == CircuitState.OPEN
@@ -0,0 +1,160 @@
+import logging
+import pytest
+from optimization.context_packer import BM25Index, pack_context, split_chunks
+from optimization.token_optimizer import TokenOptimizer
+from tests.utils import WordEncoder
+
+def make_optimizer(max_tokens: int) -> TokenOptimizer:
+    optimizer = TokenOptimizer(encoder=WordEncoder())
+    optimizer.max_tokens = max_tokens
+    return optimizer
+
+class TestTokenOptimizer:
+    def test_context_that_fits_is_kept(self):
+        """Test a context within the limit is passed through untouched"""
+        optimizer = make_optimizer(8000)
+        assert optimizer.optimize_prompt("Summarize", "One. Two.") == "Summarize\n\nContext: One. Two."
+
+    def test_truncates_at_sentence_boundary(self):
+        """Test an oversized context is cut back to the last whole sentence in budget"""
+        optimizer = make_optimizer(75)
+        context = ". ".join(f"Sentence number {i} is here" for i in range(20))
+
+        result = optimizer.optimize_prompt("Summarize", context)
+        kept = result.split("Context (truncated): ", 1)[1]
+        # 75 - 1 prompt token - 50 buffer leaves 24 tokens; each sentence and ". " is 11
+        assert kept == "Sentence number 0 is here. Sentence number 1 is here. "
+
+    def test_encodes_context_once(self):
+        """Test truncation works from a single encoding of just a prefix of the context"""
+        optimizer = make_optimizer(100)
+        context = ". ".join(f"Sentence {i}" for i in range(500))
+        optimizer.optimize_prompt("Summarize", context)
+        assert optimizer.encoder.encode_calls == 2  # prompt and context
+        assert optimizer.encoder.encoded_chars < len(context) / 2
+
+    def test_long_context_that_fits_is_encoded_whole(self):
+        """Test a context with few tokens per character is still measured exactly"""
+        optimizer = make_optimizer(100)
+        context = "word" + " " * 2000 + "end."
+        assert optimizer.optimize_prompt("Summarize", context) == f"Summarize\n\nContext: {context}"
+
+    def test_prompt_token_counts_are_memoized(self):
+        """Test a repeated prompt is only encoded the first time"""
+        optimizer = make_optimizer(8000)
+        for _ in range(3):
+            optimizer.optimize_prompt("Summarize the repository", "Short context.")
+        assert optimizer.encoder.encode_calls == 4
+        assert optimizer.count_tokens.cache_info().hits == 2
+
+    def test_keeps_token_cut_without_sentence_boundary(self):
+        """Test a context with no sentence break is cut at the token budget"""
+        optimizer = make_optimizer(60)
+        result = optimizer.optimize_prompt("Summarize", " ".join(["word"] * 100))
+        kept = result.split("Context (truncated): ", 1)[1]
+        assert len(optimizer.encoder.encode(kept)) == 9
+
+PLANNING_MD = """# Planning
+
+## Overview
+The service exposes a REST API for managing todo items.
+
+## Authentication
+Users log in with OAuth and receive a JWT token. Tokens expire after one hour.
+
+## Storage
+Todo items are stored in PostgreSQL with a migration per schema change.
+
+```python
+def save_item(item):
+
+    db.insert(item)
+```
+
+## Deployment
+The app ships as a Docker image deployed to Kubernetes."""
+
+class TestContextPacker:
+    def test_split_keeps_code_blocks_whole(self):
+        """Test markdown is split on blank lines except inside fenced code"""
+        chunks = split_chunks(PLANNING_MD)
+        assert len(chunks) == 6
+        assert chunks[0] == "# Planning"
+        assert chunks[2].startswith("## Authentication\nUsers log in")
+        assert chunks[4].startswith("```python") and chunks[4].endswith("```")
+
+    def test_split_unclosed_fence_falls_back_to_blank_lines(self):
+        """Test a code block cut off before its closing fence does not swallow the rest"""
+        context = "intro\n\n```python\n" + "def f(): pass\n\n" * 200
+        chunks = split_chunks(context)
+        assert len(chunks) == 201
+        assert chunks[1] == "```python\ndef f(): pass"
+        assert len(pack_context("def f", context, 40, lambda text: len(text.split())).kept) > 1
+
+    def test_bm25_ranks_matching_document_first(self):
+        """Test documents sharing rare query terms score highest"""
+        index = BM25Index(["the cache stores items", "jwt token expiry for auth", "the deploy step"])
+        scores = index.scores("When does the JWT token expire?")
+        assert scores.index(max(scores)) == 1
+        assert scores[2] < scores[1]
+
+    def test_packs_relevant_chunks_in_original_order(self):
+        """Test the budget goes to the most relevant chunks, which keep their order"""
+        encoder = WordEncoder()
+        count = lambda text: len(encoder.encode(text))
+        chunks = split_chunks(PLANNING_MD)
+        budget = count(chunks[2]) + 1 + count(chunks[0])
+
+        packed = pack_context("How do users authenticate with OAuth and JWT?", PLANNING_MD, budget, count)
+        assert packed.kept == [0, 2]
+        assert packed.text == chunks[0] + "\n\n" + chunks[2]
+        assert packed.dropped == [1, 3, 4, 5]
+        assert packed.dropped_chunks[0].startswith("## Overview")
+
+    def test_skips_chunks_that_no_longer_fit(self):
+        """Test a large relevant chunk that overflows gives way to smaller ones"""
+        count = lambda text: len(text.split())
+        context = "docker docker docker kubernetes image build\n\ndocker compose\n\nunrelated words"
+        packed = pack_context("docker", context, 5, count)
+        assert packed.kept == [1, 2]
+
+    def test_oversized_block_is_split_into_sentences(self):
+        """Test a block larger than the budget is packed sentence by sentence, not dropped"""
+        optimizer = make_optimizer(100)
+        result = optimizer.optimize_prompt("Summarize", "The cache stores values. " * 200, strategy="relevance")
+        kept = result.split("Context (relevant excerpts): ", 1)[1]
+        assert kept.startswith("The cache stores values. The cache stores values.")
+        assert len(optimizer.encoder.encode(kept)) <= 49
+
+    def test_oversized_sentence_is_cut_to_budget(self):
+        """Test a single sentence larger than the budget is cut rather than dropped"""
+        optimizer = make_optimizer(100)
+        packed = optimizer.pack_context("cache", " ".join(["cache"] * 500), budget=20)
+        assert packed.kept == [0]
+        assert len(optimizer.encoder.encode(packed.text)) == 20
+
+    def test_optimize_prompt_relevance_strategy(self):
+        """Test the relevance strategy keeps a late relevant section that truncation drops"""
+        optimizer = make_optimizer(120)
+        prompt = "Which database stores the todo items?"
+
+        truncated = optimizer.optimize_prompt(prompt, PLANNING_MD)
+        packed = optimizer.optimize_prompt(prompt, PLANNING_MD, strategy="relevance")
+        assert "PostgreSQL" not in truncated
+        assert "Context (relevant excerpts):" in packed
+        assert "PostgreSQL" in packed
+
+    def test_optimize_prompt_logs_dropped_chunks(self, caplog):
+        """Test the relevance strategy reports which chunks it cut"""
+        optimizer = make_optimizer(120)
+        prompt = "Which database stores the todo items?"
+        expected = optimizer.pack_context(prompt, PLANNING_MD, 120 - optimizer.count_tokens(prompt) - 50)
+        with caplog.at_level(logging.INFO, logger="optimization.token_optimizer"):
+            optimizer.optimize_prompt(prompt, PLANNING_MD, strategy="relevance")
+        assert expected.dropped
+        assert f"dropped {len(expected.dropped)} of {len(expected.chunks)} chunks: {expected.dropped}" in caplog.text
+
+    def test_rejects_unknown_strategy(self):
+        """Test an unknown strategy name is rejected"""
+        with pytest.raises(ValueError):
+            make_optimizer(100).optimize_prompt("prompt", "context", strategy="embeddings")
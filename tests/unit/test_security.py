@@ -0,0 +1,468 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import redis.asyncio as aioredis
+from cryptography.fernet import InvalidToken
+from hypothesis import given, strategies as st
+from config.production import ProductionConfig
+from security.key_manager import SecureKeyManager
+from security.rate_limiter import DistributedRateLimiter, RateLimiter, TokenRateLimiter
+from security.validator import SecurityValidator, StreamSanitizer, ValidationResult
+from tests.utils import FakeClock, make_redis_client
+
+class FakeSecretsClient:
+    """Local stand-in for the Secrets Manager client"""
+
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.calls = 0
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_secret_value(self, SecretId: str):
+        self.calls += 1
+        self.release.wait(5)
+        if self.fail:
+            raise ConnectionError("secrets manager unavailable")
+        return {"SecretString": self.secrets[SecretId]}
+
+class TestRateLimiter:
+    def test_burst_then_steady_rate(self):
+        """Test a full burst is allowed, then one request per emission interval"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=60, burst=3, clock=clock)
+
+        assert [limiter.is_allowed("client")[0] for _ in range(3)] == [True] * 3
+        allowed, wait = limiter.is_allowed("client")
+        assert not allowed
+        assert wait == pytest.approx(1.0)
+
+        clock.advance(1.0)
+        assert limiter.is_allowed("client") == (True, None)
+        assert not limiter.is_allowed("client")[0]
+
+    def test_default_burst_matches_per_minute_limit(self):
+        """Test a client can spend its whole minute's allowance at once, but no more"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=10, clock=clock)
+
+        assert all(limiter.is_allowed("client")[0] for _ in range(10))
+        allowed, wait = limiter.is_allowed("client")
+        assert not allowed
+        assert wait == pytest.approx(6.0)
+
+    def test_denied_requests_do_not_extend_wait(self):
+        """Test retrying while limited does not push the allowed time further out"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=60, burst=1, clock=clock)
+        limiter.is_allowed("client")
+
+        for _ in range(5):
+            assert not limiter.is_allowed("client")[0]
+        clock.advance(1.0)
+        assert limiter.is_allowed("client")[0]
+
+    def test_clients_are_independent(self):
+        """Test one client's usage does not limit another"""
+        limiter = RateLimiter(requests_per_minute=60, burst=1, clock=FakeClock())
+
+        assert limiter.is_allowed("a")[0]
+        assert not limiter.is_allowed("a")[0]
+        assert limiter.is_allowed("b")[0]
+
+    def test_idle_clients_are_evicted(self):
+        """Test clients whose bucket has refilled are dropped as traffic continues"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=60, burst=5, clock=clock)
+        for i in range(100):
+            limiter.is_allowed(f"idle{i}")
+        assert len(limiter) == 100
+
+        clock.advance(2.0)
+        for _ in range(60):
+            limiter.is_allowed("active")
+            clock.advance(1.0)
+        assert len(limiter) == 1
+
+    def test_throttled_clients_do_not_block_eviction(self):
+        """Test a limited client at the least recently used end does not shield idle ones"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=60, burst=1, clock=clock)
+        limiter.is_allowed("throttled")
+        for i in range(100):
+            limiter.is_allowed(f"idle{i}")
+
+        clock.advance(1.0)
+        for _ in range(60):
+            limiter.tat["throttled"] = clock() + 3600  # Keeps hammering, never allowed
+            assert limiter.is_allowed("throttled")[0] is False
+            limiter.is_allowed("active")
+            clock.advance(1.0)
+        assert sorted(limiter.tat) == ["active", "throttled"]
+
+    def test_evict_idle_keeps_limited_clients(self):
+        """Test a full sweep only drops clients with nothing left to remember"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=60, burst=2, clock=clock)
+        limiter.is_allowed("busy")
+        limiter.is_allowed("busy")
+        limiter.is_allowed("idle")
+        clock.advance(1.5)
+
+        assert limiter.evict_idle() == 1
+        assert list(limiter.tat) == ["busy"]
+
+    def test_rejects_invalid_limits(self):
+        """Test non-positive rates and bursts are rejected"""
+        with pytest.raises(ValueError):
+            RateLimiter(requests_per_minute=0)
+        with pytest.raises(ValueError):
+            RateLimiter(requests_per_minute=60, burst=0)
+
+class TestDistributedRateLimiter:
+    def test_burst_then_deny_with_wait(self):
+        """Test the shared limit allows a burst and reports the wait after it"""
+        async def scenario():
+            limiter = DistributedRateLimiter(60, burst=2, redis_client=make_redis_client(), prefix=uuid.uuid4().hex)
+            assert await limiter.is_allowed("client") == (True, None)
+            assert await limiter.is_allowed("client") == (True, None)
+            allowed, wait = await limiter.is_allowed("client")
+            assert not allowed
+            assert 0.9 <= wait <= 1.0
+            await limiter.close()
+
+        asyncio.run(scenario())
+
+    def test_workers_share_one_limit(self):
+        """Test two limiters on the same Redis together stay within the limit"""
+        async def scenario():
+            client = make_redis_client()
+            prefix = uuid.uuid4().hex
+            workers = [DistributedRateLimiter(60, burst=5, redis_client=client, prefix=prefix) for _ in range(2)]
+            results = [await workers[i % 2].is_allowed("client") for i in range(10)]
+            assert sum(allowed for allowed, _ in results) == 5
+            await client.aclose()
+
+        asyncio.run(scenario())
+
+    def test_batch_checks_in_order(self):
+        """Test a batch is decided in order, including repeated clients"""
+        async def scenario():
+            limiter = DistributedRateLimiter(60, burst=1, redis_client=make_redis_client(), prefix=uuid.uuid4().hex)
+            results = await limiter.is_allowed_many(["a", "b", "a", "c"])
+            assert [allowed for allowed, _ in results] == [True, True, False, True]
+            assert await limiter.is_allowed_many([]) == []
+            await limiter.close()
+
+        asyncio.run(scenario())
+
+    def test_client_keys_expire_when_idle(self):
+        """Test client state in Redis expires once the bucket would be full again"""
+        async def scenario():
+            client = make_redis_client()
+            prefix = uuid.uuid4().hex
+            limiter = DistributedRateLimiter(60, burst=3, redis_client=client, prefix=prefix)
+            await limiter.is_allowed("client")
+            ttl = await client.pttl(f"{prefix}:client")
+            assert 0 < ttl <= 1000
+            await limiter.close()
+
+        asyncio.run(scenario())
+
+    def test_falls_back_to_local_limit_when_redis_is_down(self):
+        """Test requests are still limited per process while Redis is unreachable"""
+        async def scenario():
+            clock = FakeClock()
+            limiter = DistributedRateLimiter(
+                60, burst=2, redis_client=aioredis.from_url("redis://127.0.0.1:1"), clock=clock
+            )
+            results = [await limiter.is_allowed("client") for _ in range(3)]
+            assert [allowed for allowed, _ in results] == [True, True, False]
+            assert limiter.degraded
+
+            clock.advance(limiter.retry_interval)
+            assert not limiter.degraded
+
+        asyncio.run(scenario())
+
+class TestTokenRateLimiter:
+    def test_acquire_within_quota_does_not_wait(self):
+        """Test requests that fit the current allowance return immediately"""
+        async def scenario():
+            limiter = TokenRateLimiter(tokens_per_minute=60000, requests_per_minute=600)
+            waits = [await limiter.acquire(1000) for _ in range(10)]
+            assert max(waits) < 0.01
+            assert limiter.tokens == pytest.approx(50000, abs=100)
+
+        asyncio.run(scenario())
+
+    def test_acquire_waits_for_token_refill(self):
+        """Test a charge larger than what is left waits for the bucket to refill"""
+        async def scenario():
+            # 1000 tokens per second
+            limiter = TokenRateLimiter(tokens_per_minute=60000, requests_per_minute=60000)
+            await limiter.acquire(60000)
+            waited = await limiter.acquire(50)
+            assert 0.04 <= waited < 0.2
+
+        asyncio.run(scenario())
+
+    def test_acquire_waits_for_request_quota(self):
+        """Test the requests-per-minute quota limits calls that cost no tokens"""
+        async def scenario():
+            # 20 requests per second
+            limiter = TokenRateLimiter(tokens_per_minute=60000, requests_per_minute=1200)
+            limiter.requests = 0.0
+            start = time.monotonic()
+            await asyncio.gather(*(limiter.acquire() for _ in range(2)))
+            assert 0.09 <= time.monotonic() - start < 0.3
+
+        asyncio.run(scenario())
+
+    def test_waiters_are_served_in_order(self):
+        """Test a large waiting request is not starved by smaller ones behind it"""
+        async def scenario():
+            limiter = TokenRateLimiter(tokens_per_minute=60000, requests_per_minute=60000)
+            await limiter.acquire(60000)
+            order = []
+
+            async def call(name: str, tokens: int):
+                await limiter.acquire(tokens)
+                order.append(name)
+
+            await asyncio.gather(call("large", 100), call("small", 1))
+            assert order == ["large", "small"]
+
+        asyncio.run(scenario())
+
+    def test_retry_after_blocks_all_callers(self):
+        """Test a provider Retry-After hint delays the next call by at least its duration"""
+        async def scenario():
+            limiter = TokenRateLimiter(tokens_per_minute=60000, requests_per_minute=60000)
+            limiter.retry_after(0.1)
+            waited = await limiter.acquire(10)
+            assert waited >= 0.1
+
+        asyncio.run(scenario())
+
+    def test_settle_refunds_overestimate(self):
+        """Test unused estimated tokens are returned to the bucket"""
+        async def scenario():
+            limiter = TokenRateLimiter(tokens_per_minute=60000, requests_per_minute=60000)
+            await limiter.acquire(60000)
+            limiter.settle(estimated=60000, actual=1000)
+            assert await limiter.acquire(1000) < 0.01
+
+        asyncio.run(scenario())
+
+    def test_rejects_cost_above_quota(self):
+        """Test a request that could never fit fails instead of waiting forever"""
+        limiter = TokenRateLimiter(tokens_per_minute=1000, requests_per_minute=10)
+        with pytest.raises(ValueError):
+            asyncio.run(limiter.acquire(1001))
+
+class TestSecurityValidator:
+    def test_blocks_any_pattern_case_insensitively(self):
+        """Test every blocked pattern is caught by the combined scan"""
+        validator = SecurityValidator(ProductionConfig())
+        for text in ("my PASSWORD is", "call eval(x)", "__IMPORT__('os')", "os.Popen", "subprocess.run"):
+            assert not validator.validate_input(text)
+        assert validator.validate_input("Build a REST API for a todo app")
+
+    def test_rejects_oversized_input(self):
+        """Test input over the length limit is rejected"""
+        validator = SecurityValidator(ProductionConfig())
+        assert not validator.validate_input("a" * 10001)
+
+    def test_validate_many_reports_rule_per_item(self):
+        """Test a batch gets one verdict per input, naming the rule that failed"""
+        validator = SecurityValidator(ProductionConfig())
+        results = validator.validate_many(["plan a todo app", "run os.POPEN('ls')", "x" * 10001])
+        assert results == [
+            ValidationResult(True),
+            ValidationResult(False, r"system|popen|subprocess", "popen"),
+            ValidationResult(False, "max_length")
+        ]
+
+    def test_validate_many_checks_length_before_scanning(self):
+        """Test an oversized input is rejected for length even when it also matches a pattern"""
+        validator = SecurityValidator(ProductionConfig())
+        assert validator.validate_many(["eval " * 3000])[0].rule == "max_length"
+        assert not validator.validate_input("eval " * 3000)
+
+    def test_large_inputs_are_scanned_in_chunks(self):
+        """Test matches are found in a process pool, including across chunk boundaries"""
+        validator = SecurityValidator(ProductionConfig())
+        validator.chunk_size = 1000
+        clean = "a" * 5000
+        split = "a" * 995 + "subprocess" + "a" * 3000
+        late = "a" * 4990 + "exec"
+        try:
+            results = validator.validate_many([clean, split, late], max_length=10 ** 6)
+        finally:
+            validator.close()
+        assert [result.match for result in results] == [None, "subprocess", "exec"]
+        assert results[0].valid
+
+    def test_rejects_chunk_size_not_above_overlap(self):
+        """Test a chunk size that leaves no room past the overlap is refused up front"""
+        config = ProductionConfig()
+        config.VALIDATION_CHUNK_SIZE = SecurityValidator.CHUNK_OVERLAP
+        with pytest.raises(ValueError):
+            SecurityValidator(config)
+
+    def test_sanitize_output(self):
+        """Test secret tokens are redacted and other text is kept"""
+        validator = SecurityValidator(ProductionConfig())
+        assert validator.sanitize_output("key sk-abc123 and api_key=XYZ.") == "key [REDACTED] and [REDACTED]."
+
+    def test_sanitize_stream(self):
+        """Test streamed chunks come out sanitized"""
+        async def chunks():
+            for chunk in ("use s", "k-ab", "c123 now"):
+                yield chunk
+
+        async def scenario():
+            validator = SecurityValidator(ProductionConfig())
+            return "".join([text async for text in validator.sanitize_stream(chunks())])
+
+        assert asyncio.run(scenario()) == "use [REDACTED] now"
+
+# Text biased towards secret prefixes and token characters
+stream_text = st.lists(
+    st.sampled_from(["sk-", "api_key=", "s", "k", "-", "api_", "key", "=", "abc", "Z9", " ", ".", "\n", "x"]),
+    max_size=40
+).map("".join)
+
+class TestStreamSanitizer:
+    @given(stream_text, st.lists(st.integers(min_value=0, max_value=60), max_size=10))
+    def test_matches_whole_string_sanitization(self, text, cuts):
+        """Test any chunking of a stream gives the same result as sanitizing it whole"""
+        cuts = sorted(min(cut, len(text)) for cut in cuts)
+        chunks = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+        sanitizer = StreamSanitizer()
+        streamed = "".join(sanitizer.feed(chunk) for chunk in chunks) + sanitizer.flush()
+        assert streamed == SecurityValidator(ProductionConfig()).sanitize_output(text)
+
+    def test_releases_safe_text_promptly(self):
+        """Test only a possible secret prefix is held back"""
+        sanitizer = StreamSanitizer()
+        assert sanitizer.feed("hello world, this is fine") == "hello world, this"
+        assert sanitizer.feed(" and sk-") == " is fine"
+        assert sanitizer.feed("abc") == " and "
+        assert sanitizer.feed(" done") == "[REDACTED]"
+        assert sanitizer.flush() == " done"
+
+class TestSecureKeyManager:
+    def make_manager(self, client, clock):
+        return SecureKeyManager(use_aws_secrets=True, secrets_client=client, ttl=300, refresh_ahead=60, clock=clock)
+
+    def test_cached_until_refresh_window(self):
+        """Test repeated lookups within the TTL do not call the backend"""
+        client = FakeSecretsClient({"openai": "sk-1"})
+        clock = FakeClock()
+        manager = self.make_manager(client, clock)
+
+        assert [manager.get_api_key("openai") for _ in range(5)] == ["sk-1"] * 5
+        clock.advance(200)
+        assert manager.get_api_key("openai") == "sk-1"
+        assert client.calls == 1
+        manager.close()
+
+    def test_refreshes_in_background_before_expiry(self):
+        """Test a key near expiry is served from cache while a refresh runs"""
+        client = FakeSecretsClient({"openai": "sk-1"})
+        clock = FakeClock()
+        manager = self.make_manager(client, clock)
+        manager.get_api_key("openai")
+
+        client.secrets["openai"] = "sk-2"
+        client.release.clear()
+        clock.advance(250)
+        assert manager.get_api_key("openai") == "sk-1"
+
+        client.release.set()
+        manager.close()
+        assert manager.get_api_key("openai") == "sk-2"
+        assert client.calls == 2
+
+    def test_concurrent_loads_share_one_call(self):
+        """Test callers racing on a cold key wait for a single backend call"""
+        client = FakeSecretsClient({"openai": "sk-1"})
+        client.release.clear()
+        manager = self.make_manager(client, FakeClock())
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = [pool.submit(manager.get_api_key, "openai") for _ in range(8)]
+            time.sleep(0.05)
+            client.release.set()
+            assert [result.result() for result in results] == ["sk-1"] * 8
+        assert client.calls == 1
+        manager.close()
+
+    def test_keeps_last_good_value_when_refresh_fails(self):
+        """Test an expired key is still served while the backend is failing"""
+        client = FakeSecretsClient({"openai": "sk-1"})
+        clock = FakeClock()
+        manager = self.make_manager(client, clock)
+        manager.get_api_key("openai")
+
+        client.fail = True
+        clock.advance(301)
+        assert manager.get_api_key("openai") == "sk-1"
+        # Retried only after retry_interval
+        assert manager.get_api_key("openai") == "sk-1"
+        assert client.calls == 2
+
+        client.fail = False
+        client.secrets["openai"] = "sk-2"
+        clock.advance(manager.retry_interval)
+        assert manager.get_api_key("openai") == "sk-2"
+        manager.close()
+
+    def test_missing_secret_returns_none(self):
+        """Test a key that was never loaded returns None when the backend fails"""
+        client = FakeSecretsClient({})
+        client.fail = True
+        manager = self.make_manager(client, FakeClock())
+        assert manager.get_api_key("openai") is None
+        manager.close()
+
+    def test_failed_cold_load_backs_off(self):
+        """Test a key that failed to load is not retried until retry_interval passes"""
+        client = FakeSecretsClient({"openai": "sk-1"})
+        client.fail = True
+        clock = FakeClock()
+        manager = self.make_manager(client, clock)
+
+        assert [manager.get_api_key("openai") for _ in range(5)] == [None] * 5
+        assert client.calls == 1
+
+        client.fail = False
+        clock.advance(manager.retry_interval)
+        assert manager.get_api_key("openai") == "sk-1"
+        assert client.calls == 2
+        manager.close()
+
+    def test_undecryptable_environment_key_raises(self, monkeypatch):
+        """Test a corrupt encrypted environment key raises instead of reading as missing"""
+        manager = SecureKeyManager(ttl=300, refresh_ahead=60, clock=FakeClock())
+        monkeypatch.setenv("TEST_API_KEY", "not-a-fernet-token")
+        with pytest.raises(InvalidToken):
+            manager.get_api_key("TEST_API_KEY")
+        manager.close()
+
+    def test_decrypts_environment_keys_once(self, monkeypatch):
+        """Test encrypted environment keys are decrypted once per TTL"""
+        manager = SecureKeyManager(ttl=300, refresh_ahead=60, clock=FakeClock())
+        monkeypatch.setenv("TEST_API_KEY", manager.fernet.encrypt(b"sk-env").decode())
+        assert manager.get_api_key("TEST_API_KEY") == "sk-env"
+
+        monkeypatch.delenv("TEST_API_KEY")
+        assert manager.get_api_key("TEST_API_KEY") == "sk-env"
+        manager.close()
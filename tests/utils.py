@@ -1,8 +1,12 @@
 # tests/utils.py
 import asyncio
+import os
+import re
 import time
 from typing import Any, Callable, Optional
 from contextlib import contextmanager
+import fakeredis
+import redis.asyncio as aioredis
 
 class TestMetrics:
     def __init__(self):
@@ -37,4 +41,46 @@ def async_test(coro):
     def wrapper(*args, **kwargs):
         loop = asyncio.get_event_loop()
         return loop.run_until_complete(coro(*args, **kwargs))
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def make_redis_client(server: Optional[fakeredis.FakeServer] = None):
+    """Use a local redis-server when REDIS_URL is set, otherwise an in-process fake"""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return aioredis.from_url(redis_url)
+    return fakeredis.FakeAsyncRedis(server=server)
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+class WordEncoder:
+    """Stand-in for a tiktoken encoding: one token per word, space or punctuation mark"""
+
+    PIECES = re.compile(r"\w+|\s+|[^\w\s]")
+
+    def __init__(self):
+        self.ids = {}
+        self.pieces = []
+        self.encode_calls = 0
+        self.encoded_chars = 0
+
+    def encode(self, text: str):
+        self.encode_calls += 1
+        self.encoded_chars += len(text)
+        tokens = []
+        for piece in self.PIECES.findall(text):
+            if piece not in self.ids:
+                self.ids[piece] = len(self.pieces)
+                self.pieces.append(piece)
+            tokens.append(self.ids[piece])
+        return tokens
+
+    def decode(self, tokens) -> str:
+        return "".join(self.pieces[token] for token in tokens)
\ No newline at end of file